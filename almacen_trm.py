@@ -0,0 +1,232 @@
+import argparse
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# ALMACÉN LOCAL (SQLITE) DEL HISTÓRICO DE LA TRM
+# ==============================================================================
+# Las TRM históricas no cambian, así que se guardan en disco por 'vigenciadesde'
+# y solo se consultan en Datos Abiertos las fechas fuera del tramo sincronizado.
+# Ese tramo (tabla 'sincronizacion', una sola fila) es el rango continuo de fechas
+# que ya se descargó completo por rangos; solo lo amplían las descargas por rangos
+# y la siembra desde CSV. Las TRM sueltas que se guardan por fecha (consultas
+# concurrentes o de respaldo) no lo mueven, así que un hueco entre ellas se sigue
+# descargando en la próxima sincronización.
+RUTA_ALMACEN_TRM = os.environ.get(
+    "TRM_ALMACEN",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "trm_historico.sqlite")
+)
+
+
+def _conectar(ruta_almacen):
+    """Abre el almacén y crea la tabla si todavía no existe."""
+    conexion = sqlite3.connect(ruta_almacen, timeout=30)
+    conexion.execute(
+        "CREATE TABLE IF NOT EXISTS trm ("
+        " vigenciadesde TEXT PRIMARY KEY,"
+        " vigenciahasta TEXT,"
+        " valor REAL NOT NULL)"
+    )
+    conexion.execute(
+        "CREATE TABLE IF NOT EXISTS sincronizacion ("
+        " id INTEGER PRIMARY KEY CHECK (id = 1),"
+        " desde TEXT NOT NULL,"
+        " hasta TEXT NOT NULL)"
+    )
+    return conexion
+
+
+def _ampliar_tramo_sincronizado(conexion, desde, hasta):
+    """
+    Une [desde, hasta] al tramo sincronizado si lo toca o se cruza con él (si no,
+    quedaría un hueco sin descargar en medio y el tramo guardado no cambia).
+
+    Returns:
+        tuple: El tramo sincronizado resultante (pandas.Timestamp, pandas.Timestamp).
+    """
+    desde, hasta = pd.Timestamp(desde).normalize(), pd.Timestamp(hasta).normalize()
+    fila = conexion.execute("SELECT desde, hasta FROM sincronizacion WHERE id = 1").fetchone()
+    if fila is not None:
+        desde_actual, hasta_actual = pd.Timestamp(fila[0]), pd.Timestamp(fila[1])
+        if desde > hasta_actual + pd.Timedelta(days=1) or hasta < desde_actual - pd.Timedelta(days=1):
+            return desde_actual, hasta_actual
+        desde, hasta = min(desde, desde_actual), max(hasta, hasta_actual)
+    conexion.execute(
+        "INSERT OR REPLACE INTO sincronizacion (id, desde, hasta) VALUES (1, ?, ?)",
+        (f"{desde:%Y-%m-%d}", f"{hasta:%Y-%m-%d}")
+    )
+    return desde, hasta
+
+
+def guardar_trm_almacen(df_trm, ruta_almacen=RUTA_ALMACEN_TRM, tramo_sincronizado=None):
+    """
+    Inserta (o reemplaza) registros de TRM en el almacén.
+
+    Args:
+        df_trm (pandas.DataFrame): Columnas 'vigenciadesde', 'vigenciahasta' y 'valor'.
+        ruta_almacen (str): Ruta del archivo SQLite.
+        tramo_sincronizado (tuple, optional): (desde, hasta) que df_trm cubre completo
+            (una descarga por rangos); se une al tramo sincronizado en la misma transacción.
+
+    Returns:
+        int: Número de registros guardados.
+    """
+    if df_trm.empty and tramo_sincronizado is None:
+        return 0
+
+    vigenciahasta = pd.to_datetime(df_trm["vigenciahasta"], errors='coerce')
+    registros = list(zip(
+        pd.to_datetime(df_trm["vigenciadesde"]).dt.strftime('%Y-%m-%d'),
+        vigenciahasta.dt.strftime('%Y-%m-%d').where(vigenciahasta.notna(), None),
+        df_trm["valor"].astype(float),
+    ))
+
+    with closing(_conectar(ruta_almacen)) as conexion, conexion:
+        conexion.executemany(
+            "INSERT OR REPLACE INTO trm (vigenciadesde, vigenciahasta, valor) VALUES (?, ?, ?)",
+            registros
+        )
+        if tramo_sincronizado is not None:
+            _ampliar_tramo_sincronizado(conexion, *tramo_sincronizado)
+    return len(registros)
+
+
+def cargar_trm_almacen(fecha_inicio=None, fecha_fin=None, ruta_almacen=RUTA_ALMACEN_TRM):
+    """
+    Lee del almacén las TRM cuya vigencia se cruza con el rango indicado, incluida
+    la publicada antes del rango que sigue vigente en sus primeros días.
+
+    Args:
+        fecha_inicio (datetime, optional): Primera fecha del rango. Sin límite si es None.
+        fecha_fin (datetime, optional): Última fecha del rango. Sin límite si es None.
+        ruta_almacen (str): Ruta del archivo SQLite.
+
+    Returns:
+        pandas.DataFrame: Columnas 'vigenciadesde', 'vigenciahasta' y 'valor', ordenadas por fecha.
+    """
+    consulta = "SELECT vigenciadesde, vigenciahasta, valor FROM trm WHERE 1 = 1"
+    parametros = []
+    if fecha_inicio is not None:
+        consulta += " AND COALESCE(vigenciahasta, vigenciadesde) >= ?"
+        parametros.append(f"{fecha_inicio:%Y-%m-%d}")
+    if fecha_fin is not None:
+        consulta += " AND vigenciadesde <= ?"
+        parametros.append(f"{fecha_fin:%Y-%m-%d}")
+    consulta += " ORDER BY vigenciadesde"
+
+    with closing(_conectar(ruta_almacen)) as conexion:
+        df_trm = pd.read_sql_query(consulta, conexion, params=parametros)
+
+    df_trm["vigenciadesde"] = pd.to_datetime(df_trm["vigenciadesde"])
+    df_trm["vigenciahasta"] = pd.to_datetime(df_trm["vigenciahasta"])
+    df_trm["valor"] = df_trm["valor"].astype(float)
+    return df_trm
+
+
+def rango_almacen(ruta_almacen=RUTA_ALMACEN_TRM):
+    """
+    Devuelve la primera fecha guardada y la última fecha cubierta por alguna
+    vigencia. Entre ellas puede haber huecos (ver rango_sincronizado).
+
+    Returns:
+        tuple: (pandas.Timestamp, pandas.Timestamp) o (None, None) si el almacén está vacío.
+    """
+    with closing(_conectar(ruta_almacen)) as conexion:
+        minima, maxima = conexion.execute("SELECT MIN(vigenciadesde), MAX(COALESCE(vigenciahasta, vigenciadesde)) FROM trm").fetchone()
+
+    if minima is None:
+        return None, None
+    return pd.Timestamp(minima), pd.Timestamp(maxima)
+
+
+def rango_sincronizado(ruta_almacen=RUTA_ALMACEN_TRM):
+    """
+    Devuelve el tramo continuo de fechas que ya se descargó completo por rangos.
+
+    Returns:
+        tuple: (pandas.Timestamp, pandas.Timestamp) o (None, None) si todavía no hay
+            ninguno (almacén nuevo o creado por una versión anterior).
+    """
+    with closing(_conectar(ruta_almacen)) as conexion:
+        fila = conexion.execute("SELECT desde, hasta FROM sincronizacion WHERE id = 1").fetchone()
+
+    if fila is None:
+        return None, None
+    return pd.Timestamp(fila[0]), pd.Timestamp(fila[1])
+
+
+def sembrar_desde_csv(ruta_csv, ruta_almacen=RUTA_ALMACEN_TRM):
+    """
+    Carga en el almacén una descarga CSV del recurso mcec-87by de Datos Abiertos,
+    para poder trabajar sin conexión. El último tramo del CSV en el que cada vigencia
+    empieza a más tardar el día siguiente al fin de la anterior se marca como sincronizado.
+
+    Args:
+        ruta_csv (str): Ruta del CSV exportado (columnas VALOR, VIGENCIADESDE, VIGENCIAHASTA).
+        ruta_almacen (str): Ruta del archivo SQLite.
+
+    Returns:
+        int: Número de registros guardados.
+    """
+    df_csv = pd.read_csv(ruta_csv, dtype=str)
+    # La exportación de Socrata usa los nombres en mayúsculas; la API, en minúsculas
+    df_csv.columns = [str(col).strip().lower() for col in df_csv.columns]
+
+    columnas_requeridas = ["valor", "vigenciadesde", "vigenciahasta"]
+    columnas_faltantes = [col for col in columnas_requeridas if col not in df_csv.columns]
+    if columnas_faltantes:
+        raise ValueError(f"El CSV no tiene las columnas requeridas: {', '.join(columnas_faltantes)}")
+
+    df_trm = pd.DataFrame({
+        "vigenciadesde": pd.to_datetime(df_csv["vigenciadesde"], format='mixed', errors='coerce').dt.normalize(),
+        "vigenciahasta": pd.to_datetime(df_csv["vigenciahasta"], format='mixed', errors='coerce').dt.normalize(),
+        "valor": pd.to_numeric(df_csv["valor"].str.replace(',', '', regex=False), errors='coerce'),
+    }).dropna(subset=["vigenciadesde", "valor"]).sort_values("vigenciadesde")
+    if df_trm.empty:
+        return 0
+
+    cobertura = df_trm["vigenciahasta"].fillna(df_trm["vigenciadesde"]).cummax()
+    huecos = np.flatnonzero(
+        df_trm["vigenciadesde"].to_numpy()[1:] > (cobertura + pd.Timedelta(days=1)).to_numpy()[:-1]
+    )
+    inicio_continuo = df_trm["vigenciadesde"].iloc[huecos[-1] + 1 if len(huecos) else 0]
+    return guardar_trm_almacen(df_trm, ruta_almacen, tramo_sincronizado=(inicio_continuo, cobertura.iloc[-1]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Administra el almacén local del histórico de la TRM.")
+    parser.add_argument("--almacen", default=RUTA_ALMACEN_TRM, help="Ruta del archivo SQLite del almacén.")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    parser_sembrar = subcomandos.add_parser("sembrar", help="Carga un CSV descargado de Datos Abiertos (mcec-87by).")
+    parser_sembrar.add_argument("ruta_csv", help="Ruta del archivo CSV.")
+
+    parser_sincronizar = subcomandos.add_parser("sincronizar", help="Descarga las TRM que faltan en el tramo sincronizado.")
+    parser_sincronizar.add_argument("--desde", help="Fecha inicial (YYYY-MM-DD) si el almacén está vacío.", default="1991-11-27")
+
+    subcomandos.add_parser("info", help="Muestra el rango de fechas guardado.")
+
+    argumentos = parser.parse_args()
+
+    if argumentos.comando == "sembrar":
+        total = sembrar_desde_csv(argumentos.ruta_csv, argumentos.almacen)
+        print(f"Se guardaron {total} registros de TRM en '{argumentos.almacen}'.")
+    elif argumentos.comando == "sincronizar":
+        from trm_datos_abiertos import sincronizar_almacen_trm
+        total = sincronizar_almacen_trm(pd.Timestamp.today().normalize(), pd.Timestamp(argumentos.desde), ruta_almacen=argumentos.almacen)
+        print(f"Se descargaron {total} registros nuevos de TRM.")
+
+    fecha_minima, fecha_maxima = rango_almacen(argumentos.almacen)
+    if fecha_minima is None:
+        print("El almacén está vacío.")
+    else:
+        print(f"El almacén contiene TRM desde {fecha_minima:%Y-%m-%d} hasta {fecha_maxima:%Y-%m-%d}.")
+        desde_sincronizado, hasta_sincronizado = rango_sincronizado(argumentos.almacen)
+        if desde_sincronizado is None:
+            print("Todavía no hay un tramo sincronizado por rangos.")
+        else:
+            print(f"Tramo sincronizado sin huecos: {desde_sincronizado:%Y-%m-%d} a {hasta_sincronizado:%Y-%m-%d}.")
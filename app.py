@@ -1,46 +1,28 @@
 import pandas as pd
-import requests
 from datetime import datetime
-import time # Para añadir un pequeño retraso entre peticiones a la API
+from trm_datos_abiertos import URL_BASE_TRM, obtener_trm_por_fechas, rellenar_tasa_de_cambio
 
 # --- Tu función para obtener la TRM ---
-def get_trm_from_datos_abiertos(date_str):
+def get_trm_from_datos_abiertos(date_str, base_url=URL_BASE_TRM):
     """
     Consulta la TRM desde la API de Datos Abiertos Colombia (Socrata).
 
     Args:
         date_str (str): La fecha en formato 'YYYY-MM-DD'.
+        base_url (str): URL del recurso mcec-87by (permite usar un servidor local).
 
     Returns:
         float or None: El valor de la TRM, o None si no se encuentra o hay un error.
     """
-    BASE_URL = "https://www.datos.gov.co/resource/mcec-87by.json"
-    params = {
-        "vigenciadesde": f"{date_str}T00:00:00.000"
-    }
-
-    try:
-        response = requests.get(BASE_URL, params=params, timeout=10) # Añadir un timeout
-        response.raise_for_status()
-
-        data = response.json()
-
-        if data:
-            return float(data[0].get('valor'))
-        else:
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error de conexión o HTTP al consultar Datos Abiertos para {date_str}: {e}")
-        return None
-    except (ValueError, IndexError, TypeError) as e:
-        print(f"Error al parsear o acceder a los datos de la TRM para {date_str}: {e}")
-        return None
-    except Exception as e:
-        print(f"Error inesperado al consultar Datos Abiertos para {date_str}: {e}")
+    # La TRM se resuelve por vigencia, así que los fines de semana y festivos
+    # reciben la TRM publicada el día hábil anterior
+    trm_por_fecha = obtener_trm_por_fechas([date_str], base_url=base_url)
+    if trm_por_fecha.empty:
         return None
+    return float(trm_por_fecha.iloc[0])
 
 
-def procesar_y_guardar_excel_completo(ruta_archivo_entrada, nombres_columnas_a_eliminar, ruta_archivo_salida):
+def procesar_y_guardar_excel_completo(ruta_archivo_entrada, nombres_columnas_a_eliminar, ruta_archivo_salida, url_base_trm=URL_BASE_TRM):
     """
     Lee un archivo de Excel, elimina filas con 'Tipo clasificación' vacío,
     elimina múltiples columnas, actualiza la columna 'Total',
@@ -51,6 +33,7 @@ def procesar_y_guardar_excel_completo(ruta_archivo_entrada, nombres_columnas_a_e
         ruta_archivo_entrada (str): La ruta completa al archivo de Excel original.
         nombres_columnas_a_eliminar (list): Una lista con los nombres de las columnas que se desean eliminar.
         ruta_archivo_salida (str): La ruta completa donde se guardará el nuevo archivo de Excel.
+        url_base_trm (str): URL del recurso mcec-87by (permite usar un servidor local).
     """
     try:
         # Leer el archivo de Excel
@@ -94,28 +77,15 @@ def procesar_y_guardar_excel_completo(ruta_archivo_entrada, nombres_columnas_a_e
         if "Tasa de cambio" in df_procesado.columns and "Fecha elaboración" in df_procesado.columns:
             print("Iniciando el proceso de rellenado de 'Tasa de cambio'...")
             
-            # Convertir "Fecha elaboración" a formato de fecha de Pandas y luego a datetime para manipularla
-            df_procesado['Fecha elaboración_dt'] = pd.to_datetime(df_procesado['Fecha elaboración'], format='%d/%m/%Y', errors='coerce')
-
-            # Iterar sobre las filas del DataFrame para buscar y aplicar la TRM
-            for index, row in df_procesado.iterrows():
-                tasa_actual = row["Tasa de cambio"]
-                fecha_elaboracion_dt = row["Fecha elaboración_dt"]
-
-                if (pd.isna(tasa_actual) or tasa_actual == 0) and pd.notna(fecha_elaboracion_dt):
-                    fecha_str_api = fecha_elaboracion_dt.strftime('%Y-%m-%d')
-                    print(f"Buscando TRM para la fecha: {fecha_str_api} (Fila {index})...")
-                    trm_valor = get_trm_from_datos_abiertos(fecha_str_api)
-
-                    if trm_valor is not None:
-                        df_procesado.at[index, "Tasa de cambio"] = trm_valor
-                        print(f"  > TRM encontrada: {trm_valor}")
-                    else:
-                        print(f"  > No se pudo obtener TRM para {fecha_str_api}. La celda permanecerá sin cambios.")
-                    
-                    time.sleep(0.1) # Pequeña pausa para no sobrecargar la API
-
-            df_procesado = df_procesado.drop(columns=['Fecha elaboración_dt'])
+            # Una consulta por rango de fechas y una asignación por columna, sin recorrer las filas
+            resumen_trm = rellenar_tasa_de_cambio(
+                df_procesado,
+                resolver_trm=lambda fechas: obtener_trm_por_fechas(fechas, base_url=url_base_trm)
+            )
+            print(f"  > Fechas distintas consultadas: {resumen_trm['fechas_consultadas']}. Filas rellenadas con TRM: {resumen_trm['filas_rellenadas']}")
+            if resumen_trm['filas_sin_trm']:
+                print(f"  > No se pudo obtener TRM para {resumen_trm['filas_sin_trm']} filas. Esas celdas permanecerán sin cambios.")
+
             print("Proceso de rellenado de 'Tasa de cambio' completado.")
         else:
             print("Advertencia: No se encontraron las columnas 'Tasa de cambio' y/o 'Fecha elaboración'. No se buscó la TRM.")
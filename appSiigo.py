@@ -1,49 +1,20 @@
 import streamlit as st
 import pandas as pd
-import requests
 from datetime import datetime
-import time
 import io
+from trm_datos_abiertos import URL_BASE_TRM, obtener_trm_por_fechas, rellenar_tasa_de_cambio
 
-# --- Tu función para obtener la TRM (sin cambios mayores) ---
-@st.cache_data(ttl=3600) # Almacena en caché los resultados de la TRM por 1 hora para evitar peticiones repetidas
-def get_trm_from_datos_abiertos(date_str):
+@st.cache_data(ttl=3600)
+def obtener_trm_por_fechas_cacheado(fechas, base_url=URL_BASE_TRM, _progreso=None):
     """
-    Consulta la TRM desde la API de Datos Abiertos Colombia (Socrata).
-
-    Args:
-        date_str (str): La fecha en formato 'YYYY-MM-DD'.
-
-    Returns:
-        float or None: El valor de la TRM, o None si no se encuentra o hay un error.
+    Versión en caché de obtener_trm_por_fechas. Recibe una tupla de fechas
+    'YYYY-MM-DD' para que Streamlit pueda usarla como llave de la caché
+    (el callback de progreso no forma parte de la llave).
     """
-    BASE_URL = "https://www.datos.gov.co/resource/mcec-87by.json"
-    params = {
-        "vigenciadesde": f"{date_str}T00:00:00.000"
-    }
-
-    try:
-        response = requests.get(BASE_URL, params=params, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
-
-        if data:
-            return float(data[0].get('valor'))
-        else:
-            return None
-    except requests.exceptions.RequestException as e:
-        # st.warning(f"Error de conexión o HTTP al consultar Datos Abiertos para {date_str}: {e}")
-        return None
-    except (ValueError, IndexError, TypeError) as e:
-        # st.warning(f"Error al parsear o acceder a los datos de la TRM para {date_str}: {e}")
-        return None
-    except Exception as e:
-        # st.warning(f"Error inesperado al consultar Datos Abiertos para {date_str}: {e}")
-        return None
+    return obtener_trm_por_fechas(fechas, base_url=base_url, progreso=_progreso)
 
 # --- Función Principal de Procesamiento (adaptada para Streamlit) ---
-def procesar_excel_para_streamlit(uploaded_file):
+def procesar_excel_para_streamlit(uploaded_file, url_base_trm=URL_BASE_TRM):
     """
     Procesa el archivo de Excel subido:
     - Elimina filas con 'Tipo clasificación' vacío.
@@ -53,6 +24,7 @@ def procesar_excel_para_streamlit(uploaded_file):
 
     Args:
         uploaded_file (streamlit.UploadedFile): El archivo Excel subido por el usuario.
+        url_base_trm (str): URL del recurso mcec-87by (permite usar un servidor local).
 
     Returns:
         pandas.DataFrame or None: El DataFrame procesado o None si hay un error.
@@ -109,35 +81,28 @@ def procesar_excel_para_streamlit(uploaded_file):
         if "Tasa de cambio" in df_procesado.columns and "Fecha elaboración" in df_procesado.columns:
             st.info("Iniciando el proceso de rellenado de **'Tasa de cambio'** con TRM desde Datos Abiertos...")
             
-            # Convertir "Fecha elaboración" a formato de fecha de Pandas y luego a datetime
-            df_procesado['Fecha elaboración_dt'] = pd.to_datetime(df_procesado['Fecha elaboración'], format='%d/%m/%Y', errors='coerce')
-
             trm_placeholder = st.empty() # Placeholder para mostrar el progreso de la TRM
-            total_trm_consultas = 0
-            
-            # Iterar sobre las filas del DataFrame para buscar y aplicar la TRM
-            for index, row in df_procesado.iterrows():
-                tasa_actual = row["Tasa de cambio"]
-                fecha_elaboracion_dt = row["Fecha elaboración_dt"]
-
-                if (pd.isna(tasa_actual) or tasa_actual == 0) and pd.notna(fecha_elaboracion_dt):
-                    fecha_str_api = fecha_elaboracion_dt.strftime('%Y-%m-%d')
-                    trm_placeholder.text(f"Buscando TRM para la fecha: {fecha_str_api} (Fila {index})...")
-                    trm_valor = get_trm_from_datos_abiertos(fecha_str_api)
-                    total_trm_consultas +=1 # Conteo de las consultas realizadas
-
-                    if trm_valor is not None:
-                        df_procesado.at[index, "Tasa de cambio"] = trm_valor
-                        trm_placeholder.text(f"TRM encontrada: {trm_valor} para {fecha_str_api}. (Fila {index})")
-                    else:
-                        trm_placeholder.warning(f"No se pudo obtener TRM para {fecha_str_api}. La celda permanecerá sin cambios.")
-                    
-                    time.sleep(0.05) # Pequeña pausa para no sobrecargar la API
+            trm_placeholder.text("Buscando TRM para las fechas sin tasa de cambio...")
+
+            # Progreso agregado de las fechas que haya que consultar una por una
+            def mostrar_progreso_trm(completadas, total):
+                trm_placeholder.progress(completadas / total, text=f"Consultando TRM: {completadas}/{total} fechas...")
+
+            # Una consulta por rango de fechas y una asignación por columna, sin recorrer las filas
+            resumen_trm = rellenar_tasa_de_cambio(
+                df_procesado,
+                resolver_trm=lambda fechas: obtener_trm_por_fechas_cacheado(
+                    tuple(pd.DatetimeIndex(fechas).strftime('%Y-%m-%d')), base_url=url_base_trm, _progreso=mostrar_progreso_trm
+                )
+            )
+            total_trm_consultas = resumen_trm['fechas_consultadas']
+
+            if resumen_trm['filas_sin_trm']:
+                st.warning(f"No se pudo obtener TRM para **{resumen_trm['filas_sin_trm']}** filas. Esas celdas permanecerán sin cambios.")
 
             # Limpiar el placeholder de TRM
             trm_placeholder.empty()
-            df_procesado.drop(columns=['Fecha elaboración_dt'], inplace=True)
-            st.success(f"Proceso de rellenado de **'Tasa de cambio'** completado. Total de consultas TRM: **{total_trm_consultas}**.")
+            st.success(f"Proceso de rellenado de **'Tasa de cambio'** completado. Fechas TRM consultadas: **{total_trm_consultas}**.")
         else:
             st.warning("Advertencia: No se encontraron las columnas **'Tasa de cambio'** y/o **'Fecha elaboración'**. No se buscó la TRM.")
 
@@ -1,18 +1,28 @@
 import streamlit as st
 import pandas as pd
 import io
+import os
+import tempfile
 import numpy as np
 import locale
 from datetime import datetime
 import requests
 from msal import ConfidentialClientApplication
 import zipfile
-import openpyxl
-from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.worksheet.table import TableColumn
 from openpyxl.utils import get_column_letter
 from pandas.api.types import is_object_dtype
 
+from escritor_graph import URL_GRAPH, anexar_filas_graph
+from escritor_xlsx import anexar_filas, nombres_hojas, reescribir_filas
+from huellas_filas import huellas_filas, marcar_repetidos, normalizar_columna, normalizar_filas
+from subida_sharepoint import archivo_temporal_subida, subir_archivo_sharepoint
+from indice_huellas import cargar_indice_huellas, etag_respuesta, guardar_indice_huellas, obtener_etag
+from lector_siigo import EncabezadoNoEncontrado
+from mapeo_trm import formulas_trm, mapear_filas_trm
+from pipeline_siigo import COLUMNAS_A_ELIMINAR, ejecutar_pipeline
+from pendientes_siigo import RUTA_PENDIENTES_SIIGO
+
 # ==============================================================================
 # CONFIGURACIÓN DE SHAREPOINT Y AZURE
 # ==============================================================================
@@ -22,6 +32,14 @@ TENANT_ID = "f20cbde7-1c45-44a0-89c5-63a25c557ef8"
 SHAREPOINT_HOSTNAME = "iacsas.sharepoint.com"
 SITE_NAME = "PruebasProyectosSantiago"
 RUTA_CARPETA_VENTAS_MENSUALES = "Ventas con ciudad 2025"
+# Cómo se añaden las filas nuevas a los libros de SharePoint:
+# "archivo": se descarga el .xlsx, se editan sus filas y se sube completo (escritor_xlsx.py).
+# "graph": solo las filas nuevas se envían a la Tabla de Excel con la API de libros
+#          (escritor_graph.py); si la hoja no tiene Tabla se usa "archivo".
+ESCRITOR_SHAREPOINT = os.environ.get("SIIGO_ESCRITOR_SHAREPOINT", "archivo")
+# Las descargas se escriben por bloques a un archivo temporal que pasa a disco por encima de este tamaño
+BLOQUE_DESCARGA = 1024 * 1024
+MAX_MEMORIA_DESCARGA = 32 * 1024 * 1024
 # ==============================================================================
 # FUNCIONES DE AUTENTICACIÓN Y CONEXIÓN
 # ==============================================================================
@@ -29,6 +47,17 @@ AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 SCOPES = ["https://graph.microsoft.com/.default"]
 
 
+def columnas_formula_trm(columnas_destino):
+    """Columnas de la hoja "Datos" del TRM que llevan fórmulas (D, AJ y AK)."""
+    return [columnas_destino[i] for i in sorted(formulas_trm()) if len(columnas_destino) > i]
+
+
+def columnas_huella_trm(columnas_destino):
+    """Columnas que definen un registro repetido en el TRM (todas menos las de fórmula)."""
+    cols_formula_a_ignorar = columnas_formula_trm(columnas_destino)
+    return [col for col in columnas_destino if col not in cols_formula_a_ignorar]
+
+
 def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesados, status_placeholder):
     """
     Actualiza la hoja "Datos" del TRM.xlsx añadiendo solo nuevas filas ÚNICAS
@@ -40,47 +69,52 @@ def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesad
     """
     nombre_hoja_destino = "Datos"
     status_placeholder.info(f"🔄 Iniciando actualización (modo apéndice) de la hoja '{nombre_hoja_destino}'...")
+    archivo_trm = None
 
     try:
-        # PASO 1: Descargar el archivo
-        status_placeholder.info("1/7 - Descargando archivo TRM...")
-        contenido_trm_bytes = obtener_contenido_archivo_sharepoint(headers, site_id, ruta_archivo_trm)
-        if contenido_trm_bytes is None: return False
+        # PASO 1: Descargar el archivo (o solo su índice de huellas, si sigue vigente)
+        # Con un índice vigente (ver indice_huellas.py) no se leen las filas del TRM: el
+        # libro solo se descarga si hay filas nuevas que añadir.
+        etag_trm = obtener_etag(headers, site_id, ruta_archivo_trm)
+        indice = cargar_indice_huellas(headers, site_id, ruta_archivo_trm, etag_trm)
+        if indice is not None and indice["columnas_huella"] != columnas_huella_trm(indice["columnas"]):
+            indice = None  # Calculado con otras columnas: se reconstruye desde el libro
+        if indice is not None:
+            status_placeholder.info(f"1/7 - Índice de huellas vigente: {len(indice['huellas'])} registros existentes, sin descargar el TRM.")
+            columnas_destino = indice["columnas"]
+        else:
+            status_placeholder.info("1/7 - Descargando archivo TRM...")
+            # Un solo archivo temporal (descarga en streaming) para read_excel y para añadir
+            archivo_trm = descargar_archivo_sharepoint(headers, site_id, ruta_archivo_trm)
+            if archivo_trm is None: return False
 
         # ==============================================================================
         # PASO 2: LEER DATOS EXISTENTES Y PREPARAR DATOS NUEVOS
         # ==============================================================================
-        status_placeholder.info("2/7 - Leyendo datos existentes para deduplicación...")
-        
-        libro_temp = openpyxl.load_workbook(io.BytesIO(contenido_trm_bytes))
-        if nombre_hoja_destino not in libro_temp.sheetnames:
-            status_placeholder.error(f"❌ No se encontró la hoja '{nombre_hoja_destino}'.")
-            return False
-        
-        hoja_temp = libro_temp[nombre_hoja_destino]
-        columnas_destino = [cell.value for cell in hoja_temp[1] if cell.value is not None]
-        num_encabezados = len(columnas_destino)
-
-        col_d_nombre = None
-        col_aj_nombre = None
-        col_ak_nombre = None
-
-        if len(columnas_destino) > 3:
-            col_d_nombre = columnas_destino[3] # Col D (índice 3)
-        if len(columnas_destino) > 35:
-            col_aj_nombre = columnas_destino[35] # Col AJ (índice 35)
-        if len(columnas_destino) > 36:
-            col_ak_nombre = columnas_destino[36] # Col AK (índice 36)
-        
-        cols_formula_a_ignorar = [col for col in [col_d_nombre, col_aj_nombre, col_ak_nombre] if col is not None]
+        # Encabezados y filas salen de una sola lectura en modo read_only (la que hace
+        # pd.read_excel); el libro completo con estilos y tablas solo se carga en el
+        # PASO 6, y únicamente si hay filas que añadir (ver benchmark_lectura_trm.py).
+        if indice is not None:
+            # Los diagnósticos que necesitan las filas existentes se omiten
+            df_existente = pd.DataFrame(columns=columnas_destino)
+        else:
+            status_placeholder.info("2/7 - Leyendo datos existentes para deduplicación...")
+            try:
+                archivo_trm.seek(0)
+                df_existente = pd.read_excel(archivo_trm, sheet_name=nombre_hoja_destino, engine='openpyxl')
+            except ValueError:
+                status_placeholder.error(f"❌ No se encontró la hoja '{nombre_hoja_destino}'.")
+                return False
+            df_existente.reset_index(drop=True, inplace=True)
+            # Celdas de encabezado vacías ('Unnamed: i') no son columnas del TRM
+            columnas_destino = [col for col in df_existente.columns if not str(col).startswith('Unnamed:')]
+            df_existente.columns = columnas_destino[:len(df_existente.columns)]
+
+        cols_formula_a_ignorar = columnas_formula_trm(columnas_destino)
         
         if cols_formula_a_ignorar:
             status_placeholder.info(f"Deduplicación ignorará columnas de fórmula: {', '.join(cols_formula_a_ignorar)}")
 
-        df_existente = pd.read_excel(io.BytesIO(contenido_trm_bytes), sheet_name=nombre_hoja_destino, engine='openpyxl')
-        df_existente.reset_index(drop=True, inplace=True)
-        df_existente.columns = columnas_destino[:len(df_existente.columns)]
-
 
         status_placeholder.info(f"3/7 - Preparando {len(df_datos_procesados)} nuevos registros...")
         
@@ -98,26 +132,8 @@ def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesad
         
         status_placeholder.info(f"Usando fecha: Año {anio}, Mes {mes}")
 
-        nuevas_filas_list_of_dicts = []
-        for index, fila_procesada in df_datos_procesados.iterrows():
-            nueva_fila_dict = {col: "" for col in columnas_destino}
-            
-            if len(columnas_destino) > 0: nueva_fila_dict[columnas_destino[0]] = anio
-            if len(columnas_destino) > 1: nueva_fila_dict[columnas_destino[1]] = mes
-            if len(columnas_destino) > 2: nueva_fila_dict[columnas_destino[2]] = "Colombia"
-            
-            for i, valor in enumerate(fila_procesada.values):
-                col_index_destino = i + 4 
-                if col_index_destino < num_encabezados:
-                    nueva_fila_dict[columnas_destino[col_index_destino]] = valor
-            
-            nuevas_filas_list_of_dicts.append(nueva_fila_dict)
-
-        if nuevas_filas_list_of_dicts:
-            df_nuevos_mapeados = pd.DataFrame(nuevas_filas_list_of_dicts)
-            df_nuevos_mapeados = df_nuevos_mapeados[columnas_destino] 
-        else:
-            df_nuevos_mapeados = pd.DataFrame(columns=columnas_destino)
+        # Cada columna del TRM se llena por su letra según MAPEO_COLUMNAS_TRM (ver mapeo_trm.py)
+        df_nuevos_mapeados = mapear_filas_trm(df_datos_procesados, columnas_destino, anio, mes)
 
         # ==============================================================================
         # PASO 3: DIAGNÓSTICO VISUAL DE TIPOS DE DATOS
@@ -125,7 +141,9 @@ def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesad
         status_placeholder.info("🔍 DIAGNÓSTICO: Comparando tipos de datos...")
         
         st.write("### 📊 TIPOS DE DATOS - ARCHIVO TRM EXISTENTE (Fila 2 / Índice 0)")
-        if len(df_existente) > 0:
+        if indice is not None:
+            st.info("ℹ️ Registros existentes tomados del índice de huellas: no se leyeron las filas del TRM.")
+        elif len(df_existente) > 0:
             tipos_existente = {}
             for col in df_existente.columns:
                 valor = df_existente.iloc[0][col]
@@ -172,39 +190,21 @@ def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesad
         # ==============================================================================
         # PASO 4: LÓGICA DE DEDUPLICACIÓN
         # ==============================================================================
+        # Cada fila se resume en una huella de 64 bits (ver huellas_filas.py) y los
+        # registros nuevos se buscan en el conjunto de huellas del histórico, sin
+        # concatenar ni convertir a texto todo el histórico.
         status_placeholder.info(f"4/7 - Ejecutando lógica de deduplicación (ignorando columnas de fórmula)...")
-        
-        df_existente['__source__'] = 'existente'
-        df_nuevos_mapeados['__source__'] = 'nuevo'
 
-        df_combinado = pd.concat([df_existente, df_nuevos_mapeados], ignore_index=True)
-        
-        df_temp_string = df_combinado.copy()
-        
-        cols_to_normalize = [
-            col for col in df_temp_string.columns 
-            if col != '__source__' and col not in cols_formula_a_ignorar
-        ]
+        cols_to_normalize = columnas_huella_trm(columnas_destino)
 
-        for col in cols_to_normalize:
-            try:
-                if df_temp_string[col].dtype in ['float64', 'float32', 'int64', 'int32']:
-                    df_temp_string[col] = df_temp_string[col].round(2)
-            except:
-                pass 
-            
-            df_temp_string[col] = (
-                df_temp_string[col]
-                .fillna('')
-                .astype(str)
-                .str.replace(r'\.0+$', '', regex=True) 
-                .str.replace('None', '', regex=False)  
-                .str.strip()
-            )
-        
-        mascara_duplicados = df_temp_string.duplicated(subset=cols_to_normalize, keep='first')
-        
-        duplicados_encontrados_en_nuevos = mascara_duplicados[df_combinado['__source__'] == 'nuevo'].sum()
+        if indice is not None:
+            huellas_existentes = indice["huellas"]
+        else:
+            huellas_existentes = huellas_filas(df_existente, cols_to_normalize)
+        huellas_nuevas = huellas_filas(df_nuevos_mapeados, cols_to_normalize)
+        mascara_duplicados = marcar_repetidos(huellas_existentes, huellas_nuevas)
+
+        duplicados_encontrados_en_nuevos = int(mascara_duplicados.sum())
         if duplicados_encontrados_en_nuevos > 0:
             status_placeholder.warning(f"⚠️ Se encontraron {duplicados_encontrados_en_nuevos} registros nuevos que ya existían y serán omitidos.")
         else:
@@ -217,108 +217,96 @@ def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesad
             st.write("### 🔍 INVESTIGANDO REGISTROS NO DETECTADOS COMO DUPLICADOS (EN TRM)")
             
             inicio_nuevos = len(df_existente)
-            registros_nuevos_no_duplicados = sum(~mascara_duplicados[inicio_nuevos:])
+            registros_nuevos_no_duplicados = int((~mascara_duplicados).sum())
             
             st.warning(f"⚠️ De {len(df_nuevos_mapeados)} registros nuevos, {registros_nuevos_no_duplicados} NO fueron detectados como duplicados y se añadirán.")
             
             if registros_nuevos_no_duplicados > 0 and duplicados_encontrados_en_nuevos > 0:
                 st.info("Esto significa que ALGUNOS se detectaron y OTROS NO. Investigando diferencias...")
                 
-                indices_nuevos_no_detectados = [i for i in range(inicio_nuevos, len(df_combinado)) if not mascara_duplicados[i]]
-                
-                if indices_nuevos_no_detectados:
-                    indice_problema = indices_nuevos_no_detectados[0]
-                    
-                    st.write(f"#### Analizando registro en índice {indice_problema} (NO detectado como duplicado)")
-                    
-                    col_key_nombre = None
-                    if len(columnas_destino) > 10:
-                        col_key_nombre = columnas_destino[10] # Columna K (Código)
-                    
-                    if col_key_nombre is None or col_key_nombre not in df_temp_string.columns:
-                        st.warning("No se pudo identificar la columna 'Código' (K) para buscar gemelos.")
-                    else:
-                        codigo_buscar = df_temp_string.iloc[indice_problema][col_key_nombre]
-                        st.write(f"Buscando en registros existentes con '{col_key_nombre}': **{codigo_buscar}**")
-                        
-                        posible_gemelo = None
-                        for i in range(inicio_nuevos):
-                            if df_temp_string.iloc[i][col_key_nombre] == codigo_buscar:
-                                posible_gemelo = i
-                                break
-                        
-                        if posible_gemelo is not None:
-                            st.success(f"✅ Encontrado posible gemelo en índice {posible_gemelo}")
-                            
-                            diferencias_detalladas = []
-                            for col in [c for c in df_temp_string.columns if c != '__source__']:
-                                val_existente = df_temp_string.iloc[posible_gemelo][col]
-                                val_nuevo = df_temp_string.iloc[indice_problema][col]
-                                
-                                # Convertimos a string aquí para la comparación de texto
-                                val_existente_str = str(val_existente)
-                                val_nuevo_str = str(val_nuevo)
-                                
-                                # --- INICIO DE LA CORRECCIÓN ---
-                                # Normalizamos los valores de la misma forma que en la deduplicación
-                                # para la comparación visual, PERO lo hacemos con str() primero
-                                # para evitar el error len(float)
-                                
-                                if col in cols_to_normalize:
-                                    # Si es una columna normalizada, aplicamos las reglas de string
-                                    val_existente_str = val_existente_str.replace('.0', '').strip()
-                                    val_nuevo_str = val_nuevo_str.replace('.0', '').strip()
-                                # Si no, simplemente usamos la conversión a str()
-                                # --- FIN DE LA CORRECCIÓN PARCIAL ---
-
-
-                                if val_existente_str != val_nuevo_str:
-                                    fue_ignorada = "SÍ (Fórmula)" if col in cols_formula_a_ignorar else "NO"
-                                    
-                                    # --- INICIO DE LA CORRECCIÓN FINAL ---
-                                    # Usamos str(val_existente) y str(val_nuevo) para el len()
-                                    diferencias_detalladas.append({
-                                        'Columna': col,
-                                        'Valor Existente': f'"{val_existente_str}" (len={len(val_existente_str)})',
-                                        'Valor Nuevo': f'"{val_nuevo_str}" (len={len(val_nuevo_str)})',
-                                        'Ignorada en Dedupl.': fue_ignorada
-                                    })
-                                    # --- FIN DE LA CORRECCIÓN FINAL ---
-                            
-                            if diferencias_detalladas:
-                                st.error(f"❌ Encontradas {len(diferencias_detalladas)} columnas diferentes (comparando como texto):")
-                                st.dataframe(pd.DataFrame(diferencias_detalladas))
-                                
-                                st.write("#### Valores ORIGINALES (con tipos de datos originales):")
-                                diferencias_originales = []
-                                for diff in diferencias_detalladas:
-                                    col_name = diff['Columna']
-                                    val_orig_existente = df_combinado.iloc[posible_gemelo][col_name]
-                                    val_orig_nuevo = df_combinado.iloc[indice_problema][col_name]
-                                    
-                                    diferencias_originales.append({
-                                        'Columna': col_name,
-                                        'Valor Existente': val_orig_existente,
-                                        'Tipo Existente': type(val_orig_existente).__name__,
-                                        'Valor Nuevo': val_orig_nuevo,
-                                        'Tipo Nuevo': type(val_orig_nuevo).__name__
-                                    })
-                                st.dataframe(pd.DataFrame(diferencias_originales))
-                                
+                # Posición (entre los nuevos) del primer registro que no se detectó como duplicado
+                posicion_problema = int(np.flatnonzero(~mascara_duplicados)[0])
+                indice_problema = inicio_nuevos + posicion_problema
+
+                st.write(f"#### Analizando registro en índice {indice_problema} (NO detectado como duplicado)")
+
+                col_key_nombre = None
+                if len(columnas_destino) > 10:
+                    col_key_nombre = columnas_destino[10] # Columna K (Código)
+
+                df_nuevos_normalizados = normalizar_filas(df_nuevos_mapeados, cols_to_normalize)
+                if indice is not None:
+                    st.info("ℹ️ Registros existentes tomados del índice de huellas: no se buscan gemelos en el TRM.")
+                elif col_key_nombre is None or col_key_nombre not in df_nuevos_normalizados.columns:
+                    st.warning("No se pudo identificar la columna 'Código' (K) para buscar gemelos.")
+                else:
+                    fila_nueva = df_nuevos_normalizados.iloc[posicion_problema]
+                    codigo_buscar = fila_nueva[col_key_nombre]
+                    st.write(f"Buscando en registros existentes con '{col_key_nombre}': **{codigo_buscar}**")
+
+                    # Solo se normaliza la columna clave del histórico para buscar el gemelo
+                    coincidencias = np.array([], dtype=int)
+                    if col_key_nombre in df_existente.columns:
+                        coincidencias = np.flatnonzero(normalizar_columna(df_existente[col_key_nombre]).to_numpy() == codigo_buscar)
+                    posible_gemelo = int(coincidencias[0]) if len(coincidencias) else None
+
+                    if posible_gemelo is not None:
+                        st.success(f"✅ Encontrado posible gemelo en índice {posible_gemelo}")
+
+                        fila_gemela = normalizar_filas(df_existente.iloc[[posible_gemelo]], cols_to_normalize).iloc[0]
+                        diferencias_detalladas = []
+                        for col in columnas_destino:
+                            if col in cols_to_normalize:
+                                val_existente_str = fila_gemela[col]
+                                val_nuevo_str = fila_nueva[col]
                             else:
-                                st.success("✅ No se encontraron diferencias en la comparación de texto.")
+                                val_existente_str = str(df_existente.iloc[posible_gemelo][col]) if col in df_existente.columns else ''
+                                val_nuevo_str = str(df_nuevos_mapeados.iloc[posicion_problema][col])
+
+                            if val_existente_str != val_nuevo_str:
+                                fue_ignorada = "SÍ (Fórmula)" if col in cols_formula_a_ignorar else "NO"
+                                diferencias_detalladas.append({
+                                    'Columna': col,
+                                    'Valor Existente': f'"{val_existente_str}" (len={len(val_existente_str)})',
+                                    'Valor Nuevo': f'"{val_nuevo_str}" (len={len(val_nuevo_str)})',
+                                    'Ignorada en Dedupl.': fue_ignorada
+                                })
+
+                        if diferencias_detalladas:
+                            st.error(f"❌ Encontradas {len(diferencias_detalladas)} columnas diferentes (comparando como texto):")
+                            st.dataframe(pd.DataFrame(diferencias_detalladas))
+
+                            st.write("#### Valores ORIGINALES (con tipos de datos originales):")
+                            diferencias_originales = []
+                            for diff in diferencias_detalladas:
+                                col_name = diff['Columna']
+                                val_orig_existente = df_existente.iloc[posible_gemelo][col_name] if col_name in df_existente.columns else None
+                                val_orig_nuevo = df_nuevos_mapeados.iloc[posicion_problema][col_name]
+
+                                diferencias_originales.append({
+                                    'Columna': col_name,
+                                    'Valor Existente': val_orig_existente,
+                                    'Tipo Existente': type(val_orig_existente).__name__,
+                                    'Valor Nuevo': val_orig_nuevo,
+                                    'Tipo Nuevo': type(val_orig_nuevo).__name__
+                                })
+                            st.dataframe(pd.DataFrame(diferencias_originales))
+
                         else:
-                            st.warning(f"⚠️ No se encontró un registro existente con '{col_key_nombre}' = {codigo_buscar}. Este registro es genuinamente nuevo.")
+                            st.success("✅ No se encontraron diferencias en la comparación de texto.")
+                    else:
+                        st.warning(f"⚠️ No se encontró un registro existente con '{col_key_nombre}' = {codigo_buscar}. Este registro es genuinamente nuevo.")
 
         # ==============================================================================
         # PASO 6: AÑADIR LAS FILAS ÚNICAS Y SUBIR
         # ==============================================================================
         
-        df_combinado_filtrado = df_combinado[~mascara_duplicados]
-        df_filas_a_anadir = df_combinado_filtrado[df_combinado_filtrado['__source__'] == 'nuevo']
-        df_filas_a_anadir = df_filas_a_anadir.drop(columns=['__source__'])
+        df_filas_a_anadir = df_nuevos_mapeados[~mascara_duplicados]
 
         if df_filas_a_anadir.empty:
+            if indice is None:
+                # El libro no cambia: el índice reconstruido vale para su eTag actual
+                guardar_indice_huellas(headers, site_id, ruta_archivo_trm, etag_trm, columnas_destino, cols_to_normalize, huellas_existentes)
             status_placeholder.success("✅ No se encontraron registros nuevos para añadir. El archivo TRM ya está actualizado.")
             return True
 
@@ -326,69 +314,70 @@ def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesad
 
         lista_nuevas_filas_final = [list(row) for row in df_filas_a_anadir.itertuples(index=False, name=None)]
 
-        libro = openpyxl.load_workbook(io.BytesIO(contenido_trm_bytes))
-        hoja = libro[nombre_hoja_destino]
-        
-        tabla = None
-        if hoja.tables:
-            nombre_tabla = list(hoja.tables.keys())[0]
-            tabla = hoja.tables[nombre_tabla]
-            status_placeholder.info(f"✅ Tabla encontrada: '{nombre_tabla}' con rango {tabla.ref}")
-        else:
-            status_placeholder.warning("⚠️ No se encontró ninguna Tabla de Excel.")
-
-        for fila in lista_nuevas_filas_final:
-            hoja.append(fila)
-        
-        if tabla:
-            rango_actual = tabla.ref
-            inicio_rango = rango_actual.split(':')[0]
-            columna_final = rango_actual.split(':')[1].rstrip('0123456789')
-            nueva_fila_final = hoja.max_row
-            nuevo_rango = f"{inicio_rango}:{columna_final}{nueva_fila_final}"
-            tabla.ref = nuevo_rango
-            status_placeholder.info(f"✅ Rango de la Tabla extendido de {rango_actual} a {nuevo_rango}")
+        num_nuevas_filas = len(lista_nuevas_filas_final)
 
         # ==============================================================================
         # PASO 7: INYECTAR FÓRMULAS
         # ==============================================================================
+        # Las fórmulas de FORMULAS_TRM (D, AJ y AK; ver mapeo_trm.py) se escriben junto
+        # con las filas, una fórmula compartida por columna.
         status_placeholder.info("6/7 - Agregando fórmulas a las nuevas filas...")
-
-        col_comercial_idx = 4
-        col_vendedor_idx = 18
-        
-        num_nuevas_filas = len(lista_nuevas_filas_final)
-        primera_fila_nueva = hoja.max_row - num_nuevas_filas + 1
-        
-        for r_idx in range(primera_fila_nueva, hoja.max_row + 1):
-            celda_comercial = hoja.cell(row=r_idx, column=col_comercial_idx)
-            celda_comercial.value = f'=IFERROR(VLOOKUP(R{r_idx},vendedor!$B:$C,2,FALSE),"")'
-        
-        status_placeholder.info(f"✅ Fórmula agregada a columna D en {num_nuevas_filas} nuevas filas")
-
-        col_aj_idx = 36
-        col_ak_idx = 37
-        
-        for r_idx in range(primera_fila_nueva, hoja.max_row + 1):
-            celda_aj = hoja.cell(row=r_idx, column=col_aj_idx)
-            celda_aj.value = f'=IFERROR(1-(AH{r_idx}/W{r_idx}),0)'
-            
-            celda_ak = hoja.cell(row=r_idx, column=col_ak_idx)
-            celda_ak.value = f'=W{r_idx}-AH{r_idx}'
-        
-        status_placeholder.info(f"✅ Fórmulas agregadas a columnas AJ y AK en {num_nuevas_filas} nuevas filas")
+        formulas_nuevas_filas = formulas_trm()
 
         # ==============================================================================
         # PASO 8: GUARDAR Y SUBIR
         # ==============================================================================
+        # Con ESCRITOR_SHAREPOINT = "graph" solo las filas nuevas se envían a la Tabla
+        # (ver escritor_graph.py). Si no, se insertan directamente en el XML de la hoja
+        # sin cargar el libro (ver escritor_xlsx.py) y se sube el archivo completo; en
+        # ambos casos las demás hojas y estilos quedan intactos.
         status_placeholder.info("7/7 - Guardando y subiendo archivo final...")
-        
-        output = io.BytesIO()
-        libro.save(output)
-        
-        endpoint_put = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{ruta_archivo_trm}:/content"
-        response_put = requests.put(endpoint_put, data=output.getvalue(), headers=headers)
-        response_put.raise_for_status()
+
+        detalles_anexo = None
+        if ESCRITOR_SHAREPOINT == "graph":
+            try:
+                detalles_anexo = anexar_filas_graph(
+                    headers, site_id, ruta_archivo_trm, nombre_hoja_destino, lista_nuevas_filas_final,
+                    formulas=formulas_nuevas_filas
+                )
+                etag_final = obtener_etag(headers, site_id, ruta_archivo_trm)
+            except ValueError as e:
+                status_placeholder.warning(f"⚠️ {e} Se subirá el archivo completo.")
+
+        if detalles_anexo is None:
+            if archivo_trm is None:
+                status_placeholder.info("Descargando archivo TRM para añadir los registros nuevos...")
+                archivo_trm = descargar_archivo_sharepoint(headers, site_id, ruta_archivo_trm)
+                if archivo_trm is None: return False
+
+            # El libro resultante va a un archivo temporal y de ahí se sube (por fragmentos
+            # si es grande; ver subida_sharepoint.py), sin una segunda copia en memoria
+            with archivo_temporal_subida() as archivo_final:
+                try:
+                    _, detalles_anexo = anexar_filas(
+                        archivo_trm, nombre_hoja_destino, lista_nuevas_filas_final,
+                        formulas=formulas_nuevas_filas, salida=archivo_final
+                    )
+                except KeyError:
+                    status_placeholder.error(f"❌ No se encontró la hoja '{nombre_hoja_destino}'.")
+                    return False
+                response_put = subir_archivo_sharepoint(headers, site_id, ruta_archivo_trm, archivo_final)
+            etag_final = etag_respuesta(response_put)
+
+        if detalles_anexo["tablas"]:
+            for nombre_tabla, rango_actual, nuevo_rango in detalles_anexo["tablas"]:
+                status_placeholder.info(f"✅ Rango de la Tabla '{nombre_tabla}' extendido de {rango_actual} a {nuevo_rango}")
+        else:
+            status_placeholder.warning("⚠️ No se encontró ninguna Tabla de Excel que termine en la última fila.")
+        status_placeholder.info(
+            f"✅ {num_nuevas_filas} filas añadidas (filas {detalles_anexo['primera_fila']} a {detalles_anexo['ultima_fila']}, "
+            f"método: {detalles_anexo['metodo']}) con fórmulas en las columnas D, AJ y AK"
+        )
+
+        huellas_finales = np.concatenate([huellas_existentes, huellas_nuevas[~mascara_duplicados]])
+        if guardar_indice_huellas(headers, site_id, ruta_archivo_trm, etag_final,
+                                  columnas_destino, cols_to_normalize, huellas_finales):
+            status_placeholder.info(f"✅ Índice de huellas actualizado ({len(huellas_finales)} registros).")
 
         status_placeholder.success(f"✅ ¡Archivo TRM actualizado! Se añadieron {num_nuevas_filas} registros nuevos y únicos.")
         return True
@@ -398,11 +387,17 @@ def actualizar_archivo_trm(headers, site_id, ruta_archivo_trm, df_datos_procesad
         import traceback
         status_placeholder.error(f"Detalles del error: {traceback.format_exc()}")
         return False
+    finally:
+        if archivo_trm is not None:
+            archivo_trm.close()
 
 
-def validar_respuesta_sharepoint(response, nombre_archivo):
+def validar_respuesta_sharepoint(response, nombre_archivo, primeros_bytes=None):
     """
     Valida que la respuesta de SharePoint sea correcta y contenga un archivo Excel
+
+    Con primeros_bytes (descarga en streaming) la firma se revisa solo en ese inicio
+    y el tamaño se toma del Content-Length, sin leer el cuerpo completo.
     """
     #st.info(f"🔍 Validando respuesta para: {nombre_archivo}")
     
@@ -418,8 +413,13 @@ def validar_respuesta_sharepoint(response, nombre_archivo):
             st.error(f"Texto de respuesta: {response.text[:500]}...")
         return False, "Error HTTP"
     
+    if primeros_bytes is None:
+        primeros_bytes = response.content
+        content_length = len(primeros_bytes)
+    else:
+        content_length = int(response.headers.get('Content-Length') or len(primeros_bytes))
+
     # 2. Verificar el tamaño del contenido
-    content_length = len(response.content)
     #st.write(f"📏 Tamaño del archivo descargado: {content_length:,} bytes")
     
     if content_length == 0:
@@ -436,17 +436,16 @@ def validar_respuesta_sharepoint(response, nombre_archivo):
     #st.write(f"📋 Content-Type: {content_type}")
     
     # 4. Verificar las primeras bytes para asegurar que es un archivo Excel
-    primeros_bytes = response.content[:20]
-    #st.write(f"🔢 Primeros 20 bytes (hex): {primeros_bytes.hex()}")
+    #st.write(f"🔢 Primeros 20 bytes (hex): {primeros_bytes[:20].hex()}")
     
     # Un archivo Excel (.xlsx) debe comenzar con la signature de ZIP: "PK"
-    if not response.content.startswith(b'PK'):
+    if not primeros_bytes.startswith(b'PK'):
         #st.error("❌ El archivo no tiene la signature de un archivo ZIP/Excel válido")
         #st.error("Los archivos .xlsx deben comenzar con 'PK' (signature de ZIP)")
         
         # Mostrar el inicio del contenido como texto para debug
         try:
-            inicio_texto = response.content[:200].decode('utf-8', errors='ignore')
+            inicio_texto = primeros_bytes[:200].decode('utf-8', errors='ignore')
             #st.error(f"Inicio del contenido como texto: {inicio_texto}")
         except:
             st.error("No se pudo decodificar el inicio del contenido como texto")
@@ -456,36 +455,61 @@ def validar_respuesta_sharepoint(response, nombre_archivo):
     #st.success("✅ El archivo parece ser un Excel válido")
     return True, "Válido"
 
-def obtener_contenido_archivo_sharepoint(headers, site_id, ruta_archivo):
+def descargar_archivo_sharepoint(headers, site_id, ruta_archivo):
     """
-    Descarga un archivo específico de SharePoint con validaciones completas
+    Descarga un archivo de SharePoint en streaming a un archivo temporal.
+
+    El cuerpo se escribe por bloques en un SpooledTemporaryFile (en memoria hasta
+    MAX_MEMORIA_DESCARGA y en disco por encima), así que nunca se arma en memoria
+    como un solo bytes. Las validaciones de validar_respuesta_sharepoint se hacen
+    con el primer bloque. El archivo se comparte tal cual entre pd.read_excel y
+    escritor_xlsx.py (ambos lo leen desde el inicio); quien lo recibe lo cierra.
+
+    Returns:
+        SpooledTemporaryFile or None: Archivo al inicio, o None si la descarga o la
+            validación fallaron.
     """
-    #st.info(f"📥 Descargando archivo: {ruta_archivo}")
-    
-    # Construir el endpoint
-    endpoint_get = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{ruta_archivo}:/content"
-    #st.write(f"🔗 Endpoint: {endpoint_get}")
-    
+    endpoint_get = f"{URL_GRAPH}/sites/{site_id}/drive/root:/{ruta_archivo}:/content"
+
     try:
-        # Realizar la petición
-        response_get = requests.get(endpoint_get, headers=headers)
-        
-        # Validar la respuesta
-        es_valido, mensaje = validar_respuesta_sharepoint(response_get, ruta_archivo.split('/')[-1])
-        
-        if not es_valido:
-            #st.error(f"❌ Validación falló: {mensaje}")
-            return None
-        
-        return response_get.content
-        
+        with requests.get(endpoint_get, headers=headers, stream=True) as response_get:
+            bloques = response_get.iter_content(chunk_size=BLOQUE_DESCARGA) if response_get.status_code == 200 else iter(())
+            primer_bloque = next(bloques, b"")
+
+            es_valido, mensaje = validar_respuesta_sharepoint(response_get, ruta_archivo.split('/')[-1], primer_bloque)
+            if not es_valido:
+                return None
+
+            archivo = tempfile.SpooledTemporaryFile(max_size=MAX_MEMORIA_DESCARGA)
+            try:
+                archivo.write(primer_bloque)
+                for bloque in bloques:
+                    archivo.write(bloque)
+            except Exception:
+                archivo.close()
+                raise
+        archivo.seek(0)
+        return archivo
+
     except requests.exceptions.RequestException as e:
-        #st.error(f"❌ Error de red al descargar el archivo: {e}")
+        print(f"Error de red al descargar '{ruta_archivo}': {e}")
         return None
     except Exception as e:
-        #st.error(f"❌ Error inesperado: {e}")
+        print(f"Error inesperado al descargar '{ruta_archivo}': {e}")
         return None
 
+
+def obtener_contenido_archivo_sharepoint(headers, site_id, ruta_archivo):
+    """
+    Descarga un archivo específico de SharePoint con validaciones completas
+    """
+    archivo = descargar_archivo_sharepoint(headers, site_id, ruta_archivo)
+    if archivo is None:
+        return None
+    with archivo:
+        return archivo.read()
+
+
 def verificar_archivo_existe_sharepoint(headers, site_id, ruta_archivo):
     """
     Verifica si un archivo existe y obtiene sus metadatos antes de descargarlo
@@ -493,7 +517,7 @@ def verificar_archivo_existe_sharepoint(headers, site_id, ruta_archivo):
     #st.info(f"🔍 Verificando existencia de: {ruta_archivo}")
     
     # Endpoint para obtener metadatos del archivo (sin descargar el contenido)
-    endpoint_metadata = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{ruta_archivo}"
+    endpoint_metadata = f"{URL_GRAPH}/sites/{site_id}/drive/root:/{ruta_archivo}"
     
     try:
         response = requests.get(endpoint_metadata, headers=headers)
@@ -547,7 +571,7 @@ def get_access_token(status_placeholder):
 
 def get_sharepoint_site_id(access_token):
     headers = {'Authorization': f'Bearer {access_token}'}
-    site_url = f"https://graph.microsoft.com/v1.0/sites/{SHAREPOINT_HOSTNAME}:/sites/{SITE_NAME}"
+    site_url = f"{URL_GRAPH}/sites/{SHAREPOINT_HOSTNAME}:/sites/{SITE_NAME}"
     try:
         response = requests.get(site_url, headers=headers)
         response.raise_for_status()
@@ -580,7 +604,7 @@ def encontrar_archivo_del_mes(headers, site_id, ruta_carpeta, status_placeholder
         
         # Primero, listar TODOS los archivos en la carpeta
         #st.write("📂 Listando todos los archivos disponibles:")
-        endpoint_children = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{ruta_carpeta}:/children"
+        endpoint_children = f"{URL_GRAPH}/sites/{site_id}/drive/root:/{ruta_carpeta}:/children"
         response_list = requests.get(endpoint_children, headers=headers)
         
         if response_list.status_code == 200:
@@ -649,28 +673,97 @@ def encontrar_archivo_del_mes(headers, site_id, ruta_carpeta, status_placeholder
         st.error(f"Error inesperado durante la búsqueda del mes: {e}")
         return None
 
+def anexar_con_indice_huellas(headers, site_id, ruta_archivo, df_nuevos_datos, indice, status_placeholder):
+    """
+    Añade al libro del mes solo los registros que no están en su índice de huellas.
+
+    La deduplicación usa únicamente el índice (el libro vigente no tiene registros
+    repetidos: el índice solo se guarda después de escribirlo sin ellos), así que las
+    filas del libro no se leen. Los diagnósticos que comparan con las filas
+    existentes se omiten.
+    """
+    nombre_archivo = ruta_archivo.split('/')[-1]
+    columnas_hoja = indice["columnas"]
+    huellas_nuevas = huellas_filas(df_nuevos_datos, columnas_hoja)
+    mascara_repetidos = marcar_repetidos(indice["huellas"], huellas_nuevas)
+    if mascara_repetidos.all():
+        status_placeholder.success(
+            f"✅ Los {len(df_nuevos_datos)} registros ya están en '{nombre_archivo}' (según su índice de huellas). No se modificó el archivo."
+        )
+        return True
+
+    if mascara_repetidos.any():
+        status_placeholder.warning(f"⚠️ Se encontraron {int(mascara_repetidos.sum())} registros duplicados que serán omitidos.")
+    status_placeholder.info(
+        f"📋 Índice de huellas vigente ({len(indice['huellas'])} registros): {int((~mascara_repetidos).sum())} registros nuevos por añadir."
+    )
+    st.info("ℹ️ Registros existentes tomados del índice de huellas: no se leyeron las filas del libro.")
+
+    # Las columnas que no traen los datos nuevos quedan vacías, como al concatenar
+    filas = list(df_nuevos_datos[~mascara_repetidos].reindex(columns=columnas_hoja).itertuples(index=False, name=None))
+
+    # Con ESCRITOR_SHAREPOINT = "graph" solo viajan las filas nuevas: el libro no se
+    # descarga (la primera hoja se le pregunta a Graph) salvo que la hoja no tenga Tabla
+    detalles_escritura = None
+    if ESCRITOR_SHAREPOINT == "graph":
+        try:
+            detalles_escritura = anexar_filas_graph(headers, site_id, ruta_archivo, None, filas)
+            etag_final = obtener_etag(headers, site_id, ruta_archivo)
+        except ValueError as e:
+            status_placeholder.warning(f"⚠️ {e} Se subirá el archivo completo.")
+    if detalles_escritura is None:
+        archivo_libro = descargar_archivo_sharepoint(headers, site_id, ruta_archivo)
+        if archivo_libro is None:
+            return False
+        with archivo_libro, archivo_temporal_subida() as archivo_final:
+            nombre_hoja_destino = nombres_hojas(archivo_libro)[0]
+            _, detalles_escritura = anexar_filas(archivo_libro, nombre_hoja_destino, filas, salida=archivo_final)
+            response_put = subir_archivo_sharepoint(headers, site_id, ruta_archivo, archivo_final)
+        etag_final = etag_respuesta(response_put)
+
+    status_placeholder.info(
+        f"➕ Modo apéndice: {len(filas)} filas nuevas escritas en las filas "
+        f"{detalles_escritura['primera_fila']} a {detalles_escritura['ultima_fila']} (método: {detalles_escritura['metodo']})."
+    )
+    huellas_finales = np.concatenate([indice["huellas"], huellas_nuevas[~mascara_repetidos]])
+    guardar_indice_huellas(headers, site_id, ruta_archivo, etag_final, columnas_hoja, columnas_hoja, huellas_finales)
+
+    status_placeholder.success(f"✅ ¡Archivo '{nombre_archivo}' actualizado preservando su formato!")
+    return True
+
+
 def agregar_datos_a_excel_sharepoint(headers, site_id, ruta_archivo, df_nuevos_datos, status_placeholder):
     """
     Agrega datos a la primera hoja de un archivo Excel en SharePoint,
     preservando fórmulas, formatos y otras hojas, y eliminando duplicados
     mediante comparación temporal de strings sin modificar los tipos de datos originales.
     """
+    archivo_libro = None
     try:
-        # PASO 1: Descargar el archivo existente con validaciones
-        contenido_bytes = obtener_contenido_archivo_sharepoint(headers, site_id, ruta_archivo)
-        if contenido_bytes is None:
+        # PASO 0: Con un índice de huellas vigente (ver indice_huellas.py) la
+        # deduplicación se hace solo con el índice, sin leer las filas del libro; el
+        # libro completo solo se lee para reconstruir el índice (no hay, o el eTag
+        # cambió) o si los datos nuevos traen columnas que la hoja no tiene.
+        etag_libro = obtener_etag(headers, site_id, ruta_archivo)
+        indice = cargar_indice_huellas(headers, site_id, ruta_archivo, etag_libro)
+        if indice is not None and (indice["columnas_huella"] != indice["columnas"]
+                                   or not set(df_nuevos_datos.columns) <= set(indice["columnas"])):
+            indice = None
+        if indice is not None:
+            return anexar_con_indice_huellas(headers, site_id, ruta_archivo, df_nuevos_datos, indice, status_placeholder)
+
+        # PASO 1: Descargar el archivo existente con validaciones, en streaming a un
+        # archivo temporal que comparten todas las lecturas y escrituras de abajo
+        archivo_libro = descargar_archivo_sharepoint(headers, site_id, ruta_archivo)
+        if archivo_libro is None:
             return False
 
-        contenido_en_memoria = io.BytesIO(contenido_bytes)
-
-        # PASO 2: Cargar el libro de trabajo completo con openpyxl
-        libro = openpyxl.load_workbook(contenido_en_memoria)
-        
-        nombre_hoja_destino = libro.sheetnames[0]
-        hoja = libro[nombre_hoja_destino]
+        # PASO 2: Nombre de la primera hoja (solo de xl/workbook.xml, sin cargar el libro)
+        nombre_hoja_destino = nombres_hojas(archivo_libro)[0]
         
         # Leer los datos de esa hoja en un DataFrame
-        df_existente = pd.read_excel(io.BytesIO(contenido_bytes), sheet_name=nombre_hoja_destino, engine='openpyxl')
+        archivo_libro.seek(0)
+        df_existente = pd.read_excel(archivo_libro, sheet_name=nombre_hoja_destino, engine='openpyxl')
         df_existente.reset_index(drop=True, inplace=True)
 
         # ====== DIAGNÓSTICO: COMPARAR TIPOS DE DATOS ======
@@ -743,46 +836,15 @@ def agregar_datos_a_excel_sharepoint(headers, site_id, ruta_archivo, df_nuevos_d
         status_placeholder.info("3/4 - Combinando datos nuevos y existentes...")
         df_combinado = pd.concat([df_existente, df_nuevos_datos], ignore_index=True)
         
-        # ====== DETECCIÓN DE DUPLICADOS CON COMPARACIÓN TEMPORAL STRING ======
+        # ====== DETECCIÓN DE DUPLICADOS CON HUELLAS DE FILAS ======
         filas_antes = len(df_combinado)
         status_placeholder.info(f"📊 Total de filas antes de verificar duplicados: {filas_antes}")
         
-        # CREAR COPIA TEMPORAL DE TODO EL DATAFRAME PARA COMPARACIÓN
-        df_temp_string = df_combinado.copy()
-        
-        status_placeholder.info(f"🔍 Convirtiendo {len(df_temp_string.columns)} columnas a string para comparación...")
-        
-        # Convertir TODAS las columnas a string para comparación uniforme
-        for col in df_temp_string.columns:
-            # 1. Rellenar NaN/None con string vacío
-            # 2. Si es numérico, redondear a 2 decimales para evitar diferencias de precisión
-            # 3. Convertir a string
-            # 4. Eliminar el .0 al final de números flotantes
-            # 5. Reemplazar "None" con ""
-            # 6. Limpiar espacios
-            
-            # Intentar redondear si es numérico
-            try:
-                # Si la columna es numérica, redondear a 2 decimales
-                if df_temp_string[col].dtype in ['float64', 'float32', 'int64', 'int32']:
-                    df_temp_string[col] = df_temp_string[col].round(2)
-            except:
-                pass  # Si no es numérico, continuar
-            
-            df_temp_string[col] = (
-                df_temp_string[col]
-                .fillna('')
-                .astype(str)
-                .str.replace(r'\.0+$', '', regex=True)  # "2.0" → "2"
-                .str.replace('None', '', regex=False)    # "None" → ""
-                .str.strip()
-            )
-        
-        status_placeholder.info("✅ Todas las columnas convertidas a string (redondeadas y normalizadas).")
-        
-        # IDENTIFICAR duplicados usando la versión temporal en string
-        # Esto compara TODAS las columnas de cada registro
-        mascara_duplicados = df_temp_string.duplicated(keep='first')
+        # Cada registro se compara por su huella sobre TODAS las columnas normalizadas
+        # (NaN/None -> '', números a 2 decimales, sin '.0' ni espacios), ver huellas_filas.py
+        columnas_comparacion = list(df_combinado.columns)
+        huellas_combinado = huellas_filas(df_combinado, columnas_comparacion)
+        mascara_duplicados = pd.Series(huellas_combinado).duplicated(keep='first')
         
         # Contar duplicados encontrados
         duplicados_encontrados = mascara_duplicados.sum()
@@ -807,84 +869,76 @@ def agregar_datos_a_excel_sharepoint(headers, site_id, ruta_archivo, df_nuevos_d
             inicio_nuevos = len(df_existente)
             
             # Ver cuántos de los nuevos NO fueron marcados como duplicados
-            registros_nuevos_no_duplicados = sum(~mascara_duplicados[inicio_nuevos:])
+            registros_nuevos_no_duplicados = int((~mascara_duplicados[inicio_nuevos:]).sum())
             
             st.warning(f"⚠️ De {len(df_nuevos_datos)} registros nuevos, {registros_nuevos_no_duplicados} NO fueron detectados como duplicados")
             
             if registros_nuevos_no_duplicados > 0 and registros_nuevos_no_duplicados < len(df_nuevos_datos):
                 st.write("Esto significa que ALGUNOS se detectaron y OTROS NO. Investigando diferencias...")
                 
-                # Obtener los índices de registros nuevos que NO fueron detectados como duplicados
-                indices_nuevos_no_detectados = []
-                for i in range(inicio_nuevos, len(df_combinado)):
-                    if not mascara_duplicados[i]:
-                        indices_nuevos_no_detectados.append(i)
+                # Tomar el primer registro nuevo que NO se detectó como duplicado
+                indice_problema = inicio_nuevos + int(np.flatnonzero(~mascara_duplicados.to_numpy()[inicio_nuevos:])[0])
                 
-                if indices_nuevos_no_detectados:
-                    # Tomar el primer registro nuevo que NO se detectó como duplicado
-                    indice_problema = indices_nuevos_no_detectados[0]
+                st.write(f"#### Analizando registro en índice {indice_problema} (NO detectado como duplicado)")
+                
+                # Buscar registros existentes que tengan el mismo "Código" (columna clave)
+                if 'Código' in df_combinado.columns:
+                    fila_nueva = normalizar_filas(df_combinado.iloc[[indice_problema]], columnas_comparacion).iloc[0]
+                    codigo_buscar = fila_nueva['Código']
                     
-                    st.write(f"#### Analizando registro en índice {indice_problema} (NO detectado como duplicado)")
+                    st.write(f"Buscando en registros existentes con Código: **{codigo_buscar}**")
                     
-                    # Buscar registros existentes que tengan el mismo "Código" (columna clave)
-                    if 'Código' in df_temp_string.columns:
-                        codigo_buscar = df_temp_string.iloc[indice_problema]['Código']
-                        
-                        st.write(f"Buscando en registros existentes con Código: **{codigo_buscar}**")
+                    # Buscar en los registros existentes (antes de inicio_nuevos), normalizando solo esa columna
+                    coincidencias = np.flatnonzero(normalizar_columna(df_combinado['Código'].iloc[:inicio_nuevos]).to_numpy() == codigo_buscar)
+                    posible_gemelo = int(coincidencias[0]) if len(coincidencias) else None
+                    
+                    if posible_gemelo is not None:
+                        st.success(f"✅ Encontrado posible gemelo en índice {posible_gemelo}")
                         
-                        # Buscar en los registros existentes (antes de inicio_nuevos)
-                        posible_gemelo = None
-                        for i in range(inicio_nuevos):
-                            if df_temp_string.iloc[i]['Código'] == codigo_buscar:
-                                posible_gemelo = i
-                                break
+                        # Comparar TODAS las columnas entre estos dos registros
+                        fila_gemela = normalizar_filas(df_combinado.iloc[[posible_gemelo]], columnas_comparacion).iloc[0]
+                        diferencias_detalladas = []
+                        for col in columnas_comparacion:
+                            val_existente = fila_gemela[col]
+                            val_nuevo = fila_nueva[col]
+                            
+                            if val_existente != val_nuevo:
+                                # Mostrar también el tipo y longitud para debugging
+                                diferencias_detalladas.append({
+                                    'Columna': col,
+                                    'Valor Existente (ya string)': f'"{val_existente}" (len={len(val_existente)})',
+                                    'Valor Nuevo (ya string)': f'"{val_nuevo}" (len={len(val_nuevo)})',
+                                    'Son iguales?': 'NO ❌'
+                                })
                         
-                        if posible_gemelo is not None:
-                            st.success(f"✅ Encontrado posible gemelo en índice {posible_gemelo}")
+                        if diferencias_detalladas:
+                            st.error(f"❌ Encontradas {len(diferencias_detalladas)} columnas diferentes:")
+                            st.dataframe(pd.DataFrame(diferencias_detalladas))
                             
-                            # Comparar TODAS las columnas entre estos dos registros
-                            diferencias_detalladas = []
-                            for col in df_temp_string.columns:
-                                val_existente = df_temp_string.iloc[posible_gemelo][col]
-                                val_nuevo = df_temp_string.iloc[indice_problema][col]
+                            # Mostrar también los valores ORIGINALES (antes de convertir a string)
+                            st.write("#### Valores ORIGINALES (con tipos de datos originales):")
+                            diferencias_originales = []
+                            for col in df_combinado.columns:
+                                val_orig_existente = df_combinado.iloc[posible_gemelo][col]
+                                val_orig_nuevo = df_combinado.iloc[indice_problema][col]
+                                tipo_existente = type(val_orig_existente).__name__
+                                tipo_nuevo = type(val_orig_nuevo).__name__
                                 
-                                if val_existente != val_nuevo:
-                                    # Mostrar también el tipo y longitud para debugging
-                                    diferencias_detalladas.append({
+                                if str(val_orig_existente) != str(val_orig_nuevo):
+                                    diferencias_originales.append({
                                         'Columna': col,
-                                        'Valor Existente (ya string)': f'"{val_existente}" (len={len(val_existente)})',
-                                        'Valor Nuevo (ya string)': f'"{val_nuevo}" (len={len(val_nuevo)})',
-                                        'Son iguales?': 'NO ❌'
+                                        'Valor Existente': val_orig_existente,
+                                        'Tipo Existente': tipo_existente,
+                                        'Valor Nuevo': val_orig_nuevo,
+                                        'Tipo Nuevo': tipo_nuevo
                                     })
                             
-                            if diferencias_detalladas:
-                                st.error(f"❌ Encontradas {len(diferencias_detalladas)} columnas diferentes:")
-                                st.dataframe(pd.DataFrame(diferencias_detalladas))
-                                
-                                # Mostrar también los valores ORIGINALES (antes de convertir a string)
-                                st.write("#### Valores ORIGINALES (con tipos de datos originales):")
-                                diferencias_originales = []
-                                for col in df_combinado.columns:
-                                    val_orig_existente = df_combinado.iloc[posible_gemelo][col]
-                                    val_orig_nuevo = df_combinado.iloc[indice_problema][col]
-                                    tipo_existente = type(val_orig_existente).__name__
-                                    tipo_nuevo = type(val_orig_nuevo).__name__
-                                    
-                                    if str(val_orig_existente) != str(val_orig_nuevo):
-                                        diferencias_originales.append({
-                                            'Columna': col,
-                                            'Valor Existente': val_orig_existente,
-                                            'Tipo Existente': tipo_existente,
-                                            'Valor Nuevo': val_orig_nuevo,
-                                            'Tipo Nuevo': tipo_nuevo
-                                        })
-                                
-                                if diferencias_originales:
-                                    st.dataframe(pd.DataFrame(diferencias_originales))
-                            else:
-                                st.success("✅ Todos los valores son iguales (esto NO debería pasar)")
+                            if diferencias_originales:
+                                st.dataframe(pd.DataFrame(diferencias_originales))
                         else:
-                            st.warning(f"⚠️ No se encontró un registro existente con Código {codigo_buscar}")
+                            st.success("✅ Todos los valores son iguales (esto NO debería pasar)")
+                    else:
+                        st.warning(f"⚠️ No se encontró un registro existente con Código {codigo_buscar}")
         # ====== FIN INVESTIGACIÓN ======
         
         # FILTRAR el DataFrame ORIGINAL (con tipos de datos originales intactos)
@@ -903,31 +957,64 @@ def agregar_datos_a_excel_sharepoint(headers, site_id, ruta_archivo, df_nuevos_d
             status_placeholder.info("🧹 Columnas 'Unnamed:' eliminadas.")
 
         # PASO 4: Escribir los datos actualizados de vuelta a la hoja
+        # Si el libro no tenía registros repetidos y los datos nuevos no traen columnas que
+        # la hoja no tenga, solo se escriben las filas nuevas después de la última (modo
+        # apéndice). Si hay que quitar repetidos del propio libro, todas las filas bajo el
+        # encabezado se reemplazan en un solo paso. Ambos editan el XML de la hoja (ver
+        # escritor_xlsx.py) en lugar de borrar y escribir celda por celda.
         status_placeholder.info("4/4 - Escribiendo datos y subiendo el archivo final...")
         
-        # Usar el DataFrame limpio (sin duplicados, pero con tipos originales)
-        df_combinado = df_sin_duplicados
-        hoja = libro[nombre_hoja_destino]
+        inicio_nuevos = len(df_existente)
+        repetidos_en_libro = int(mascara_duplicados.to_numpy()[:inicio_nuevos].sum())
+        columnas_fuera_de_hoja = [col for col in df_nuevos_datos.columns if col not in df_existente.columns]
         
-        # Borrar datos antiguos de la hoja (excepto encabezados)
-        for r in range(hoja.max_row, 1, -1):
-            hoja.delete_rows(r)
+        if repetidos_en_libro == 0 and not columnas_fuera_de_hoja:
+            df_filas_nuevas = df_combinado.iloc[inicio_nuevos:][~mascara_duplicados.to_numpy()[inicio_nuevos:]]
+            columnas_hoja = list(df_existente.columns)
+            huellas_finales = huellas_combinado[~mascara_duplicados.to_numpy()]
             
-        from openpyxl.utils.dataframe import dataframe_to_rows    
-        
-        # Escribir el contenido del DataFrame combinado en la hoja
-        for r_idx, row in enumerate(dataframe_to_rows(df_sin_duplicados, index=False, header=False), 2):
-            for c_idx, value in enumerate(row, 1):
-                hoja.cell(row=r_idx, column=c_idx, value=value)
-        
-        # Guardar el libro modificado en memoria
-        output = io.BytesIO()
-        libro.save(output)
-        
-        # Subir el archivo final
-        endpoint_put = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{ruta_archivo}:/content"
-        response_put = requests.put(endpoint_put, data=output.getvalue(), headers=headers)
-        response_put.raise_for_status()
+            if df_filas_nuevas.empty:
+                # El libro no cambia: el índice calculado vale para su eTag actual
+                guardar_indice_huellas(headers, site_id, ruta_archivo, etag_libro, columnas_hoja, columnas_hoja, huellas_finales)
+                status_placeholder.success(f"✅ No hay registros nuevos para '{ruta_archivo.split('/')[-1]}'. No se modificó el archivo.")
+                return True
+            
+            filas = list(df_filas_nuevas[columnas_hoja].itertuples(index=False, name=None))
+            detalles_escritura = None
+            if ESCRITOR_SHAREPOINT == "graph":
+                try:
+                    # Solo las filas nuevas viajan; el libro ya descargado no se sube
+                    detalles_escritura = anexar_filas_graph(headers, site_id, ruta_archivo, nombre_hoja_destino, filas)
+                    etag_final = obtener_etag(headers, site_id, ruta_archivo)
+                except ValueError as e:
+                    status_placeholder.warning(f"⚠️ {e} Se subirá el archivo completo.")
+            if detalles_escritura is None:
+                # El libro resultante va a un archivo temporal y de ahí se sube (por
+                # fragmentos si es grande; ver subida_sharepoint.py)
+                with archivo_temporal_subida() as archivo_final:
+                    _, detalles_escritura = anexar_filas(archivo_libro, nombre_hoja_destino, filas, salida=archivo_final)
+                    response_put = subir_archivo_sharepoint(headers, site_id, ruta_archivo, archivo_final)
+                etag_final = etag_respuesta(response_put)
+            status_placeholder.info(
+                f"➕ Modo apéndice: {len(filas)} filas nuevas escritas en las filas "
+                f"{detalles_escritura['primera_fila']} a {detalles_escritura['ultima_fila']} (método: {detalles_escritura['metodo']})."
+            )
+        else:
+            motivo = (f"{repetidos_en_libro} registros repetidos en el propio libro" if repetidos_en_libro
+                      else f"columnas nuevas: {', '.join(map(str, columnas_fuera_de_hoja))}")
+            filas = list(df_sin_duplicados.itertuples(index=False, name=None))
+            with archivo_temporal_subida() as archivo_final:
+                _, detalles_escritura = reescribir_filas(archivo_libro, nombre_hoja_destino, filas, salida=archivo_final)
+                response_put = subir_archivo_sharepoint(headers, site_id, ruta_archivo, archivo_final)
+            etag_final = etag_respuesta(response_put)
+            columnas_hoja = list(df_sin_duplicados.columns)
+            huellas_finales = huellas_filas(df_sin_duplicados, columnas_hoja)
+            status_placeholder.info(
+                f"♻️ Reescritura completa ({motivo}): {len(filas)} filas (método: {detalles_escritura['metodo']})."
+            )
+
+        guardar_indice_huellas(headers, site_id, ruta_archivo, etag_final, columnas_hoja,
+                               columnas_hoja, huellas_finales)
 
         status_placeholder.success(f"✅ ¡Archivo '{ruta_archivo.split('/')[-1]}' actualizado preservando su formato!")
         return True
@@ -937,6 +1024,9 @@ def agregar_datos_a_excel_sharepoint(headers, site_id, ruta_archivo, df_nuevos_d
         import traceback
         status_placeholder.error(f"Detalles del error: {traceback.format_exc()}")
         return False
+    finally:
+        if archivo_libro is not None:
+            archivo_libro.close()
     
     
 def listar_archivos_en_carpeta(headers, site_id, ruta_carpeta):
@@ -945,7 +1035,7 @@ def listar_archivos_en_carpeta(headers, site_id, ruta_carpeta):
     """
     #st.info(f"📂 Explorando carpeta: {ruta_carpeta}")
     
-    endpoint = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{ruta_carpeta}:/children"
+    endpoint = f"{URL_GRAPH}/sites/{site_id}/drive/root:/{ruta_carpeta}:/children"
     
     try:
         response = requests.get(endpoint, headers=headers)
@@ -967,8 +1057,8 @@ def listar_archivos_en_carpeta(headers, site_id, ruta_carpeta):
 # --- Función Principal de Procesamiento ---
 def procesar_excel_para_streamlit(uploaded_file, status_placeholder):
     """
-    Procesa el archivo de Excel subido:
-    - Ignora las primeras 7 filas al cargar el archivo (asumiendo que los encabezados están en la fila 8).
+    Procesa el archivo de Excel subido, bloque por bloque (ver pipeline_siigo.py):
+    - Detecta la fila de encabezado (normalmente la 8) entre las primeras filas del archivo.
     - Elimina filas con 'Tipo clasificación' vacío.
     - Elimina columnas no deseadas.
     - Actualiza la columna 'Total'.
@@ -981,121 +1071,56 @@ def procesar_excel_para_streamlit(uploaded_file, status_placeholder):
         pandas.DataFrame or None: El DataFrame procesado o None si hay un error.
     """
     try:
-        # Usar skiprows para que Pandas lea el encabezado correcto
-        df = pd.read_excel(uploaded_file, skiprows=7) # La fila 8 (índice 7) se toma como encabezado
+        # Lectura y limpieza por bloques (ver pipeline_siigo.py); solo el relacionamiento
+        # FV ↔ DS/FC junta todos los bloques, ya recortados a las columnas finales.
+        # Las etapas cuyo archivo y configuración no cambiaron se toman de la memoria.
+        # El encabezado se detecta entre las primeras filas; si no aparece, el archivo se
+        # rechaza sin leerlo completo.
+        try:
+            df_procesado, resumen = ejecutar_pipeline(uploaded_file, ruta_pendientes=RUTA_PENDIENTES_SIIGO)
+        except EncabezadoNoEncontrado as e:
+            st.error(f"El archivo no parece un export de Siigo: {e}")
+            return None
 
-        # Verifica si el DataFrame tiene columnas después de skiprows.
-        if df.empty or df.columns.empty:
-            st.error("Parece que el archivo no tiene datos o encabezados después de saltar las primeras 7 filas. Por favor, verifica el formato del archivo.")
+        # Verifica si el archivo tiene datos después de las filas de encabezado.
+        if resumen["filas_leidas"] == 0:
+            st.error("Parece que el archivo no tiene datos después del encabezado. Por favor, verifica el formato del archivo.")
             return None
 
-        st.info(f"Archivo cargado exitosamente. Se saltaron las primeras 7 filas. Filas iniciales (después de saltar): **{len(df)}**.")
+        columnas_leidas = resumen["columnas_leidas"]
+        if resumen["etapas_memorizadas"]:
+            st.info(f"Etapas reutilizadas de una ejecución anterior: {', '.join(resumen['etapas_memorizadas'])}.")
+        elif resumen["desde_cache"]:
+            st.info("Este archivo ya se había leído: se tomaron los datos de la caché sin volver a abrir el Excel.")
+        st.info(f"Archivo cargado exitosamente. Encabezado detectado en la fila {resumen['filas_saltadas'] + 1} (se saltaron {resumen['filas_saltadas']} filas). Filas iniciales: **{resumen['filas_leidas']}**.")
 
-        df_procesado = df.copy()
-        
-        # --- FUNCIÓN DE LIMPIEZA SIMPLE ---
-        def convertir_a_numero_limpiando_comas(columna):
-            if not pd.api.types.is_string_dtype(columna):
-                columna = columna.astype(str)
-            columna_limpia = columna.str.replace(',', '', regex=False)
-            return pd.to_numeric(columna_limpia, errors='coerce')
-
-        if 'Identificación Vendedor' in df_procesado.columns:
-            # Crear la nueva columna 'Vendedor' con los datos de la original
-            df_procesado['Vendedor'] = df_procesado['Identificación Vendedor']
+        if 'Identificación Vendedor' in columnas_leidas:
             st.success("✅ Columna 'Vendedor' creada con éxito.")
         else:
-            # Si la columna original no existe, crear 'Vendedor' como una columna vacía
             st.warning("⚠️ No se encontró la columna 'Identificación Vendedor'. Se creará una columna 'Vendedor' vacía.")
-            df_procesado['Vendedor'] = ''
-
-        # Columnas a eliminar predefinidas
-        nombres_columnas_a_eliminar = [
-            "Sucursal",
-            "Centro costo",
-            "Fecha creación",
-            "Fecha modificación",
-            "Correo electrónico",
-            "Tipo de registro",
-            "Referencia fábrica",
-            "Bodega",
-            #"Identificación Vendedor",
-            "Nombre vendedor",
-            "Valor desc.",
-            "Base AIU",
-            "Impuesto cargo",
-            "Valor Impuesto Cargo",
-            "Impuesto Cargo 2",
-            "Valor Impuesto Cargo 2",
-            "Impuesto retención",
-            "Valor Impuesto Retención",
-            "Base retención (ICA/IVA)",
-            "Cargo en totales",
-            "Descuento en totales",
-            "Moneda",
-            "Forma pago",
-            "Fecha vencimiento",
-            "Nombre contacto"
-        ]
 
-        #df_procesado = df.copy()
-        
-        #Extraer códigos de Línea y Sublínea desde "Referencia fábrica"
-        if "Referencia fábrica" in df_procesado.columns:
-            st.info("Extrayendo códigos de Línea y Sublínea desde 'Referencia fábrica'...")
-            
-            # Convertir a string para poder usar regex
-            df_procesado['Referencia fábrica'] = df_procesado['Referencia fábrica'].astype(str)
-            
-            # Extraer código de línea (entre paréntesis) - TODO el contenido
-            df_procesado['Línea'] = df_procesado['Referencia fábrica'].str.extract(r'\(([^)]+)\)', expand=False)
-            
-            # Extraer código de sublínea (entre llaves) - TODO el contenido
-            df_procesado['Sublínea'] = df_procesado['Referencia fábrica'].str.extract(r'\{([^}]+)\}', expand=False)
-            
-            # Reemplazar NaN con string vacío
-            df_procesado['Línea'].fillna('', inplace=True)
-            df_procesado['Sublínea'].fillna('', inplace=True)
-            
-            st.success(f"Códigos extraídos - Líneas: {df_procesado['Línea'].ne('').sum()}, Sublíneas: {df_procesado['Sublínea'].ne('').sum()}")
+        if "Referencia fábrica" in columnas_leidas:
+            st.success(f"Códigos extraídos - Líneas: {resumen['lineas']}, Sublíneas: {resumen['sublineas']}")
         else:
             st.warning("No se encontró la columna 'Referencia fábrica'.")
-            df_procesado['Línea'] = ''
-            df_procesado['Sublínea'] = ''
-            
-        if "Observaciones" in df_procesado.columns:
-            st.info("Extrayendo Clasificación Producto desde 'Observaciones'...")
-            
-            df_procesado['Observaciones'] = df_procesado['Observaciones'].astype(str)
-            
-            # Extraer contenido entre comillas dobles
-            df_procesado['Clasificación Producto'] = df_procesado['Observaciones'].str.extract(r'"([^"]+)"', expand=False)
-            
-            # Reemplazar NaN con string vacío
-            df_procesado['Clasificación Producto'].fillna('', inplace=True)
-            
-            clasificaciones_encontradas = df_procesado['Clasificación Producto'].ne('').sum()
-            st.success(f"Clasificaciones de producto extraídas: {clasificaciones_encontradas}")
+
+        if "Observaciones" in columnas_leidas:
+            st.success(f"Clasificaciones de producto extraídas: {resumen['clasificaciones']}")
         else:
             st.warning("No se encontró la columna 'Observaciones'.")
-            df_procesado['Clasificación Producto'] = ''
-        
-        
-        # 1. Eliminar filas donde "Tipo clasificación" esté vacío/NaN
-        if "Tipo clasificación" in df_procesado.columns:
-            filas_antes_eliminacion = len(df_procesado)
-            df_procesado.dropna(subset=["Tipo clasificación"], inplace=True)
-            filas_despues_eliminacion = len(df_procesado)
-            st.success(f"Filas con 'Tipo clasificación' vacío eliminadas: **{filas_antes_eliminacion - filas_despues_eliminacion}**. Filas restantes: **{filas_despues_eliminacion}**.")
+
+        # 1. Filas con "Tipo clasificación" vacío
+        if "Tipo clasificación" in columnas_leidas:
+            filas_restantes = resumen["filas_leidas"] - resumen["filas_sin_tipo_clasificacion"]
+            st.success(f"Filas con 'Tipo clasificación' vacío eliminadas: **{resumen['filas_sin_tipo_clasificacion']}**. Filas restantes: **{filas_restantes}**.")
         else:
             st.warning("La columna **'Tipo clasificación'** no se encontró. No se eliminaron filas vacías.")
 
-        # 2. Eliminar columnas especificadas
-        columnas_existentes_para_eliminar = [col for col in nombres_columnas_a_eliminar if col in df_procesado.columns]
-        columnas_no_existentes_para_eliminar = [col for col in nombres_columnas_a_eliminar if col not in df_procesado.columns]
+        # 2. Columnas eliminadas
+        columnas_existentes_para_eliminar = [col for col in COLUMNAS_A_ELIMINAR if col in columnas_leidas]
+        columnas_no_existentes_para_eliminar = [col for col in COLUMNAS_A_ELIMINAR if col not in columnas_leidas]
 
         if columnas_existentes_para_eliminar:
-            df_procesado.drop(columns=columnas_existentes_para_eliminar, inplace=True)
             st.success(f"Columnas eliminadas: **{', '.join(columnas_existentes_para_eliminar)}**.")
         else:
             st.info("Ninguna de las columnas especificadas para eliminar se encontró. No se eliminaron columnas.")
@@ -1103,229 +1128,59 @@ def procesar_excel_para_streamlit(uploaded_file, status_placeholder):
         if columnas_no_existentes_para_eliminar:
             st.warning(f"Advertencia: Las siguientes columnas especificadas para eliminación no se encontraron: **{', '.join(columnas_no_existentes_para_eliminar)}**.")
 
-        # 3. Actualizar la columna "Total" existente
-        if "Cantidad" in df_procesado.columns and "Valor unitario" in df_procesado.columns and "Total" in df_procesado.columns:
-            df_procesado["Cantidad"] = pd.to_numeric(df_procesado["Cantidad"], errors='coerce')
-            df_procesado["Valor unitario"] = pd.to_numeric(df_procesado["Valor unitario"], errors='coerce')
-            df_procesado["Total"] = df_procesado["Cantidad"] * df_procesado["Valor unitario"]
-            df_procesado["Total"] = df_procesado["Total"].fillna(0)
+        # 3. Columna "Total"
+        if all(col in columnas_leidas for col in ["Cantidad", "Valor unitario", "Total"]):
             st.success("La columna **'Total'** ha sido actualizada con el cálculo **'Cantidad * Valor unitario'**.")
         else:
             st.warning("Advertencia: No se pudieron encontrar las columnas **'Cantidad'**, **'Valor unitario'** y/o **'Total'**. La columna **'Total'** no se actualizó.")
 
-        # 4. Crear y posicionar la nueva columna "Numero comprobante"
-        columnas_necesarias = ['Número comprobante', 'Consecutivo', 'Factura proveedor']
-        if all(col in df_procesado.columns for col in columnas_necesarias):
-            # Definir las condiciones
-            conditions = [
-                df_procesado['Número comprobante'] == 'FV-1',
-                df_procesado['Número comprobante'] == 'FV-2'
-            ]
-                
-            # Definir los valores a asignar para cada condición
-            choices = [
-                'FLE-' + df_procesado['Consecutivo'].astype('Int64').astype(str),
-                'FSE-' + df_procesado['Consecutivo'].astype('Int64').astype(str)
-            ]
-            
-            # Usar np.select para crear los valores de la nueva columna
-            # El valor por defecto será un texto vacío ''
-            valores_nueva_columna = np.select(conditions, choices, default='')
-            
-            # Encontrar la posición de la columna "Factura proveedor" para insertar antes
-            posicion_insercion = df_procesado.columns.get_loc('Factura proveedor')
-            
-            # Insertar la nueva columna en la posición encontrada
-            df_procesado.insert(posicion_insercion, 'Numero comprobante', valores_nueva_columna)
-            
+        # 4. Columna "Numero comprobante"
+        if all(col in columnas_leidas for col in ['Número comprobante', 'Consecutivo', 'Factura proveedor']):
             st.success("Se ha creado y llenado la nueva columna **'Numero comprobante'**.")
-            
         else:
             st.warning("Advertencia: No se encontraron las columnas necesarias ('Número comprobante', 'Consecutivo', 'Factura proveedor') para crear la nueva columna.")
-        
-        # 5. Extraer TRM de 'Observaciones' y sobrescribir 'Tasa de cambio'
-        #if "Tasa de cambio" in df_procesado.columns and "Observaciones" in df_procesado.columns:
-            #st.info("Actualizando 'Tasa de cambio' con los valores encontrados en 'Observaciones'...")
-
-            #df_procesado['Observaciones'] = df_procesado['Observaciones'].astype(str)
-            # Extrae el contenido de las llaves '{}'. El resultado será el texto o NaN si no hay llaves.
-            #trm_extraida = df_procesado['Observaciones'].str.extract(r'\{(.*?)\}')[0]
-            # Elimina las filas donde no se encontró nada (NaN), para quedarnos solo con los valores a actualizar.
-            #trm_extraida.dropna(inplace=True)
-            # Aseguramos que la columna 'Tasa de cambio' pueda recibir texto sin problemas.
-            #df_procesado['Tasa de cambio'] = df_procesado['Tasa de cambio'].astype(object)
-            # Actualiza la columna 'Tasa de cambio' SÓLO con los valores encontrados.
-            # El método .update() alinea por índice y solo modifica donde hay coincidencia.
-            #df_procesado['Tasa de cambio'].update(trm_extraida)
-            
-            #filas_actualizadas = len(trm_extraida)
-            #st.success(f"Se actualizaron **{filas_actualizadas}** filas en 'Tasa de cambio'. Los valores existentes se respetaron donde no se encontró un valor entre {{}}.")
-        #else:
-            #st.warning("Advertencia: No se encontraron las columnas **'Tasa de cambio'** y/o **'Observaciones'**.")
-        # 5. Extraer, LIMPIAR y sobrescribir 'Tasa de cambio' desde 'Observaciones' (LÓGICA CORREGIDA Y ENFOCADA)
-        # 5. Extraer, LIMPIAR y sobrescribir 'Tasa de cambio' desde 'Observaciones'
-        if "Tasa de cambio" in df_procesado.columns and "Observaciones" in df_procesado.columns:
 
-            df_procesado['Tasa de cambio'] = convertir_a_numero_limpiando_comas(
-                df_procesado['Tasa de cambio']
-            ).fillna(0.0).astype(float)
+        # 5. TRM tomada de 'Observaciones'
+        if "Tasa de cambio" in columnas_leidas and "Observaciones" in columnas_leidas:
+            st.write("🔍 DEBUG - Muestra de Observaciones (primeras 10):", resumen["muestra_observaciones"])
 
-            # --- DEBUG: ver qué hay realmente en Observaciones ---
-            muestra_obs = df_procesado['Observaciones'].astype(str).head(10).tolist()
-            st.write("🔍 DEBUG - Muestra de Observaciones (primeras 10):", muestra_obs)
-            # ---------------------------------------------------
-
-            trm_extraida = df_procesado['Observaciones'].astype(str).str.extract(r'\{(.*?)\}')[0]
-
-            # --- DEBUG: ver qué extrajo el regex ---
-            st.write("🔍 DEBUG - TRM extraída antes de dropna:", trm_extraida.value_counts(dropna=False).head(10))
-            # ---------------------------------------
-
-            trm_extraida = trm_extraida.dropna()
-
-            if trm_extraida.empty:
+            if resumen["trm_observaciones"] == 0:
                 st.warning("⚠️ El regex NO encontró ningún valor entre {} en Observaciones. Revisa el formato real de la columna.")
             else:
-                st.info(f"✅ Se encontraron {len(trm_extraida)} valores de TRM en Observaciones.")
-                trm_limpia = trm_extraida.str.replace(',', '', regex=False).str.strip()
-                trm_numerica = pd.to_numeric(trm_limpia, errors='coerce').dropna()
-
-                st.write("🔍 DEBUG - Valores numéricos listos para escribir:", trm_numerica.head(10).tolist())
-
-                # FIX: usar .loc en vez de .update() para garantizar escritura al DataFrame
-                df_procesado.loc[trm_numerica.index, 'Tasa de cambio'] = trm_numerica
-
-                # Verificación inmediata
-                valores_escritos = df_procesado.loc[trm_numerica.index, 'Tasa de cambio']
-                st.success(f"✅ Escritura verificada. Ejemplo: {valores_escritos.head(3).tolist()}")
+                st.info(f"✅ Se encontraron {resumen['trm_observaciones']} valores de TRM en Observaciones.")
+                st.write("🔍 DEBUG - Valores numéricos escritos:", resumen["ejemplo_trm"])
 
-        # 5.1. Calcular la nueva columna 'Valor Total ME' (VERSIÓN CORREGIDA FINAL)
-        st.info("Calculando 'Valor Total ME'...")
-        if 'Total' in df_procesado.columns and 'Tasa de cambio' in df_procesado.columns:
-            
-            # PASO CLAVE: Nos aseguramos de que 'Tasa de cambio' sea numérica OTRA VEZ,
-            # justo antes de la división, para revertir el cambio a 'object' del paso anterior.
-            tasa_numerica = pd.to_numeric(df_procesado['Tasa de cambio'], errors='coerce')
-            
-            # Reemplazamos 0 con NaN para evitar errores de división por cero.
-            tasa_numerica.replace(0, np.nan, inplace=True)
-
-            # Realizamos la división.
-            df_procesado['Valor Total ME'] = df_procesado['Total'] / tasa_numerica
-            
-            # Rellenamos cualquier resultado inválido (NaN) con 0.
-            df_procesado['Valor Total ME'].fillna(0, inplace=True)
-            
+        # 5.1. Columna 'Valor Total ME'
+        if 'Valor Total ME' in df_procesado.columns:
             st.success("Se ha creado y calculado la columna **'Valor Total ME'**.")
         else:
             st.warning("No se pudo calcular 'Valor Total ME'.")
 
-        # 6. Relacionar documentos FV-1 con DS-1 y FC-1
-        st.info("Iniciando el proceso de relacionamiento de documentos...")
-        
-        # Separar el DataFrame en los dos grupos principales
-        df_destino = df_procesado[df_procesado['Número comprobante'].isin(['FV-1', 'FV-2'])].copy()
-        df_fuente = df_procesado[df_procesado['Número comprobante'].isin(['DS-1', 'FC-1'])].copy()
-
-        if not df_fuente.empty:
-            # Preparar el DataFrame fuente (DS-1, FC-1)
-            df_fuente['NIT_relacion'] = df_fuente['Observaciones'].str.extract(r'\((.*?)\)')[0]
-            
-            df_destino['Identificación'] = df_destino['Identificación'].astype('Int64').astype(str)
-            df_destino['Código'] = df_destino['Código'].astype(str)
-            
-            df_fuente['NIT_relacion'] = df_fuente['NIT_relacion'].astype(str)
-            df_fuente['Código'] = df_fuente['Código'].astype(str)
-            
-            # Añadir prefijo a las columnas para evitar colisiones y dar claridad
-            df_fuente = df_fuente.add_prefix('REL_')
-            
-            # Realizar la unión externa (outer join)
-            df_final = pd.merge(
-                df_destino,
-                df_fuente,
-                how='outer',
-                left_on=['Identificación', 'Código'],
-                right_on=['REL_NIT_relacion', 'REL_Código']
-            )
-            
+        # 6. Relacionamiento FV-1/FV-2 con DS-1/FC-1
+        if resumen["relacionado"]:
+            relacion = resumen["relacion"]
             st.success("Relacionamiento completado. Los documentos sin pareja se han conservado.")
-            df_procesado = df_final
+            st.info(f"Modo de relacionamiento: **{relacion['modo']}**. Claves FV: {relacion['claves_destino']}, claves DS/FC: {relacion['claves_fuente']}, en común: {relacion['claves_comunes']}. Filas FV con pareja: {relacion['filas_destino_con_pareja']}, filas DS/FC con pareja: {relacion['filas_fuente_con_pareja']}. Filas resultantes: **{relacion['filas_resultado']}**.")
+            if relacion["claves_muchos_a_muchos"] > 0:
+                st.warning(f"⚠️ {relacion['claves_muchos_a_muchos']} claves tienen varias FV y varias DS/FC (muchos a muchos); en el modo 'todos' cada combinación genera una fila. Claves con más combinaciones:")
+                st.dataframe(pd.DataFrame(resumen["cardinalidad_relacion"]))
         else:
             st.warning("No se encontraron documentos DS-1 o FC-1 para relacionar. El archivo final no tendrá columnas de relación.")
-        
-        # 7. Organizar y Limpiar Columnas Finales
-        st.info("Organizando el formato final del archivo...")
-        
-        # A. Renombrar la columna "Tipo clasificación" a "Tipo Bien"
-        # Verificamos si la columna existe antes de intentar renombrarla
-        if "Tipo clasificación" in df_procesado.columns:
-            df_procesado.rename(columns={"Tipo clasificación": "Tipo Bien"}, inplace=True)
-            st.info("La columna **'Tipo clasificación'** ha sido renombrada a **'Tipo Bien'**.")
-        
-        if 'Tipo Bien' in df_procesado.columns:
-            # Creamos un diccionario con los valores a reemplazar
-            mapeo_valores = {
-                'Servicio': 'S',
-                'Producto': 'P'
-            }
-            #df_procesado['Tipo Bien'].replace(mapeo_valores, inplace=True)
-            df_procesado['Tipo Bien'] = df_procesado['Tipo Bien'].replace(mapeo_valores)
-            st.info("Valores en 'Tipo Bien' actualizados: 'Servicio' a 'S' y 'Producto' a 'P'.")
-        
-        #Creación de la nueva columna "Vendedor"
-        #if 'Vendedor' not in df_procesado.columns:
-            #df_procesado['Vendedor'] = ''
-        if 'Identificación Vendedor' in df_procesado.columns:
-            df_procesado.drop(columns=['Identificación Vendedor'], inplace=True)
-            
-        #Creación de la nueva columna "Clasificación Producto"
-        if 'Clasificación Producto' not in df_procesado.columns:
-            df_procesado['Clasificación Producto'] = ''
-            
-        #Creación de la nueva columna "Línea"
-        if 'Línea' not in df_procesado.columns:
-            df_procesado['Línea'] = ''
-            
-        #Creación de la nueva columna "Descripción Línea"
-        if 'Descripción Línea' not in df_procesado.columns:
-            df_procesado['Descripción Línea'] = ''
-            
-        #Creación de la nueva columna "Sublínea"
-        if 'Sublínea' not in df_procesado.columns:
-            df_procesado['Sublínea'] = ''
-            
-        #Creación de la nueva columna "Descripción Sublínea"
-        if 'Descripción Sublínea' not in df_procesado.columns:
-            df_procesado['Descripción Sublínea'] = ''
-            
-        
-        #Se define el orden y la selección final de las columnas
-        columnas_finales = [
-            # Columnas del lado izquierdo (FV)
-            'Tipo Bien', 'Clasificación Producto', 'Línea', 'Descripción Línea', 'Sublínea', 'Descripción Sublínea', 'Código', 'Nombre', 'Número comprobante', 'Numero comprobante',
-            'Fecha elaboración', 'Identificación', 'Nombre tercero', 'Vendedor', 'Cantidad',
-            'Valor unitario', 'Total', 'Tasa de cambio', 'Valor Total ME', 'Observaciones',
-            
-            # Columnas del lado derecho (REL_)
-            'REL_Número comprobante', 'REL_Consecutivo',
-            'REL_Factura proveedor', 'REL_Identificación', 'REL_Nombre tercero', 'REL_Cantidad',
-            'REL_Valor unitario',  'REL_Tasa de cambio', 'REL_Total', 'REL_Valor Total ME'
-        ]
-        
-        # Filtrar la lista para incluir solo las columnas que realmente existen en el DataFrame
-        # Esto hace el código más robusto si alguna columna faltara
-        columnas_existentes_ordenadas = [col for col in columnas_finales if col in df_procesado.columns]
 
-        # Reordenar y eliminar las columnas no deseadas de una sola vez
-        df_procesado = df_procesado[columnas_existentes_ordenadas]
+        # 6.1. Relacionamiento con documentos sin pareja de exports anteriores
+        pendientes = resumen["pendientes"]
+        if pendientes:
+            if pendientes["parejas_fv_nuevas"] or pendientes["parejas_fuente_nuevas"]:
+                st.success(f"Relaciones con meses anteriores: {pendientes['parejas_fv_nuevas']} FV de este archivo con DS/FC anteriores y {pendientes['parejas_fuente_nuevas']} DS/FC de este archivo con FV anteriores (se agregan al final).")
+            st.info(f"Documentos que siguen esperando pareja: {pendientes['fv_pendientes']} FV y {pendientes['fuente_pendientes']} DS/FC.")
 
+        # 7. Formato final ('Tipo Bien' con S/P y columnas en su orden)
+        if "Tipo clasificación" in columnas_leidas:
+            st.info("La columna **'Tipo clasificación'** ha sido renombrada a **'Tipo Bien'** con los valores 'S' y 'P'.")
         st.success("Columnas reorganizadas y limpiadas con éxito.")
- 
+
         st.success("¡Procesamiento completado con éxito!")
-        
-        
-        
+
         return df_procesado
 
     except Exception as e:
@@ -0,0 +1,73 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from extractor_siigo import PATRONES_OBSERVACIONES, PATRONES_REFERENCIA, extraer_etiquetas
+
+# ==============================================================================
+# BENCHMARK DE LA EXTRACCIÓN DE 'Observaciones' Y 'Referencia fábrica'
+# ==============================================================================
+# Compara el recorrido anterior (un str.extract por campo sobre toda la columna:
+# tres pasadas para 'Observaciones' y dos para 'Referencia fábrica') con
+# extraer_etiquetas, que recorre cada columna una vez y aplica los patrones solo a
+# los valores distintos. Se mide con observaciones repetidas por factura (caso
+# normal), con cerca de la mitad distintas (alrededor de FRACCION_MAXIMA_DISTINTOS)
+# y con todas distintas (texto libre, peor caso: no debe quedar más lento que antes).
+PLANTILLAS_OBSERVACIONES = np.array([
+    '"Hardware" {4,101.36} (800000012) Pedido ',
+    'Venta "Software" licencias ',
+    '{3990} ajuste de tasa ',
+    'Soporte (900123456) "Servicio" {4.050,5} ',
+    'Sin observaciones ',
+    'nan',
+])
+PLANTILLAS_REFERENCIA = np.array(['(LIN01) {SUB01}', '(LIN02) {SUB07}', '(LIN03)', 'SIN REF', 'nan'])
+
+
+def generar_columnas(num_filas, facturas_distintas, semilla=0):
+    """Genera 'Observaciones' y 'Referencia fábrica' sintéticas; None en facturas_distintas = todas distintas."""
+    rng = np.random.default_rng(semilla)
+    sufijos = np.arange(num_filas) if facturas_distintas is None else rng.integers(0, facturas_distintas, num_filas)
+    observaciones = np.char.add(rng.choice(PLANTILLAS_OBSERVACIONES, num_filas), sufijos.astype(str))
+    referencias = np.char.add(rng.choice(PLANTILLAS_REFERENCIA, num_filas), rng.integers(0, 500, num_filas).astype(str))
+    return pd.Series(observaciones).astype(str), pd.Series(referencias).astype(str)
+
+
+def extraer_por_campo(serie, patrones):
+    """Réplica del recorrido anterior: un str.extract completo por cada campo."""
+    return pd.DataFrame({nombre: serie.str.extract(patron, expand=False) for nombre, patron in patrones.items()})
+
+
+def medir(funcion, *args, repeticiones=3):
+    """Mejor tiempo de varias repeticiones (str.extract varía bastante entre corridas)."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos), resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la extracción de campos marcados.")
+    parser.add_argument("--filas", type=int, default=1_000_000, help="Filas de las columnas sintéticas.")
+    argumentos = parser.parse_args()
+
+    casos = [("5.000 facturas", 5_000), ("Filas/2 facturas", argumentos.filas // 2), ("Todas distintas", None)]
+    print(f"{'Caso':<16} | {'Columna':<18} | {'Distintos':>9} | {'Por campo (s)':>13} | {'Una pasada (s)':>14} | {'Aceleración':>11}")
+    print("-" * 96)
+
+    for nombre_caso, facturas_distintas in casos:
+        observaciones, referencias = generar_columnas(argumentos.filas, facturas_distintas)
+        for nombre_columna, serie, patrones in [
+            ("Observaciones", observaciones, PATRONES_OBSERVACIONES),
+            ("Referencia fábrica", referencias, PATRONES_REFERENCIA),
+        ]:
+            tiempo_anterior, esperado = medir(extraer_por_campo, serie, patrones)
+            tiempo_nuevo, obtenido = medir(extraer_etiquetas, serie, patrones)
+            pd.testing.assert_frame_equal(esperado, obtenido)
+            distintos = serie.nunique(dropna=False) / len(serie)
+            print(f"{nombre_caso:<16} | {nombre_columna:<18} | {distintos:9.0%} | {tiempo_anterior:13.3f} | {tiempo_nuevo:14.3f} | "
+                  f"{tiempo_anterior / tiempo_nuevo:10.1f}x")
@@ -0,0 +1,107 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from cache_siigo import leer_siigo_con_cache
+from lector_siigo import FILAS_ENCABEZADO_SIIGO, leer_siigo_por_bloques
+
+# ==============================================================================
+# BENCHMARK DE MEMORIA DE LA LECTURA DEL EXPORT DE SIIGO
+# ==============================================================================
+# Compara la memoria máxima (tracemalloc) y el tiempo de pd.read_excel con la
+# lectura por bloques de lector_siigo.py sobre un export sintético con las 7 filas
+# de encabezado de Siigo. Para la lectura por bloques se recorren los bloques sin
+# concatenarlos, que es como la consume el procesamiento por bloques. Al final se
+# lee dos veces con cache_siigo.py: la segunda lectura tiene que salir de la caché
+# y dar los mismos bloques, aunque 'Código' mezcle números y textos.
+TAMANOS_BLOQUE = [1_000, 5_000, 20_000]
+
+
+def generar_export_siigo(ruta, num_filas, semilla=0):
+    """Escribe un .xlsx con 7 filas de encabezado y columnas parecidas a las del export de Siigo."""
+    rng = np.random.default_rng(semilla)
+    fechas = pd.date_range("2025-01-01", "2025-12-31", freq="D")
+    df = pd.DataFrame({
+        "Tipo clasificación": rng.choice(["Producto", "Servicio", None], num_filas),
+        "Comprobante": rng.choice(["FV-1", "FV-2", "DS-1", "FC-1"], num_filas),
+        "Consecutivo": rng.integers(1, 50_000, num_filas),
+        "Fecha elaboración": pd.Series(rng.choice(fechas, num_filas)).dt.strftime('%d/%m/%Y'),
+        "Identificación": rng.integers(800_000_000, 999_999_999, num_filas),
+        "Nombre tercero": rng.choice(["CLIENTE A S.A.S.", "CLIENTE B LTDA", "PROVEEDOR C"], num_filas),
+        # Códigos numéricos y alfanuméricos, como en los exports reales
+        "Código": [int(c) if c % 5 else f"P{c:03d}" for c in rng.integers(100, 999, num_filas)],
+        "Referencia fábrica": rng.choice(["LIN-SUB-001", "ABC-XY-77", "SIN REF"], num_filas),
+        "Observaciones": rng.choice(["Pedido 123...Hardware", "Soporte...Servicio", ""], num_filas),
+        "Cantidad": rng.integers(1, 20, num_filas),
+        "Valor unitario": rng.uniform(1_000, 5_000_000, num_filas).round(2),
+        "Tasa de cambio": rng.choice([0.0, 4100.5, 4200.25], num_filas),
+    })
+    with pd.ExcelWriter(ruta, engine="xlsxwriter") as writer:
+        hoja = writer.book.add_worksheet("Sheet1")
+        writer.sheets["Sheet1"] = hoja
+        for fila, texto in enumerate(["Movimiento de ventas", "EMPRESA DE PRUEBA S.A.S.", "Desde 01/01/2025 hasta 31/12/2025"]):
+            hoja.write(fila, 0, texto)
+        df.to_excel(writer, sheet_name="Sheet1", startrow=FILAS_ENCABEZADO_SIIGO, index=False)
+
+
+def medir(funcion):
+    """Devuelve (segundos, memoria máxima en MB, resultado) de ejecutar la función."""
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    resultado = funcion()
+    tiempo = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tiempo, pico / 1024 ** 2, resultado
+
+
+def recorrer_bloques(ruta, tamano_bloque):
+    """Consume los bloques uno a uno y devuelve el total de filas leídas."""
+    return sum(len(bloque) for bloque in leer_siigo_por_bloques(ruta, tamano_bloque=tamano_bloque))
+
+
+def leer_con_cache(ruta, tamano_bloque, ruta_cache):
+    """Lee el export con la caché y devuelve (bloques, True si salieron de la caché)."""
+    detalles = {}
+    bloques = list(leer_siigo_con_cache(ruta, tamano_bloque=tamano_bloque, ruta_cache=ruta_cache, detalles=detalles))
+    return bloques, detalles["desde_cache"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de memoria de la lectura del export de Siigo.")
+    parser.add_argument("--filas", type=int, nargs="+", default=[20_000, 100_000], help="Filas de los exports sintéticos.")
+    argumentos = parser.parse_args()
+
+    print(f"{'Filas':>10} | {'Lector':<24} | {'Tiempo (s)':>10} | {'Memoria máx. (MB)':>17}")
+    print("-" * 72)
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        for num_filas in argumentos.filas:
+            ruta = os.path.join(carpeta, f"siigo_{num_filas}.xlsx")
+            generar_export_siigo(ruta, num_filas)
+
+            tiempo, pico, df = medir(lambda: pd.read_excel(ruta, skiprows=FILAS_ENCABEZADO_SIIGO))
+            print(f"{num_filas:>10,} | {'pd.read_excel':<24} | {tiempo:10.2f} | {pico:17.1f}")
+
+            for tamano_bloque in TAMANOS_BLOQUE:
+                tiempo, pico, total_filas = medir(lambda: recorrer_bloques(ruta, tamano_bloque))
+                assert total_filas == len(df), f"Se leyeron {total_filas} filas y se esperaban {len(df)}"
+                print(f"{num_filas:>10,} | {f'Por bloques ({tamano_bloque:,})':<24} | {tiempo:10.2f} | {pico:17.1f}")
+
+            ruta_cache = os.path.join(carpeta, "cache")
+            tamano_bloque = TAMANOS_BLOQUE[1]
+            tiempo, pico, (originales, desde_cache) = medir(lambda: leer_con_cache(ruta, tamano_bloque, ruta_cache))
+            assert not desde_cache, "La primera lectura no debería salir de la caché"
+            print(f"{num_filas:>10,} | {'Caché (1.ª lectura)':<24} | {tiempo:10.2f} | {pico:17.1f}")
+
+            tiempo, pico, (cacheados, desde_cache) = medir(lambda: leer_con_cache(ruta, tamano_bloque, ruta_cache))
+            assert desde_cache, "La segunda lectura del mismo export debería salir de la caché"
+            assert len(cacheados) == len(originales)
+            for original, cacheado in zip(originales, cacheados):
+                pd.testing.assert_frame_equal(cacheado, original)
+            print(f"{num_filas:>10,} | {'Caché (2.ª lectura)':<24} | {tiempo:10.2f} | {pico:17.1f}")
@@ -0,0 +1,152 @@
+import argparse
+import io
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.worksheet.table import Table
+
+from escritor_xlsx import anexar_filas_xlsx
+
+# ==============================================================================
+# TIEMPOS DE LECTURA DEL TRM POR VARIANTE
+# ==============================================================================
+# actualizar_archivo_trm abría los mismos bytes tres veces: openpyxl completo para
+# los encabezados, pd.read_excel para las filas y openpyxl completo otra vez para
+# añadir. Este script mide cada paso de esa secuencia y de las alternativas sobre
+# el mismo libro (--archivo para un TRM4.xlsx real; si no, uno sintético con la
+# hoja "Datos", una Tabla y fórmulas en D, AJ y AK):
+#   original        Encabezados (openpyxl) + filas (read_excel) + libro para añadir.
+#   lectura_unica   Encabezados y filas de un solo read_excel + libro para añadir.
+#   lectura_xml     Un solo read_excel + filas insertadas en el XML (escritor_xlsx.py),
+#                   lo que hace ahora la aplicación cuando hay filas nuevas.
+#   sin_nuevas      Solo el read_excel (cuando no hay nada que añadir).
+#   libro_unico     Un solo openpyxl completo del que salen también las filas. Las
+#                   columnas con fórmulas traen el texto de la fórmula y no su valor,
+#                   por eso la aplicación no usa esta variante.
+NOMBRE_HOJA = "Datos"
+NUM_COLUMNAS_TRM = 38
+FILAS_NUEVAS = 500
+
+
+def generar_trm(num_filas, semilla=0):
+    """Bytes de un TRM sintético con num_filas en la hoja "Datos"."""
+    rng = np.random.default_rng(semilla)
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.title = NOMBRE_HOJA
+    hoja.append([f"Columna {i}" for i in range(NUM_COLUMNAS_TRM)])
+    textos = [f"CLIENTE {i} S.A.S." for i in range(1_000)]
+    for fila in range(2, num_filas + 2):
+        valores = [2025, int(rng.integers(1, 13)), "Colombia", f'=IFERROR(VLOOKUP(R{fila},vendedor!$B:$C,2,FALSE),"")']
+        valores += [textos[int(rng.integers(0, len(textos)))] if i % 3 else float(rng.uniform(0, 1e6)) for i in range(4, 35)]
+        valores += [f"=IFERROR(1-(AH{fila}/W{fila}),0)", f"=W{fila}-AH{fila}"]
+        hoja.append(valores[:NUM_COLUMNAS_TRM])
+    hoja.add_table(Table(displayName="TablaDatos", ref=f"A1:AL{num_filas + 1}"))
+    salida = io.BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+
+class Cronometro:
+    """Acumula los segundos de cada paso de una variante."""
+
+    def __init__(self):
+        self.tiempos = {}
+
+    def medir(self, paso, funcion, *args, **kwargs):
+        inicio = time.perf_counter()
+        resultado = funcion(*args, **kwargs)
+        self.tiempos[paso] = self.tiempos.get(paso, 0.0) + time.perf_counter() - inicio
+        return resultado
+
+
+def _encabezados_openpyxl(contenido):
+    libro = openpyxl.load_workbook(io.BytesIO(contenido))
+    return [celda.value for celda in libro[NOMBRE_HOJA][1] if celda.value is not None]
+
+
+def _filas_read_excel(contenido):
+    return pd.read_excel(io.BytesIO(contenido), sheet_name=NOMBRE_HOJA, engine="openpyxl")
+
+
+def _cargar_libro(contenido):
+    return openpyxl.load_workbook(io.BytesIO(contenido))
+
+
+def _filas_de_libro(libro):
+    filas = libro[NOMBRE_HOJA].iter_rows(values_only=True)
+    encabezados = next(filas)
+    return pd.DataFrame(list(filas), columns=encabezados)
+
+
+def _anadir_y_guardar(libro, filas_nuevas):
+    hoja = libro[NOMBRE_HOJA]
+    for fila in filas_nuevas:
+        hoja.append(fila)
+    salida = io.BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+
+def medir_variantes(contenido, filas_nuevas):
+    """
+    Corre cada variante sobre los mismos bytes.
+
+    Returns:
+        pandas.DataFrame: Segundos por paso (filas) y variante (columnas), con el total.
+    """
+    variantes = {}
+
+    c = Cronometro()
+    c.medir("encabezados (openpyxl completo)", _encabezados_openpyxl, contenido)
+    c.medir("filas (read_excel)", _filas_read_excel, contenido)
+    libro = c.medir("libro para añadir (openpyxl completo)", _cargar_libro, contenido)
+    c.medir("añadir y guardar", _anadir_y_guardar, libro, filas_nuevas)
+    variantes["original"] = c.tiempos
+
+    c = Cronometro()
+    c.medir("filas (read_excel)", _filas_read_excel, contenido)
+    libro = c.medir("libro para añadir (openpyxl completo)", _cargar_libro, contenido)
+    c.medir("añadir y guardar", _anadir_y_guardar, libro, filas_nuevas)
+    variantes["lectura_unica"] = c.tiempos
+
+    c = Cronometro()
+    c.medir("filas (read_excel)", _filas_read_excel, contenido)
+    c.medir("añadir en el XML", anexar_filas_xlsx, contenido, NOMBRE_HOJA, filas_nuevas)
+    variantes["lectura_xml"] = c.tiempos
+
+    c = Cronometro()
+    c.medir("filas (read_excel)", _filas_read_excel, contenido)
+    variantes["sin_nuevas"] = c.tiempos
+
+    c = Cronometro()
+    libro = c.medir("libro para añadir (openpyxl completo)", _cargar_libro, contenido)
+    c.medir("filas (del libro cargado)", _filas_de_libro, libro)
+    c.medir("añadir y guardar", _anadir_y_guardar, libro, filas_nuevas)
+    variantes["libro_unico"] = c.tiempos
+
+    reporte = pd.DataFrame(variantes)
+    reporte.loc["TOTAL"] = reporte.sum()
+    return reporte
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiempo de cada paso de lectura del TRM por variante.")
+    parser.add_argument("--archivo", help="TRM real (.xlsx) con la hoja 'Datos'; si no se da, se genera uno sintético.")
+    parser.add_argument("--filas", type=int, default=10_000, help="Filas del TRM sintético cuando no se da --archivo.")
+    argumentos = parser.parse_args()
+
+    if argumentos.archivo:
+        with open(argumentos.archivo, "rb") as f:
+            contenido = f.read()
+    else:
+        contenido = generar_trm(argumentos.filas)
+
+    filas_nuevas = [[2025, 1, "Colombia", None] + [f"NUEVO {i}"] * (NUM_COLUMNAS_TRM - 4) for i in range(FILAS_NUEVAS)]
+    reporte = medir_variantes(contenido, filas_nuevas)
+
+    pd.set_option("display.width", 120)
+    print(f"Libro de {len(contenido) / 1024 ** 2:.1f} MB, {FILAS_NUEVAS} filas nuevas (segundos):")
+    print(reporte.round(2).fillna("-").to_string())
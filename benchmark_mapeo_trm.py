@@ -0,0 +1,71 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from mapeo_trm import MAPEO_COLUMNAS_TRM, mapear_filas_trm
+
+# ==============================================================================
+# BENCHMARK DEL MAPEO DE REGISTROS A LA HOJA "Datos" DEL TRM
+# ==============================================================================
+# Compara mapear_filas_trm (por columnas, según MAPEO_COLUMNAS_TRM) con el armado
+# fila por fila con iterrows que usaba actualizar_archivo_trm (un diccionario por
+# registro y los valores corridos 4 posiciones), y verifica que den lo mismo.
+TAMANOS = [10_000, 50_000, 100_000]
+TAMANO_MAXIMO_ITERROWS = 50_000  # El recorrido fila por fila es demasiado lento por encima de esto
+NUM_COLUMNAS_TRM = 38
+
+
+def generar_datos(num_filas, semilla=0):
+    """Registros procesados sintéticos con las columnas de MAPEO_COLUMNAS_TRM."""
+    rng = np.random.default_rng(semilla)
+    return pd.DataFrame({
+        columna: rng.uniform(0, 1e6, num_filas) if i % 3 == 0
+        else pd.Series(rng.integers(0, 500, num_filas)).map(lambda k, c=columna: f"{c} {k}")
+        for i, columna in enumerate(MAPEO_COLUMNAS_TRM.values())
+    })
+
+
+def mapear_iterrows(df_datos_procesados, columnas_destino, anio, mes):
+    """Versión anterior: un diccionario por fila y los valores desde la columna E."""
+    filas = []
+    for _, fila_procesada in df_datos_procesados.iterrows():
+        nueva_fila = {col: "" for col in columnas_destino}
+        nueva_fila[columnas_destino[0]] = anio
+        nueva_fila[columnas_destino[1]] = mes
+        nueva_fila[columnas_destino[2]] = "Colombia"
+        for i, valor in enumerate(fila_procesada.values):
+            if i + 4 < len(columnas_destino):
+                nueva_fila[columnas_destino[i + 4]] = valor
+        filas.append(nueva_fila)
+    return pd.DataFrame(filas)[columnas_destino]
+
+
+def medir(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiempo del mapeo de registros al TRM.")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS, help="Cantidades de registros a medir.")
+    argumentos = parser.parse_args()
+
+    columnas_destino = [f"Columna {i}" for i in range(NUM_COLUMNAS_TRM)]
+    resultados = []
+    for num_filas in argumentos.tamanos:
+        df = generar_datos(num_filas)
+        nuevo, segundos_columnas = medir(mapear_filas_trm, df, columnas_destino, 2025, 5)
+        segundos_iterrows = None
+        if num_filas <= TAMANO_MAXIMO_ITERROWS:
+            anterior, segundos_iterrows = medir(mapear_iterrows, df, columnas_destino, 2025, 5)
+            pd.testing.assert_frame_equal(anterior.astype(object), nuevo.astype(object))
+        resultados.append({
+            "filas": num_filas,
+            "por_columnas_ms": round(segundos_columnas * 1000, 1),
+            "iterrows_ms": round(segundos_iterrows * 1000, 1) if segundos_iterrows is not None else "-",
+        })
+
+    print(pd.DataFrame(resultados).to_string(index=False))
@@ -0,0 +1,97 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from esquema_siigo import ESQUEMA_SIIGO
+from lector_siigo import TAMANO_BLOQUE, leer_siigo_por_bloques
+from pipeline_siigo import COLUMNAS_FINALES, nuevo_resumen, procesar_bloques, separar_documentos
+
+# ==============================================================================
+# REPORTE DE MEMORIA DEL ESQUEMA DE TIPOS
+# ==============================================================================
+# Mide con memory_usage(deep=True) lo que ocupan los documentos separados (FV,
+# DS/FC y otros), que son los que quedan en memoria entre ejecuciones, con los
+# tipos que infiere el lector y con el esquema de esquema_siigo.py. Con --archivo
+# se mide un export real; si no, bloques sintéticos generados en memoria.
+COMPROBANTES = ["FV-1", "FV-2", "DS-1", "FC-1", "NC-1", "RC-1"]
+
+
+def generar_bloques_siigo(num_filas, tamano_bloque=TAMANO_BLOQUE, semilla=0):
+    """Bloques sintéticos con las columnas y la repetición de valores de un export de Siigo."""
+    rng = np.random.default_rng(semilla)
+    terceros = [f"CLIENTE {i} S.A.S." for i in range(1_500)]
+    productos = [f"PRODUCTO {i}" for i in range(3_000)]
+    referencias = [f"(LIN{i % 40:02d}) {{SUB{i % 300:03d}}}" for i in range(3_000)]
+    observaciones = [f'"Hardware" {{4,1{i % 90:02d}.36}} ({900_000_000 + i % 800}) Pedido {i}' for i in range(20_000)]
+
+    for inicio in range(0, num_filas, tamano_bloque):
+        n = min(tamano_bloque, num_filas - inicio)
+        producto = rng.integers(0, len(productos), n)
+        df_bloque = pd.DataFrame({
+            "Tipo clasificación": pd.Series(rng.choice(["Producto", "Servicio", None], n, p=[0.6, 0.35, 0.05]), dtype=str),
+            "Número comprobante": pd.Series(rng.choice(COMPROBANTES, n), dtype=str),
+            "Consecutivo": rng.integers(1, 50_000, n),
+            "Factura proveedor": pd.Series(rng.choice([None, "FP-100", "FP-200"], n), dtype=str),
+            "Fecha elaboración": pd.Series(rng.choice(pd.date_range("2025-01-01", periods=365).strftime("%d/%m/%Y"), n), dtype=str),
+            "Identificación": rng.integers(900_000_000, 900_000_800, n),
+            "Nombre tercero": pd.Series(rng.choice(terceros, n), dtype=str),
+            "Identificación Vendedor": rng.choice([1_010_101, 2_020_202, 3_030_303, 4_040_404], n),
+            "Código": producto,
+            "Nombre": pd.Series(np.asarray(productos)[producto], dtype=str),
+            "Referencia fábrica": pd.Series(np.asarray(referencias)[producto], dtype=str),
+            "Observaciones": pd.Series(rng.choice(observaciones, n), dtype=str),
+            "Cantidad": rng.integers(1, 20, n),
+            "Valor unitario": rng.uniform(1_000, 5_000_000, n).round(2),
+            "Total": np.zeros(n),
+            "Tasa de cambio": rng.choice([0.0, 4100.5, 4200.25], n),
+        })
+        df_bloque.index = pd.RangeIndex(inicio, inicio + n)
+        yield df_bloque
+
+
+def separar(bloques, esquema):
+    """Limpieza y separación completas; devuelve (partes, segundos)."""
+    inicio = time.perf_counter()
+    resumen = nuevo_resumen()
+    partes = separar_documentos(procesar_bloques(bloques, resumen, esquema=esquema), resumen, sorted(set(COLUMNAS_FINALES)))
+    return partes, time.perf_counter() - inicio
+
+
+def memoria_por_columna(partes):
+    """Bytes por columna sumando destino, fuente y otros."""
+    totales = {}
+    for nombre in ("destino", "fuente", "otros"):
+        if partes[nombre] is None:
+            continue
+        for columna, tamano in partes[nombre].memory_usage(deep=True, index=False).items():
+            totales[f"{nombre}: {columna}"] = tamano
+    return pd.Series(totales)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memoria de los documentos separados con y sin esquema de tipos.")
+    parser.add_argument("--archivo", help="Export real de Siigo (.xlsx); si no se da, se generan datos sintéticos.")
+    parser.add_argument("--filas", type=int, default=200_000, help="Filas sintéticas cuando no se da --archivo.")
+    argumentos = parser.parse_args()
+
+    def bloques():
+        if argumentos.archivo:
+            return leer_siigo_por_bloques(argumentos.archivo)
+        return generar_bloques_siigo(argumentos.filas)
+
+    partes_sin, tiempo_sin = separar(bloques(), None)
+    partes_con, tiempo_con = separar(bloques(), ESQUEMA_SIIGO)
+
+    sin_esquema = memoria_por_columna(partes_sin)
+    con_esquema = memoria_por_columna(partes_con)
+    reporte = pd.DataFrame({"Sin esquema (MB)": sin_esquema, "Con esquema (MB)": con_esquema}) / 1024 ** 2
+    reporte = reporte[reporte["Sin esquema (MB)"] >= 0.01].sort_values("Sin esquema (MB)", ascending=False)
+
+    pd.set_option("display.width", 120)
+    print(reporte.round(2).to_string())
+    print("-" * 72)
+    print(f"{'Total':<40} {sin_esquema.sum() / 1024 ** 2:10.1f} MB -> {con_esquema.sum() / 1024 ** 2:.1f} MB "
+          f"({con_esquema.sum() / sin_esquema.sum():.0%})")
+    print(f"{'Tiempo de limpieza y separación':<40} {tiempo_sin:10.2f} s  -> {tiempo_con:.2f} s")
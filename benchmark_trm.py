@@ -0,0 +1,132 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+from servidor_trm_local import iniciar_servidor_trm
+from trm_datos_abiertos import obtener_trm_por_fechas, rellenar_tasa_de_cambio
+
+# ==============================================================================
+# BENCHMARK DEL RELLENADO DE 'Tasa de cambio'
+# ==============================================================================
+# Compara el rellenado por columnas (rellenar_tasa_de_cambio) con el recorrido
+# fila por fila con iterrows que se usaba antes. La TRM se resuelve con una tabla
+# en memoria para medir solo el costo del rellenado, sin red.
+#
+# Con --servidor se mide además la consulta de la TRM contra servidor_trm_local.py,
+# con latencia y errores simulados, sin depender de www.datos.gov.co.
+TAMANOS = [10_000, 50_000, 100_000, 200_000, 400_000]
+TAMANO_MAXIMO_ITERROWS = 50_000  # El recorrido fila por fila es demasiado lento por encima de esto
+
+
+def generar_datos(num_filas, semilla=0):
+    """Genera un export sintético con un año de fechas y ~40% de tasas vacías o en 0."""
+    rng = np.random.default_rng(semilla)
+    fechas = pd.date_range("2025-01-01", "2025-12-31", freq="D")
+    return pd.DataFrame({
+        "Fecha elaboración": pd.Series(rng.choice(fechas, num_filas)).dt.strftime('%d/%m/%Y'),
+        "Tasa de cambio": rng.choice([0.0, np.nan, 4100.5, 4200.25, 3990.0], num_filas),
+    })
+
+
+TRM_SINTETICA = pd.Series(
+    np.linspace(3900, 4300, 365),
+    index=pd.date_range("2025-01-01", "2025-12-31", freq="D")
+)
+
+
+def resolver_trm_sintetica(fechas):
+    return TRM_SINTETICA[TRM_SINTETICA.index.isin(pd.DatetimeIndex(fechas))]
+
+
+def rellenar_con_iterrows(df):
+    """Réplica del rellenado anterior, fila por fila (sin las peticiones HTTP)."""
+    df['Fecha elaboración_dt'] = pd.to_datetime(df['Fecha elaboración'], format='%d/%m/%Y', errors='coerce')
+    for index, row in df.iterrows():
+        tasa_actual = row["Tasa de cambio"]
+        fecha_elaboracion_dt = row["Fecha elaboración_dt"]
+        if (pd.isna(tasa_actual) or tasa_actual == 0) and pd.notna(fecha_elaboracion_dt):
+            trm_valor = TRM_SINTETICA.get(pd.Timestamp(fecha_elaboracion_dt.strftime('%Y-%m-%d')))
+            if trm_valor is not None:
+                df.at[index, "Tasa de cambio"] = trm_valor
+    df.drop(columns=['Fecha elaboración_dt'], inplace=True)
+
+
+def medir(funcion, df):
+    inicio = time.perf_counter()
+    funcion(df)
+    return time.perf_counter() - inicio
+
+
+def consultar_fecha_por_fecha(fechas, base_url):
+    """Réplica de la consulta anterior: una petición secuencial por fecha exacta."""
+    resultado = {}
+    for fecha in fechas:
+        response = requests.get(base_url, params={"vigenciadesde": f"{fecha:%Y-%m-%d}T00:00:00.000"}, timeout=10)
+        if response.ok and response.json():
+            resultado[fecha] = float(response.json()[0]["valor"])
+        time.sleep(0.05)
+    return pd.Series(resultado, dtype=float)
+
+
+def benchmark_contra_servidor(latencia, tasa_errores, num_filas):
+    """Mide las estrategias de consulta de la TRM contra el servidor local."""
+    servidor, url_base = iniciar_servidor_trm(latencia=latencia, jitter=latencia / 2, tasa_errores=tasa_errores)
+    estadisticas = servidor.RequestHandlerClass.estadisticas
+    df = generar_datos(num_filas)
+    fechas = pd.to_datetime(df["Fecha elaboración"], format='%d/%m/%Y').unique()
+
+    estrategias = [
+        ("Fecha por fecha (anterior)", lambda: consultar_fecha_por_fecha(fechas, url_base)),
+        ("Rango + as-of", lambda: obtener_trm_por_fechas(fechas, base_url=url_base, ruta_almacen=None, modo="rango")),
+        ("Concurrente", lambda: obtener_trm_por_fechas(fechas, base_url=url_base, ruta_almacen=None, modo="concurrente")),
+    ]
+
+    print(f"Servidor local: latencia {latencia:.3f}s (+jitter {latencia / 2:.3f}s), errores {tasa_errores:.0%}, "
+          f"{num_filas:,} filas, {len(fechas)} fechas distintas")
+    print(f"{'Estrategia':<28} | {'Tiempo (s)':>10} | {'Peticiones':>10} | {'Fechas con TRM':>14}")
+    print("-" * 72)
+    for nombre, estrategia in estrategias:
+        peticiones_antes = estadisticas["peticiones"]
+        inicio = time.perf_counter()
+        trm_por_fecha = estrategia()
+        tiempo = time.perf_counter() - inicio
+        print(f"{nombre:<28} | {tiempo:10.2f} | {estadisticas['peticiones'] - peticiones_antes:>10} | {len(trm_por_fecha):>14}")
+
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del rellenado y la consulta de la TRM.")
+    parser.add_argument("--servidor", action="store_true", help="Medir también la consulta contra el servidor local.")
+    parser.add_argument("--latencia", type=float, default=0.1, help="Latencia simulada por petición (segundos).")
+    parser.add_argument("--tasa-errores", type=float, default=0.05, help="Fracción de peticiones que fallan con 429/503.")
+    parser.add_argument("--filas", type=int, default=20_000, help="Filas del export sintético para --servidor.")
+    argumentos = parser.parse_args()
+
+    print(f"{'Filas':>10} | {'Vectorizado (s)':>15} | {'µs/fila':>8} | {'iterrows (s)':>12} | {'Aceleración':>11}")
+    print("-" * 70)
+
+    for num_filas in TAMANOS:
+        df_base = generar_datos(num_filas)
+
+        df_vectorizado = df_base.copy()
+        tiempo_vectorizado = medir(lambda df: rellenar_tasa_de_cambio(df, resolver_trm=resolver_trm_sintetica), df_vectorizado)
+
+        if num_filas <= TAMANO_MAXIMO_ITERROWS:
+            df_iterrows = df_base.copy()
+            tiempo_iterrows = medir(rellenar_con_iterrows, df_iterrows)
+            pd.testing.assert_series_equal(df_vectorizado["Tasa de cambio"], df_iterrows["Tasa de cambio"])
+            texto_iterrows = f"{tiempo_iterrows:12.3f}"
+            texto_aceleracion = f"{tiempo_iterrows / tiempo_vectorizado:10.0f}x"
+        else:
+            texto_iterrows = f"{'-':>12}"
+            texto_aceleracion = f"{'-':>11}"
+
+        print(f"{num_filas:>10,} | {tiempo_vectorizado:15.4f} | {tiempo_vectorizado / num_filas * 1e6:8.3f} | {texto_iterrows} | {texto_aceleracion}")
+
+    if argumentos.servidor:
+        print()
+        benchmark_contra_servidor(argumentos.latencia, argumentos.tasa_errores, argumentos.filas)
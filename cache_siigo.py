@@ -0,0 +1,262 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from lector_siigo import TAMANO_BLOQUE, leer_siigo_por_bloques
+
+# ==============================================================================
+# CACHÉ EN PARQUET DE LOS EXPORTS DE SIIGO YA LEÍDOS
+# ==============================================================================
+# La lectura con openpyxl es el paso más lento del procesamiento. Los bloques ya
+# tipados se guardan en Parquet bajo el SHA-256 del archivo subido, así que volver
+# a procesar el mismo export los lee de disco sin abrir el .xlsx. Cada export es
+# una carpeta con un Parquet por bloque: un bloque puede tener una columna numérica
+# y otro la misma columna con números y textos (p. ej. 'Código' con 1001 y 'P001'),
+# y así cada uno conserva sus tipos. Arrow no guarda columnas que mezclan tipos, así
+# que esas se escriben como texto más una columna con el tipo de cada valor
+# (TIPOS_MIXTOS) y se reconstruyen al leer. La carpeta de la caché tiene un tamaño
+# máximo y se vacía empezando por las entradas usadas hace más tiempo.
+RUTA_CACHE_SIIGO = os.environ.get(
+    "SIIGO_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_siigo")
+)
+TAMANO_MAXIMO_CACHE = int(float(os.environ.get("SIIGO_CACHE_MAX_MB", "500")) * 1024 ** 2)
+TAMANO_LECTURA_HASH = 1024 * 1024  # Bytes por lectura al calcular el SHA-256
+CLAVE_FILAS_SALTADAS = b"siigo_filas_saltadas"
+CLAVE_COLUMNAS_MIXTAS = b"siigo_columnas_mixtas"
+PREFIJO_TIPO_MIXTO = "__tipo__"
+# Tipo de cada valor de una columna mixta -> cómo se reconstruye desde su texto
+TIPOS_MIXTOS = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": lambda texto: texto == "True",
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "Timestamp": pd.Timestamp,
+}
+
+
+def huella_archivo(archivo):
+    """
+    Calcula el SHA-256 del contenido del archivo sin cargarlo entero en memoria.
+
+    Args:
+        archivo (str or file-like): Ruta o archivo subido (se deja al inicio después de leerlo).
+
+    Returns:
+        str: Huella en hexadecimal.
+    """
+    sha256 = hashlib.sha256()
+    if isinstance(archivo, (str, os.PathLike)):
+        with open(archivo, "rb") as contenido:
+            for parte in iter(lambda: contenido.read(TAMANO_LECTURA_HASH), b""):
+                sha256.update(parte)
+    else:
+        archivo.seek(0)
+        for parte in iter(lambda: archivo.read(TAMANO_LECTURA_HASH), b""):
+            sha256.update(parte)
+        archivo.seek(0)
+    return sha256.hexdigest()
+
+
+def _ruta_entrada(huella, filas_a_saltar, ruta_cache):
+    """Carpeta de un export; la detección automática y cada skiprows fijo se guardan aparte."""
+    sufijo = "auto" if filas_a_saltar is None else f"saltar{filas_a_saltar}"
+    return os.path.join(ruta_cache, f"{huella}-{sufijo}")
+
+
+def _tamano_carpeta(ruta):
+    """Bytes de los archivos de una carpeta de la caché (0 si otra sesión la borró)."""
+    try:
+        return sum(entrada.stat().st_size for entrada in os.scandir(ruta) if entrada.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+def limpiar_cache(ruta_cache=RUTA_CACHE_SIIGO, tamano_maximo=TAMANO_MAXIMO_CACHE):
+    """
+    Borra las entradas usadas hace más tiempo hasta que la caché quepa en tamano_maximo.
+
+    Returns:
+        int: Número de entradas borradas.
+    """
+    entradas = []
+    for nombre in os.listdir(ruta_cache):
+        ruta = os.path.join(ruta_cache, nombre)
+        if nombre.endswith(".tmp") or not os.path.isdir(ruta):
+            continue  # Escrituras en curso de otras sesiones
+        try:
+            estado = os.stat(ruta)
+        except FileNotFoundError:
+            continue  # Otra sesión la borró mientras se listaba
+        entradas.append((estado.st_mtime, _tamano_carpeta(ruta), ruta))
+
+    tamano_total = sum(tamano for _, tamano, _ in entradas)
+    borrados = 0
+    for _, tamano, ruta in sorted(entradas):
+        if tamano_total <= tamano_maximo:
+            break
+        shutil.rmtree(ruta, ignore_errors=True)
+        borrados += 1
+        tamano_total -= tamano
+    return borrados
+
+
+def _tabla_arrow(df_bloque, filas_saltadas):
+    """
+    Convierte un bloque a tabla de Arrow. Las columnas object con valores de varios
+    tipos se guardan como texto y su tipo por valor va en PREFIJO_TIPO_MIXTO + columna.
+
+    Raises:
+        ValueError: Si una columna mixta tiene valores de un tipo fuera de TIPOS_MIXTOS.
+    """
+    columnas_mixtas = {}
+    for columna in df_bloque.columns:
+        serie = df_bloque[columna]
+        if serie.dtype != object:
+            continue
+        presentes = serie[serie.notna()]
+        tipos = presentes.map(lambda valor: type(valor).__name__)
+        nombres_tipos = sorted(tipos.unique())
+        if len(nombres_tipos) <= 1:
+            continue
+        desconocidos = set(nombres_tipos) - set(TIPOS_MIXTOS)
+        if desconocidos:
+            raise ValueError(f"Tipos no soportados en la columna {columna}: {', '.join(sorted(desconocidos))}")
+        codigos = pd.Series(-1, index=serie.index, dtype="int8")
+        codigos[presentes.index] = tipos.map({nombre: i for i, nombre in enumerate(nombres_tipos)}).astype("int8")
+        textos = presentes.map(lambda valor: valor.isoformat() if hasattr(valor, "isoformat") else str(valor))
+        df_bloque = df_bloque.assign(**{
+            columna: textos.reindex(serie.index).astype(object).where(serie.notna(), None),
+            PREFIJO_TIPO_MIXTO + columna: codigos,
+        })
+        columnas_mixtas[columna] = nombres_tipos
+
+    tabla = pa.Table.from_pandas(df_bloque, preserve_index=False)
+    metadatos = dict(tabla.schema.metadata or {})
+    metadatos[CLAVE_FILAS_SALTADAS] = str(filas_saltadas).encode()
+    metadatos[CLAVE_COLUMNAS_MIXTAS] = json.dumps(columnas_mixtas).encode()
+    return tabla.replace_schema_metadata(metadatos)
+
+
+def _bloque_desde_tabla(tabla):
+    """Inverso de _tabla_arrow: reconstruye los valores de las columnas mixtas (object)."""
+    columnas_mixtas = json.loads((tabla.schema.metadata or {}).get(CLAVE_COLUMNAS_MIXTAS, b"{}"))
+    df_bloque = tabla.to_pandas()
+    for columna, nombres_tipos in columnas_mixtas.items():
+        codigos = df_bloque.pop(PREFIJO_TIPO_MIXTO + columna).to_numpy()
+        textos = df_bloque[columna].to_numpy(dtype=object)
+        valores = np.full(len(df_bloque), None, dtype=object)
+        for codigo, nombre_tipo in enumerate(nombres_tipos):
+            posiciones = np.flatnonzero(codigos == codigo)
+            valores[posiciones] = [TIPOS_MIXTOS[nombre_tipo](texto) for texto in textos[posiciones]]
+        df_bloque[columna] = pd.Series(valores, index=df_bloque.index, dtype=object)
+    return df_bloque
+
+
+def _leer_bloques_cache(ruta_entrada, detalles):
+    """Entrega los bloques guardados, uno por Parquet y en orden, con el mismo índice continuo del lector."""
+    rutas = sorted(entrada.path for entrada in os.scandir(ruta_entrada) if entrada.name.endswith(".parquet"))
+    if not rutas:
+        raise OSError(f"Entrada de caché sin bloques: {ruta_entrada}")
+
+    inicio = 0
+    for ruta in rutas:
+        tabla = pq.read_table(ruta)
+        if detalles is not None and inicio == 0:
+            detalles["filas_saltadas"] = int((tabla.schema.metadata or {}).get(CLAVE_FILAS_SALTADAS, b"0"))
+        df_bloque = _bloque_desde_tabla(tabla)
+        df_bloque.index = pd.RangeIndex(inicio, inicio + len(df_bloque))
+        inicio += len(df_bloque)
+        yield df_bloque
+
+
+def _guardar_bloques_cache(bloques, ruta_entrada, ruta_cache, tamano_maximo, detalles):
+    """
+    Entrega los bloques del lector y a la vez escribe cada uno en su Parquet. Si alguno
+    no se puede guardar (p. ej. un tipo de valor que Arrow no admite), se descarta la
+    entrada y el procesamiento sigue sin caché.
+    """
+    ruta_temporal = f"{ruta_entrada}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(ruta_temporal)
+    guardar = True
+    completo = False
+    num_bloques = 0
+    try:
+        for df_bloque in bloques:
+            if guardar:
+                try:
+                    tabla = _tabla_arrow(df_bloque, detalles.get("filas_saltadas", 0))
+                    pq.write_table(tabla, os.path.join(ruta_temporal, f"{num_bloques:06d}.parquet"))
+                    num_bloques += 1
+                except (pa.ArrowException, ValueError) as e:
+                    print(f"No se guardará el export en caché: {str(e).splitlines()[0]}")
+                    guardar = False
+            yield df_bloque
+        completo = True
+    finally:
+        guardado = False
+        if completo and guardar and num_bloques:
+            try:
+                # Renombrado atómico: otra sesión nunca ve una entrada a medio escribir
+                os.rename(ruta_temporal, ruta_entrada)
+                guardado = True
+            except OSError:
+                pass  # Otra sesión guardó el mismo export primero
+        if guardado:
+            limpiar_cache(ruta_cache, tamano_maximo)
+        else:
+            shutil.rmtree(ruta_temporal, ignore_errors=True)
+
+
+def leer_siigo_con_cache(archivo, filas_a_saltar=None, tamano_bloque=TAMANO_BLOQUE, ruta_cache=RUTA_CACHE_SIIGO,
+                         tamano_maximo=TAMANO_MAXIMO_CACHE, detalles=None, huella=None):
+    """
+    Igual que lector_siigo.leer_siigo_por_bloques, pero si el mismo archivo ya se leyó
+    entrega los bloques desde la caché en Parquet sin abrir el .xlsx.
+
+    Args:
+        archivo (str or file-like): Ruta o archivo .xlsx subido.
+        filas_a_saltar (int, optional): Filas antes del encabezado; None para detectarlo.
+        tamano_bloque (int): Máximo de filas por bloque.
+        ruta_cache (str): Carpeta de la caché.
+        tamano_maximo (int): Bytes máximos que ocupa la caché en disco.
+        detalles (dict, optional): Recibe 'filas_saltadas' y 'desde_cache' (bool).
+        huella (str, optional): SHA-256 del archivo si quien llama ya lo calculó (ver
+            huella_archivo); si es None se calcula aquí.
+
+    Yields:
+        pandas.DataFrame: Bloques del export, con los mismos tipos e índice que el lector.
+    """
+    detalles = {} if detalles is None else detalles
+    os.makedirs(ruta_cache, exist_ok=True)
+    ruta_entrada = _ruta_entrada(huella or huella_archivo(archivo), filas_a_saltar, ruta_cache)
+
+    if os.path.exists(ruta_entrada):
+        try:
+            # Se marca como usada recientemente para la limpieza por antigüedad
+            os.utime(ruta_entrada)
+            bloques = _leer_bloques_cache(ruta_entrada, detalles)
+            primer_bloque = next(bloques, None)
+        except (OSError, pa.ArrowException) as e:
+            print(f"Entrada de caché inválida, se lee el archivo original: {e}")
+        else:
+            detalles["desde_cache"] = True
+            if primer_bloque is not None:
+                yield primer_bloque
+                yield from bloques
+            return
+
+    detalles["desde_cache"] = False
+    bloques = leer_siigo_por_bloques(archivo, filas_a_saltar, tamano_bloque, detalles=detalles)
+    yield from _guardar_bloques_cache(bloques, ruta_entrada, ruta_cache, tamano_maximo, detalles)
@@ -7,6 +7,8 @@ from datetime import datetime
 import requests
 from msal import ConfidentialClientApplication
 
+from lector_siigo import localizar_encabezado
+
 # ==============================================================================
 # SECCIÓN 1: CONFIGURACIÓN DE SHAREPOINT Y AZURE
 # ==============================================================================
@@ -129,7 +131,7 @@ def encontrar_archivo_del_mes_en_carpeta(site_id, headers, ruta_carpeta):
 def procesar_excel_para_streamlit(uploaded_file):
     """
     Procesa el archivo de Excel subido:
-    - Ignora las primeras 7 filas al cargar el archivo (asumiendo que los encabezados están en la fila 8).
+    - Detecta la fila de encabezado (normalmente la 8) y salta las filas anteriores.
     - Elimina filas con 'Tipo clasificación' vacío.
     - Elimina columnas no deseadas.
     - Actualiza la columna 'Total'.
@@ -142,15 +144,19 @@ def procesar_excel_para_streamlit(uploaded_file):
         pandas.DataFrame or None: El DataFrame procesado o None si hay un error.
     """
     try:
-        # Usar skiprows para que Pandas lea el encabezado correcto
-        df = pd.read_excel(uploaded_file, skiprows=7) # La fila 8 (índice 7) se toma como encabezado
+        # Se busca la fila de encabezado (normalmente la 8) leyendo solo las primeras filas
+        filas_a_saltar = localizar_encabezado(uploaded_file)
+        if filas_a_saltar is None:
+            st.error("No se encontró la fila de encabezado de Siigo en las primeras filas del archivo. Por favor, verifica el formato del archivo.")
+            return None
+        df = pd.read_excel(uploaded_file, skiprows=filas_a_saltar)
 
         # Verifica si el DataFrame tiene columnas después de skiprows.
         if df.empty or df.columns.empty:
-            st.error("Parece que el archivo no tiene datos o encabezados después de saltar las primeras 7 filas. Por favor, verifica el formato del archivo.")
+            st.error(f"Parece que el archivo no tiene datos o encabezados después de saltar las primeras {filas_a_saltar} filas. Por favor, verifica el formato del archivo.")
             return None
 
-        st.info(f"Archivo cargado exitosamente. Se saltaron las primeras 7 filas. Filas iniciales (después de saltar): **{len(df)}**.")
+        st.info(f"Archivo cargado exitosamente. Se saltaron las primeras {filas_a_saltar} filas. Filas iniciales (después de saltar): **{len(df)}**.")
 
         df_procesado = df.copy()
         
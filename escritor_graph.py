@@ -0,0 +1,241 @@
+import datetime
+import math
+import os
+import re
+import time
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import requests
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+# ==============================================================================
+# AÑADIR FILAS A UNA TABLA CON LA API DE LIBROS DE GRAPH
+# ==============================================================================
+# escritor_xlsx.py evita cargar el libro en openpyxl, pero el .xlsx completo se
+# sigue descargando y subiendo con /content, así que la transferencia crece con el
+# libro y no con las filas nuevas. Aquí las filas se envían a la Tabla de Excel con
+# POST .../workbook/tables/{tabla}/rows/add, en lotes de FILAS_POR_LOTE_GRAPH y
+# dentro de una sesión de libro (workbook-session-id, con persistChanges) para que
+# Excel Online no abra y guarde el archivo en cada lote. Solo viajan las filas
+# nuevas; las fórmulas existentes, las demás hojas y los estilos los mantiene el
+# propio Excel. Las fórmulas de las filas nuevas se envían como texto '=...' con el
+# número de fila de cada una. Las fechas viajan como número de serie de Excel y,
+# después de cada lote, se les pone formato de fecha (PATCH del numberFormat del
+# rango de cada columna con fechas): sin él quedarían como 45658 y al releer el
+# libro (sin índice de huellas o con uno vencido) no coincidirían con los datos
+# nuevos, que se volverían a añadir.
+#
+# Si un lote falla después de que otros ya se guardaron, el libro queda con parte
+# de las filas: la siguiente ejecución las encuentra al deduplicar (el eTag cambió,
+# así que se lee el libro completo) y solo añade las que faltan.
+#
+# Todas las llamadas a Graph de la app (descargas, eTag, índice de huellas, subidas
+# y libros) usan URL_GRAPH, así que con la variable GRAPH_URL_BASE se pueden apuntar
+# juntas a servidor_graph_local.py.
+URL_GRAPH = os.environ.get("GRAPH_URL_BASE", "https://graph.microsoft.com/v1.0")
+FILAS_POR_LOTE_GRAPH = int(os.environ.get("SIIGO_FILAS_POR_LOTE_GRAPH", "1000"))
+TIMEOUT_GRAPH = 120
+MAX_REINTENTOS_GRAPH = 3
+# Solo se reintenta lo que Graph no aplicó (limitación de tasa); reintentar un
+# 5xx podría añadir dos veces el mismo lote
+CODIGOS_REINTENTABLES_GRAPH = {429, 503}
+# Excel guarda "m/d/yyyy" como su formato integrado de fecha corta (el NUMFMT_FECHA
+# de escritor_xlsx.py), que se muestra según la configuración regional
+FORMATO_FECHA_GRAPH = "m/d/yyyy"
+
+_RE_DIRECCION = re.compile(r"!\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?$")
+
+
+def url_libro(site_id, ruta_archivo, base_url=URL_GRAPH):
+    """URL del recurso workbook de un archivo de la biblioteca del sitio."""
+    return f"{base_url}/sites/{site_id}/drive/root:/{quote(ruta_archivo)}:/workbook"
+
+
+def valor_graph(valor):
+    """
+    Convierte un valor de pandas/numpy al JSON que acepta 'values' de Graph.
+
+    Los vacíos (None, NaN, NaT) van como "" y las fechas como número de serie de
+    Excel, igual que en escritor_xlsx.py.
+    """
+    if valor is None or valor is pd.NA:
+        return ""
+    if isinstance(valor, (bool, np.bool_)):
+        return bool(valor)
+    if isinstance(valor, (int, np.integer)):
+        return int(valor)
+    if isinstance(valor, (float, np.floating)):
+        return float(valor) if math.isfinite(valor) else ""
+    if isinstance(valor, (datetime.datetime, datetime.date)):
+        return to_excel(valor) if valor == valor else ""
+    return str(valor)
+
+
+def _es_fecha(valor):
+    """True para las fechas que valor_graph convierte a número de serie (no NaT)."""
+    return isinstance(valor, (datetime.datetime, datetime.date)) and valor == valor
+
+
+def _tramos_columnas(columnas):
+    """Agrupa índices de columna en tramos contiguos: [0, 1, 4] -> [(0, 1), (4, 4)]."""
+    tramos = []
+    for columna in sorted(columnas):
+        if tramos and tramos[-1][1] == columna - 1:
+            tramos[-1] = (tramos[-1][0], columna)
+        else:
+            tramos.append((columna, columna))
+    return tramos
+
+
+def _solicitud_graph(sesion_http, metodo, url, encabezados, **kwargs):
+    """Hace una petición a Graph reintentando solo los 429/503 (respetando Retry-After)."""
+    for intento in range(MAX_REINTENTOS_GRAPH + 1):
+        response = sesion_http.request(metodo, url, headers=encabezados, timeout=TIMEOUT_GRAPH, **kwargs)
+        if response.status_code not in CODIGOS_REINTENTABLES_GRAPH or intento == MAX_REINTENTOS_GRAPH:
+            response.raise_for_status()
+            return response
+        espera = response.headers.get("Retry-After")
+        time.sleep(float(espera) if espera and espera.isdigit() else 2 ** intento)
+
+
+def abrir_sesion_libro(sesion_http, headers, base_libro):
+    """
+    Crea una sesión de libro que guarda los cambios (persistChanges).
+
+    Returns:
+        str: Id de la sesión, para el encabezado 'workbook-session-id'.
+    """
+    response = _solicitud_graph(sesion_http, "POST", f"{base_libro}/createSession", headers,
+                                json={"persistChanges": True})
+    return response.json()["id"]
+
+
+def cerrar_sesion_libro(sesion_http, headers, base_libro, id_sesion):
+    """Cierra la sesión de libro; un error aquí no deshace lo ya guardado."""
+    try:
+        _solicitud_graph(sesion_http, "POST", f"{base_libro}/closeSession",
+                         {**headers, "workbook-session-id": id_sesion})
+    except requests.exceptions.RequestException as e:
+        print(f"No se pudo cerrar la sesión del libro: {e}")
+
+
+def hojas_libro(sesion_http, headers, base_libro):
+    """Nombres de las hojas del libro, en el orden de sus pestañas."""
+    hojas = _solicitud_graph(sesion_http, "GET", f"{base_libro}/worksheets", headers).json().get("value", [])
+    return [hoja["name"] for hoja in sorted(hojas, key=lambda hoja: hoja.get("position", 0))]
+
+
+def tablas_de_hoja(sesion_http, headers, base_libro, nombre_hoja):
+    """Nombres de las Tablas de Excel de una hoja, en el orden en que las devuelve Graph."""
+    url = f"{base_libro}/worksheets/{quote(nombre_hoja, safe='')}/tables"
+    return [tabla["name"] for tabla in _solicitud_graph(sesion_http, "GET", url, headers).json().get("value", [])]
+
+
+def rango_tabla(sesion_http, headers, base_libro, nombre_tabla):
+    """
+    Rango actual de una Tabla.
+
+    Returns:
+        tuple: (dirección sin hoja, p. ej. 'A1:AL51', última fila, número de columnas).
+    """
+    url = f"{base_libro}/tables/{quote(nombre_tabla, safe='')}/range"
+    direccion = _solicitud_graph(sesion_http, "GET", url, headers).json()["address"]
+    coincidencia = _RE_DIRECCION.search(direccion)
+    if coincidencia is None:
+        raise ValueError(f"Dirección de Tabla no reconocida: {direccion}")
+    columna_inicio, fila_inicio, columna_fin, fila_fin = coincidencia.groups()
+    columna_fin, fila_fin = columna_fin or columna_inicio, fila_fin or fila_inicio
+    num_columnas = column_index_from_string(columna_fin) - column_index_from_string(columna_inicio) + 1
+    return f"{columna_inicio}{fila_inicio}:{columna_fin}{fila_fin}", int(fila_fin), num_columnas
+
+
+def anexar_filas_graph(headers, site_id, ruta_archivo, nombre_hoja, filas, formulas=None, nombre_tabla=None,
+                       filas_por_lote=FILAS_POR_LOTE_GRAPH, base_url=URL_GRAPH):
+    """
+    Añade filas al final de una Tabla de Excel con la API de libros de Graph.
+
+    Args:
+        headers (dict): Encabezados con el token de Graph.
+        site_id (str): Id del sitio de SharePoint.
+        ruta_archivo (str): Ruta del libro en la biblioteca del sitio.
+        nombre_hoja (str): Hoja donde está la Tabla; None para la primera hoja del libro
+            (se consulta a Graph, sin descargar el archivo).
+        filas (list): Filas nuevas (valores en orden de columna desde la primera de la
+            Tabla); se completan o recortan al ancho de la Tabla.
+        formulas (dict, optional): {índice de columna (desde 0): plantilla}, con
+            '{fila}' donde va el número de fila, como en escritor_xlsx.py.
+        nombre_tabla (str, optional): Tabla a extender; por defecto la primera de la hoja.
+        filas_por_lote (int): Filas por petición rows/add.
+        base_url (str): Raíz de la API (p. ej. la de servidor_graph_local.py).
+
+    Returns:
+        dict: 'primera_fila', 'ultima_fila', 'tablas' (lista con (tabla, ref anterior,
+            ref nuevo)), 'lotes' y 'metodo' ('graph').
+
+    Raises:
+        ValueError: Si la hoja no tiene Tablas (hay que usar escritor_xlsx.py).
+        requests.exceptions.RequestException: Si Graph rechaza alguna petición.
+    """
+    base_libro = url_libro(site_id, ruta_archivo, base_url)
+    with requests.Session() as sesion_http:
+        id_sesion = abrir_sesion_libro(sesion_http, headers, base_libro)
+        encabezados = {**headers, "workbook-session-id": id_sesion}
+        try:
+            if nombre_hoja is None:
+                nombre_hoja = hojas_libro(sesion_http, encabezados, base_libro)[0]
+            if nombre_tabla is None:
+                tablas = tablas_de_hoja(sesion_http, encabezados, base_libro, nombre_hoja)
+                if not tablas:
+                    raise ValueError(f"La hoja '{nombre_hoja}' no tiene Tablas de Excel.")
+                nombre_tabla = tablas[0]
+            ref_anterior, ultima_fila, num_columnas = rango_tabla(sesion_http, encabezados, base_libro, nombre_tabla)
+            columna_inicio = column_index_from_string(re.match(r"[A-Z]+", ref_anterior).group(0))
+
+            primera_fila = ultima_fila + 1
+            valores = []
+            columnas_fecha = []  # Por fila, las columnas con fecha (sin las de fórmula)
+            for desplazamiento, fila in enumerate(filas):
+                fila = list(fila)[:num_columnas]
+                valores_fila = [valor_graph(valor) for valor in fila]
+                valores_fila += [""] * (num_columnas - len(valores_fila))
+                fechas_fila = {columna for columna, valor in enumerate(fila) if _es_fecha(valor)}
+                for columna, plantilla in (formulas or {}).items():
+                    if columna < num_columnas:
+                        valores_fila[columna] = plantilla.format(fila=primera_fila + desplazamiento)
+                        fechas_fila.discard(columna)
+                valores.append(valores_fila)
+                columnas_fecha.append(fechas_fila)
+
+            url_filas = f"{base_libro}/tables/{quote(nombre_tabla, safe='')}/rows/add"
+            url_hoja = f"{base_libro}/worksheets/{quote(nombre_hoja, safe='')}"
+            lotes = 0
+            for inicio in range(0, len(valores), filas_por_lote):
+                lote = valores[inicio:inicio + filas_por_lote]
+                _solicitud_graph(sesion_http, "POST", url_filas, encabezados, json={"index": None, "values": lote})
+                lotes += 1
+                # Formato de fecha en el mismo lote, para que un fallo posterior no deje
+                # filas ya guardadas con las fechas como número. None deja el formato de la celda
+                fechas_lote = columnas_fecha[inicio:inicio + len(lote)]
+                fila_lote = primera_fila + inicio
+                for primera, ultima in _tramos_columnas(set().union(*fechas_lote)):
+                    direccion = (f"{get_column_letter(columna_inicio + primera)}{fila_lote}:"
+                                 f"{get_column_letter(columna_inicio + ultima)}{fila_lote + len(lote) - 1}")
+                    formatos = [[FORMATO_FECHA_GRAPH if columna in fechas_fila else None
+                                 for columna in range(primera, ultima + 1)] for fechas_fila in fechas_lote]
+                    _solicitud_graph(sesion_http, "PATCH", f"{url_hoja}/range(address='{direccion}')", encabezados,
+                                     json={"numberFormat": formatos})
+        finally:
+            cerrar_sesion_libro(sesion_http, headers, base_libro, id_sesion)
+
+    nueva_ultima_fila = ultima_fila + len(valores)
+    ref_nuevo = re.sub(r"\d+$", str(nueva_ultima_fila), ref_anterior)
+    return {
+        "primera_fila": primera_fila,
+        "ultima_fila": nueva_ultima_fila,
+        "tablas": [(nombre_tabla, ref_anterior, ref_nuevo)],
+        "lotes": lotes,
+        "metodo": "graph",
+    }
@@ -0,0 +1,555 @@
+import datetime
+import io
+import math
+import posixpath
+import re
+import shutil
+import zipfile
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+# ==============================================================================
+# AÑADIR FILAS EDITANDO EL .XLSX DIRECTAMENTE
+# ==============================================================================
+# Para añadir unos cientos de filas al TRM se cargaba el libro completo en openpyxl,
+# que vuelve a escribir todas las hojas (y pierde lo que no entiende: estilos
+# condicionales, validaciones, partes que no conoce). Aquí el .xlsx se trata como
+# el zip que es: las filas nuevas se insertan como elementos <row> justo antes de
+# </sheetData> en el XML de la hoja, se lleva hasta la nueva última fila el 'ref'
+# de la Tabla de la hoja (y el de su autoFilter), como hacía el código con openpyxl,
+# y el resto de las partes se copian tal cual. Si la hoja tiene varias Tablas se
+# extiende la que contiene el encabezado de los datos; si eso no decide, se usa
+# openpyxl. No se interpreta el XML de la hoja, solo se buscan esas marcas, así que el
+# trabajo extra depende de las filas nuevas y no de las existentes (la hoja sí se
+# vuelve a comprimir). Si el libro no tiene la forma esperada se lanza ValueError
+# y anexar_filas usa openpyxl. reescribir_filas hace lo mismo pero reemplazando
+# todas las filas desde una dada (p. ej. todo menos el encabezado) en un solo corte
+# del XML, en lugar de borrar fila por fila.
+#
+# Las celdas nuevas toman el estilo de la celda de la misma columna en la última
+# fila existente, los textos se escriben como inlineStr (sin tocar sharedStrings)
+# y las fórmulas sin valor calculado: se marca fullCalcOnLoad para que Excel las
+# calcule al abrir, como hace openpyxl al guardar. Las plantillas de 'formulas' van
+# como una fórmula compartida por columna, así que no se arma una fórmula por celda. Las fechas van como número de
+# serie de Excel; si el estilo heredado de su columna no es de fecha se agrega a
+# styles.xml un estilo con el formato de fecha corta (NUMFMT_FECHA).
+NS_HOJA = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_RELACIONES = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+TIPO_TABLA = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/table"
+RUTA_ESTILOS = "xl/styles.xml"
+NUMFMT_FECHA = 14  # Formato integrado de fecha corta (se muestra según la configuración regional)
+
+_RE_FILA = re.compile(rb'<row\b[^>]*?\br="(\d+)"')
+_RE_CELDA = re.compile(rb'<c\b[^>]*>')
+_RE_REF_CELDA = re.compile(rb'\br="([A-Z]+)\d+"')
+_RE_ESTILO = re.compile(rb'\bs="(\d+)"')
+_RE_DIMENSION = re.compile(rb'(<dimension\b[^>]*\bref=")([^"]+)(")')
+_RE_REF_TABLA = re.compile(rb'(<table\b[^>]*?\bref=")([A-Z]+\d+):([A-Z]+)(\d+)(")')
+_RE_REF_FILTRO = re.compile(rb'(<autoFilter\b[^>]*?\bref=")([A-Z]+\d+):([A-Z]+)(\d+)(")')
+_RE_FILAS_TOTALES = re.compile(rb'\btotalsRowCount="([1-9]\d*)"')
+_RE_CALCPR = re.compile(rb'<calcPr\b[^>]*?/?>')
+_RE_CONTEO_XFS = re.compile(rb'(<cellXfs\b[^>]*?\bcount=")(\d+)(")')
+_RE_SI_COMPARTIDA = re.compile(rb'<f\b[^>]*?\bsi="(\d+)"')
+
+
+def _ruta_en_zip(base, destino):
+    """Resuelve el Target de una relación respecto a la parte que la declara."""
+    if destino.startswith("/"):
+        return destino.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), destino))
+
+
+def _ruta_relaciones(parte):
+    return posixpath.join(posixpath.dirname(parte), "_rels", posixpath.basename(parte) + ".rels")
+
+
+def _ruta_hoja(zin, nombre_hoja):
+    """Parte del zip con el XML de la hoja llamada nombre_hoja."""
+    libro = ElementTree.fromstring(zin.read("xl/workbook.xml"))
+    id_relacion = None
+    for hoja in libro.iter(f"{{{NS_HOJA}}}sheet"):
+        if hoja.get("name") == nombre_hoja:
+            id_relacion = hoja.get(f"{{{NS_R}}}id")
+            break
+    if id_relacion is None:
+        raise KeyError(f"No se encontró la hoja '{nombre_hoja}'.")
+    relaciones = ElementTree.fromstring(zin.read("xl/_rels/workbook.xml.rels"))
+    for relacion in relaciones.iter(f"{{{NS_RELACIONES}}}Relationship"):
+        if relacion.get("Id") == id_relacion:
+            return _ruta_en_zip("xl/workbook.xml", relacion.get("Target"))
+    raise ValueError(f"La hoja '{nombre_hoja}' no tiene relación en el libro.")
+
+
+def _rutas_tablas(zin, ruta_hoja):
+    """Partes de las Tablas de Excel que pertenecen a la hoja."""
+    ruta_rels = _ruta_relaciones(ruta_hoja)
+    if ruta_rels not in zin.namelist():
+        return []
+    relaciones = ElementTree.fromstring(zin.read(ruta_rels))
+    return [
+        _ruta_en_zip(ruta_hoja, relacion.get("Target"))
+        for relacion in relaciones.iter(f"{{{NS_RELACIONES}}}Relationship")
+        if relacion.get("Type") == TIPO_TABLA and relacion.get("TargetMode") != "External"
+    ]
+
+
+def _xml_celda(referencia, valor, estilo):
+    """XML de una celda, o '' si el valor va vacío."""
+    if valor is None or valor is pd.NA:
+        return ""
+    atributo_estilo = f' s="{estilo}"' if estilo else ""
+    if isinstance(valor, (bool, np.bool_)):
+        return f'<c r="{referencia}"{atributo_estilo} t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, np.integer)):
+        return f'<c r="{referencia}"{atributo_estilo}><v>{int(valor)}</v></c>'
+    if isinstance(valor, (float, np.floating)):
+        if not math.isfinite(valor):
+            return ""
+        return f'<c r="{referencia}"{atributo_estilo}><v>{float(valor)!r}</v></c>'
+    if isinstance(valor, (datetime.datetime, datetime.date)):
+        if valor != valor:  # NaT
+            return ""
+        return f'<c r="{referencia}"{atributo_estilo}><v>{to_excel(valor)!r}</v></c>'
+    texto = ILLEGAL_CHARACTERS_RE.sub("", str(valor))
+    if texto.startswith("=") and len(texto) > 1:
+        return f'<c r="{referencia}"{atributo_estilo}><f>{escape(texto[1:])}</f></c>'
+    if texto == "":
+        return ""
+    return f'<c r="{referencia}"{atributo_estilo} t="inlineStr"><is><t xml:space="preserve">{escape(texto)}</t></is></c>'
+
+
+def _xml_filas(filas, primera_fila, estilos, formulas, primer_si=0):
+    """
+    Elementos <row> de las filas nuevas, numeradas desde primera_fila.
+
+    Cada plantilla de 'formulas' se escribe una sola vez, como fórmula compartida
+    (t="shared") en la primera fila nueva con 'ref' sobre toda la columna nueva; las
+    demás celdas solo la referencian por su 'si' y Excel corre las referencias
+    relativas fila por fila. primer_si es el primer índice libre en la hoja.
+    """
+    num_columnas = max((len(fila) for fila in filas), default=0)
+    if formulas:
+        num_columnas = max(num_columnas, max(formulas) + 1)
+    letras = [get_column_letter(i + 1) for i in range(num_columnas)]
+    ultima_fila = primera_fila + len(filas) - 1
+    formulas_compartidas = {}
+    for si, (columna, plantilla) in enumerate(sorted((formulas or {}).items()), start=primer_si):
+        letra = letras[columna]
+        atributo_estilo = f' s="{estilos[letra]}"' if estilos.get(letra) else ""
+        texto = escape(plantilla.format(fila=primera_fila).removeprefix("="))
+        formulas_compartidas[columna] = (
+            f'<c r="{letra}{primera_fila}"{atributo_estilo}>'
+            f'<f t="shared" ref="{letra}{primera_fila}:{letra}{ultima_fila}" si="{si}">{texto}</f></c>',
+            f'<c r="{letra}{{numero}}"{atributo_estilo}><f t="shared" si="{si}"/></c>',
+        )
+    partes = []
+    for desplazamiento, fila in enumerate(filas):
+        numero = primera_fila + desplazamiento
+        valores = list(fila) + [None] * (num_columnas - len(fila))
+        celdas = []
+        for i, valor in enumerate(valores):
+            if i in formulas_compartidas:
+                primera, siguientes = formulas_compartidas[i]
+                celdas.append(primera if desplazamiento == 0 else siguientes.format(numero=numero))
+            else:
+                celdas.append(_xml_celda(f"{letras[i]}{numero}", valor, estilos.get(letras[i])))
+        partes.append(f'<row r="{numero}">{"".join(celdas)}</row>')
+    return "".join(partes).encode("utf-8"), num_columnas
+
+
+def _ultima_fila(xml_hoja, fin_datos):
+    """Número y posición de inicio del último <row> dentro de sheetData (0 y -1 si no hay filas)."""
+    inicio = xml_hoja.rfind(b"<row ", 0, fin_datos)
+    if inicio < 0:
+        return 0, -1
+    coincidencia = _RE_FILA.match(xml_hoja, inicio)
+    if coincidencia is None:
+        raise ValueError("Las filas de la hoja no indican su número (atributo r).")
+    return int(coincidencia.group(1)), inicio
+
+
+def _estilos_ultima_fila(xml_hoja, inicio_fila, fin_datos):
+    """Estilo (s) de cada columna en la última fila: {'A': '3', ...}."""
+    estilos = {}
+    if inicio_fila < 0:
+        return estilos
+    for etiqueta in _RE_CELDA.findall(xml_hoja, inicio_fila, fin_datos):
+        columna = _RE_REF_CELDA.search(etiqueta)
+        estilo = _RE_ESTILO.search(etiqueta)
+        if columna and estilo:
+            estilos[columna.group(1).decode()] = estilo.group(1).decode()
+    return estilos
+
+
+def _estilos_de_fecha(xml_estilos):
+    """
+    Índices de cellXfs con formato numérico de fecha.
+
+    Returns:
+        tuple: (set con los índices como texto, número total de estilos de celda).
+    """
+    raiz = ElementTree.fromstring(xml_estilos)
+    formatos = {int(formato.get("numFmtId")): formato.get("formatCode") for formato in raiz.iter(f"{{{NS_HOJA}}}numFmt")}
+    estilos_celda = raiz.find(f"{{{NS_HOJA}}}cellXfs")
+    if estilos_celda is None:
+        raise ValueError("styles.xml no tiene cellXfs.")
+    indices = set()
+    for indice, xf in enumerate(estilos_celda):
+        id_formato = int(xf.get("numFmtId", 0))
+        codigo = formatos.get(id_formato, BUILTIN_FORMATS.get(id_formato))
+        if codigo and is_date_format(codigo):
+            indices.add(str(indice))
+    return indices, len(estilos_celda)
+
+
+def _agregar_estilo_fecha(xml_estilos, num_estilos):
+    """Agrega al final de cellXfs un estilo con NUMFMT_FECHA; devuelve (XML, índice)."""
+    fin = xml_estilos.rfind(b"</cellXfs>")
+    if fin < 0:
+        raise ValueError("No se encontró </cellXfs> en styles.xml.")
+    nuevo = f'<xf numFmtId="{NUMFMT_FECHA}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'.encode()
+    xml_estilos = xml_estilos[:fin] + nuevo + xml_estilos[fin:]
+    xml_estilos = _RE_CONTEO_XFS.sub(lambda m: m.group(1) + str(num_estilos + 1).encode() + m.group(3), xml_estilos, count=1)
+    return xml_estilos, str(num_estilos)
+
+
+def _fila_final_tabla(esquina, nueva_ultima_fila):
+    """Última fila de una Tabla que empieza en 'esquina' (al menos una fila bajo el encabezado)."""
+    fila_encabezado = int(re.search(rb"\d+", esquina).group(0))
+    return max(nueva_ultima_fila, fila_encabezado + 1)
+
+
+def _extender_ref(coincidencia, nueva_ultima_fila):
+    inicio, esquina, columna_final, _, cierre = coincidencia.groups()
+    return inicio + esquina + b":" + columna_final + str(_fila_final_tabla(esquina, nueva_ultima_fila)).encode() + cierre
+
+
+def _tabla_a_extender(refs, fila_encabezado):
+    """
+    Posición de la Tabla que crece con los datos: la única de la hoja o, si hay varias,
+    la única cuyo rango contiene la fila del encabezado. None si no se puede decidir.
+
+    Args:
+        refs (list): Rangos de las Tablas de la hoja ('A1:K50').
+        fila_encabezado (int or None): Fila del encabezado de los datos.
+    """
+    if len(refs) == 1:
+        return 0
+    if fila_encabezado is None:
+        return None
+    candidatas = [
+        posicion for posicion, ref in enumerate(refs)
+        if int(re.search(r"\d+", ref).group(0)) <= fila_encabezado <= int(re.search(r"\d+$", ref).group(0))
+    ]
+    return candidatas[0] if len(candidatas) == 1 else None
+
+
+def _inicio_filas_desde(xml_hoja, inicio_datos, fin_datos, fila_inicio):
+    """Posición del primer <row> con número >= fila_inicio (fin_datos si no hay)."""
+    for coincidencia in _RE_FILA.finditer(xml_hoja, inicio_datos, fin_datos):
+        if int(coincidencia.group(1)) >= fila_inicio:
+            return coincidencia.start()
+    return fin_datos
+
+
+def _calculo_al_abrir(xml_libro):
+    """Marca fullCalcOnLoad en calcPr para que Excel calcule las fórmulas nuevas."""
+    coincidencia = _RE_CALCPR.search(xml_libro)
+    if coincidencia is None or b"fullCalcOnLoad=" in coincidencia.group(0):
+        return xml_libro
+    etiqueta = coincidencia.group(0)
+    cierre = b"/>" if etiqueta.endswith(b"/>") else b">"
+    nueva = etiqueta[:-len(cierre)].rstrip() + b' fullCalcOnLoad="1"' + cierre
+    return xml_libro[:coincidencia.start()] + nueva + xml_libro[coincidencia.end():]
+
+
+def _como_archivo(contenido):
+    """El .xlsx como archivo binario: los bytes se envuelven y un archivo se lleva al inicio."""
+    if isinstance(contenido, (bytes, bytearray, memoryview)):
+        return io.BytesIO(contenido)
+    contenido.seek(0)
+    return contenido
+
+
+def nombres_hojas(contenido):
+    """Nombres de las hojas del .xlsx en orden, leyendo solo xl/workbook.xml."""
+    with zipfile.ZipFile(_como_archivo(contenido)) as zin:
+        libro = ElementTree.fromstring(zin.read("xl/workbook.xml"))
+    return [hoja.get("name") for hoja in libro.iter(f"{{{NS_HOJA}}}sheet")]
+
+
+def anexar_filas_xlsx(contenido, nombre_hoja, filas, formulas=None, salida=None):
+    """
+    Añade filas al final de una hoja editando el XML del .xlsx, sin cargar el libro.
+
+    Args:
+        contenido (bytes or file): El .xlsx original, en bytes o como archivo binario con
+            seek (p. ej. el de una descarga; se lee sin copiarlo a memoria).
+        nombre_hoja (str): Hoja donde se añaden las filas.
+        filas (list): Filas nuevas (listas de valores, en orden de columna desde A).
+            Un texto que empieza por '=' se escribe como fórmula.
+        formulas (dict, optional): {índice de columna (desde 0): plantilla}, con
+            '{fila}' donde va el número de fila; reemplaza el valor de esa columna.
+        salida (file, optional): Archivo binario donde se escribe el .xlsx resultante
+            (p. ej. subida_sharepoint.archivo_temporal_subida), en lugar de devolver bytes.
+
+    Returns:
+        tuple: (bytes del .xlsx resultante, o 'salida' al inicio si se indicó; dict con
+            'primera_fila', 'ultima_fila' y 'tablas': lista de (parte, ref anterior, ref nuevo)).
+
+    Raises:
+        KeyError: Si la hoja no existe.
+        ValueError: Si el XML no tiene la forma esperada (p. ej. una Tabla con fila de
+            totales); el libro se puede actualizar con anexar_filas_openpyxl.
+    """
+    return _escribir_filas_xlsx(contenido, nombre_hoja, filas, formulas, None, salida)
+
+
+def reescribir_filas_xlsx(contenido, nombre_hoja, filas, fila_inicio=2, formulas=None, salida=None):
+    """
+    Reemplaza todas las filas desde fila_inicio por las indicadas, editando el XML.
+
+    Las filas anteriores (el encabezado) quedan igual y la Tabla de los datos pasa a
+    terminar en la última fila escrita.
+
+    Args:
+        contenido (bytes or file): Como en anexar_filas_xlsx.
+        nombre_hoja (str): Hoja que se reescribe.
+        filas (list): Filas que quedan desde fila_inicio.
+        fila_inicio (int): Primera fila (de Excel) que se reemplaza.
+        formulas (dict, optional): Como en anexar_filas_xlsx.
+        salida (file, optional): Como en anexar_filas_xlsx.
+
+    Returns:
+        tuple: Como anexar_filas_xlsx.
+
+    Raises:
+        KeyError: Si la hoja no existe.
+        ValueError: Si el XML no tiene la forma esperada.
+    """
+    return _escribir_filas_xlsx(contenido, nombre_hoja, filas, formulas, fila_inicio, salida)
+
+
+def _escribir_filas_xlsx(contenido, nombre_hoja, filas, formulas, fila_inicio, salida=None):
+    """Añade (fila_inicio=None) o reemplaza desde fila_inicio las filas de una hoja en el XML."""
+    with zipfile.ZipFile(_como_archivo(contenido)) as zin:
+        ruta_hoja = _ruta_hoja(zin, nombre_hoja)
+        xml_hoja = zin.read(ruta_hoja)
+
+        fin_datos = xml_hoja.rfind(b"</sheetData>")
+        if fin_datos < 0:
+            vacia = xml_hoja.find(b"<sheetData/>")
+            if vacia < 0:
+                raise ValueError("No se encontró <sheetData> en la hoja (¿prefijo de espacio de nombres?).")
+            xml_hoja = xml_hoja[:vacia] + b"<sheetData></sheetData>" + xml_hoja[vacia + len(b"<sheetData/>"):]
+            fin_datos = vacia + len(b"<sheetData>")
+        inicio_datos = xml_hoja.find(b"<sheetData")
+
+        ultima_fila, inicio_ultima = _ultima_fila(xml_hoja, fin_datos)
+        estilos = _estilos_ultima_fila(xml_hoja, inicio_ultima, fin_datos)
+        reemplazos = {}
+
+        # Columnas con fechas cuyo estilo heredado no muestra fechas
+        columnas_fecha = {
+            get_column_letter(i + 1)
+            for fila in filas for i, valor in enumerate(fila)
+            if isinstance(valor, (datetime.datetime, datetime.date)) and valor == valor
+        }
+        if columnas_fecha:
+            if RUTA_ESTILOS not in zin.namelist():
+                raise ValueError("El libro no tiene styles.xml.")
+            xml_estilos = zin.read(RUTA_ESTILOS)
+            estilos_fecha, num_estilos = _estilos_de_fecha(xml_estilos)
+            estilo_nuevo = None
+            for letra in sorted(columnas_fecha):
+                if estilos.get(letra) not in estilos_fecha:
+                    if estilo_nuevo is None:
+                        xml_estilos, estilo_nuevo = _agregar_estilo_fecha(xml_estilos, num_estilos)
+                        reemplazos[RUTA_ESTILOS] = xml_estilos
+                    estilos[letra] = estilo_nuevo
+
+        if fila_inicio is None:
+            primera_fila = ultima_fila + 1
+            corte = fin_datos
+            primera_existente = _RE_FILA.search(xml_hoja, inicio_datos, fin_datos)
+            fila_encabezado = int(primera_existente.group(1)) if primera_existente else None
+        else:
+            primera_fila = fila_inicio
+            corte = _inicio_filas_desde(xml_hoja, inicio_datos, fin_datos, fila_inicio)
+            fila_encabezado = fila_inicio - 1
+        # Índices de fórmula compartida que siguen en uso después del corte
+        primer_si = max((int(si) for parte in (xml_hoja[:corte], xml_hoja[fin_datos:])
+                         for si in _RE_SI_COMPARTIDA.findall(parte)), default=-1) + 1
+        xml_nuevas, num_columnas = _xml_filas(filas, primera_fila, estilos, formulas, primer_si)
+        nueva_ultima_fila = primera_fila + len(filas) - 1
+        xml_hoja = xml_hoja[:corte] + xml_nuevas + xml_hoja[fin_datos:]
+
+        dimension = _RE_DIMENSION.search(xml_hoja)
+        if dimension is not None and num_columnas:
+            inicio_dim, ref, cierre = dimension.groups()
+            esquina, _, final = ref.decode().partition(":")
+            columna_final = re.match(r"[A-Z]+", final or esquina).group(0)
+            columna_final = get_column_letter(max(column_index_from_string(columna_final), num_columnas))
+            nuevo_ref = f"{esquina}:{columna_final}{max(nueva_ultima_fila, 1)}".encode()
+            xml_hoja = xml_hoja[:dimension.start()] + inicio_dim + nuevo_ref + cierre + xml_hoja[dimension.end():]
+
+        reemplazos[ruta_hoja] = xml_hoja
+        tablas = []
+        rutas_tablas = _rutas_tablas(zin, ruta_hoja)
+        if rutas_tablas:
+            xml_tablas = [zin.read(ruta_tabla) for ruta_tabla in rutas_tablas]
+            refs_tablas = [_RE_REF_TABLA.search(xml_tabla) for xml_tabla in xml_tablas]
+            for ruta_tabla, ref_tabla in zip(rutas_tablas, refs_tablas):
+                if ref_tabla is None:
+                    raise ValueError(f"No se encontró el rango de la Tabla en '{ruta_tabla}'.")
+            refs_anteriores = [(ref.group(2) + b":" + ref.group(3) + ref.group(4)).decode() for ref in refs_tablas]
+            posicion = _tabla_a_extender(refs_anteriores, fila_encabezado)
+            if posicion is None:
+                raise ValueError(f"No se sabe cuál de las Tablas de la hoja ({', '.join(refs_anteriores)}) extender.")
+            ruta_tabla, xml_tabla, ref_tabla = rutas_tablas[posicion], xml_tablas[posicion], refs_tablas[posicion]
+            if _RE_FILAS_TOTALES.search(xml_tabla):
+                raise ValueError(f"La Tabla de '{ruta_tabla}' tiene fila de totales.")
+            xml_tabla = _RE_REF_TABLA.sub(lambda m: _extender_ref(m, nueva_ultima_fila), xml_tabla, count=1)
+            xml_tabla = _RE_REF_FILTRO.sub(lambda m: _extender_ref(m, nueva_ultima_fila), xml_tabla, count=1)
+            reemplazos[ruta_tabla] = xml_tabla
+            ref_nuevo = ref_tabla.group(2) + b":" + ref_tabla.group(3) + str(_fila_final_tabla(ref_tabla.group(2), nueva_ultima_fila)).encode()
+            tablas.append((ruta_tabla, refs_anteriores[posicion], ref_nuevo.decode()))
+
+        if formulas or any(isinstance(v, str) and v.startswith("=") for fila in filas for v in fila):
+            reemplazos["xl/workbook.xml"] = _calculo_al_abrir(zin.read("xl/workbook.xml"))
+
+        destino_zip = salida if salida is not None else io.BytesIO()
+        with zipfile.ZipFile(destino_zip, "w") as zout:
+            for info in zin.infolist():
+                info_salida = zipfile.ZipInfo(info.filename, info.date_time)
+                info_salida.compress_type = info.compress_type
+                info_salida.external_attr = info.external_attr
+                if info.filename in reemplazos:
+                    zout.writestr(info_salida, reemplazos[info.filename])
+                else:
+                    # Las demás partes se copian sin interpretarlas
+                    with zin.open(info) as origen, zout.open(info_salida, "w") as destino:
+                        shutil.copyfileobj(origen, destino, 1024 * 1024)
+
+    return _resultado(destino_zip, salida), {"primera_fila": primera_fila, "ultima_fila": nueva_ultima_fila, "tablas": tablas}
+
+
+def anexar_filas_openpyxl(contenido, nombre_hoja, filas, formulas=None, salida=None):
+    """
+    Igual que anexar_filas_xlsx, cargando el libro completo con openpyxl (si no se
+    puede decidir qué Tabla extender, se extiende la primera de la hoja).
+    """
+    libro = openpyxl.load_workbook(_como_archivo(contenido))
+    hoja = libro[nombre_hoja]
+    fila_encabezado = hoja.min_row  # Antes de añadir: la primera fila con datos
+    primera_fila = hoja.max_row + 1
+    for desplazamiento, fila in enumerate(filas):
+        valores = [None if valor is pd.NA else valor for valor in fila]
+        if formulas:
+            valores += [None] * (max(formulas) + 1 - len(valores))
+            for columna, plantilla in formulas.items():
+                valores[columna] = plantilla.format(fila=primera_fila + desplazamiento)
+        hoja.append(valores)
+
+    tablas = _extender_tabla_openpyxl(hoja, fila_encabezado, hoja.max_row)
+
+    destino = salida if salida is not None else io.BytesIO()
+    libro.save(destino)
+    return _resultado(destino, salida), {"primera_fila": primera_fila, "ultima_fila": hoja.max_row, "tablas": tablas}
+
+
+def _extender_tabla_openpyxl(hoja, fila_encabezado, nueva_ultima_fila):
+    """Lleva la Tabla de los datos (ver _tabla_a_extender; si no, la primera) hasta nueva_ultima_fila."""
+    if not hoja.tables:
+        return []
+    nombres = list(hoja.tables.keys())
+    posicion = _tabla_a_extender([hoja.tables[nombre].ref for nombre in nombres], fila_encabezado) or 0
+    tabla = hoja.tables[nombres[posicion]]
+    rango_actual = tabla.ref
+    inicio_rango, _, final_rango = rango_actual.partition(':')
+    fila_final = _fila_final_tabla(inicio_rango.encode(), nueva_ultima_fila)
+    tabla.ref = f"{inicio_rango}:{final_rango.rstrip('0123456789')}{fila_final}"
+    return [(nombres[posicion], rango_actual, tabla.ref)]
+
+
+def reescribir_filas_openpyxl(contenido, nombre_hoja, filas, fila_inicio=2, formulas=None, salida=None):
+    """
+    Igual que reescribir_filas_xlsx, cargando el libro con openpyxl. Las filas viejas se
+    borran con un solo delete_rows (un solo desplazamiento de celdas, no uno por fila).
+    """
+    libro = openpyxl.load_workbook(_como_archivo(contenido))
+    hoja = libro[nombre_hoja]
+    ultima_fila = hoja.max_row
+    if ultima_fila >= fila_inicio:
+        hoja.delete_rows(fila_inicio, ultima_fila - fila_inicio + 1)
+    for desplazamiento, fila in enumerate(filas):
+        valores = [None if valor is pd.NA else valor for valor in fila]
+        if formulas:
+            valores += [None] * (max(formulas) + 1 - len(valores))
+            for columna, plantilla in formulas.items():
+                valores[columna] = plantilla.format(fila=fila_inicio + desplazamiento)
+        for columna, valor in enumerate(valores, 1):
+            hoja.cell(row=fila_inicio + desplazamiento, column=columna, value=valor)
+
+    nueva_ultima_fila = fila_inicio + len(filas) - 1
+    tablas = _extender_tabla_openpyxl(hoja, fila_inicio - 1, nueva_ultima_fila)
+
+    destino = salida if salida is not None else io.BytesIO()
+    libro.save(destino)
+    return _resultado(destino, salida), {"primera_fila": fila_inicio, "ultima_fila": nueva_ultima_fila, "tablas": tablas}
+
+
+def _resultado(destino, salida):
+    """Bytes escritos en destino o, si el llamador dio un archivo de salida, ese archivo al inicio."""
+    if salida is None:
+        return destino.getvalue()
+    salida.seek(0)
+    return salida
+
+
+def _con_respaldo(funcion_xml, funcion_openpyxl, *args, salida=None):
+    """Usa la versión que edita el XML y, si el libro no tiene la forma esperada, la de openpyxl."""
+    try:
+        contenido_nuevo, detalles = funcion_xml(*args, salida=salida)
+        detalles["metodo"] = "xml"
+    except ValueError as e:
+        print(f"No se pudo escribir editando el XML, se usa openpyxl: {e}")
+        if salida is not None:
+            salida.seek(0)
+            salida.truncate()
+        contenido_nuevo, detalles = funcion_openpyxl(*args, salida=salida)
+        detalles["metodo"] = "openpyxl"
+    return contenido_nuevo, detalles
+
+
+def anexar_filas(contenido, nombre_hoja, filas, formulas=None, salida=None):
+    """
+    Añade filas editando el XML y, si el libro no tiene la forma esperada, con openpyxl.
+
+    Returns:
+        tuple: (bytes del .xlsx, o 'salida' si se indicó; dict como el de anexar_filas_xlsx
+            con 'metodo': 'xml' u 'openpyxl').
+    """
+    return _con_respaldo(anexar_filas_xlsx, anexar_filas_openpyxl, contenido, nombre_hoja, filas, formulas,
+                         salida=salida)
+
+
+def reescribir_filas(contenido, nombre_hoja, filas, fila_inicio=2, formulas=None, salida=None):
+    """
+    Reemplaza las filas desde fila_inicio editando el XML y, si el libro no tiene la
+    forma esperada, con openpyxl.
+
+    Returns:
+        tuple: Como anexar_filas.
+    """
+    return _con_respaldo(reescribir_filas_xlsx, reescribir_filas_openpyxl, contenido, nombre_hoja, filas, fila_inicio,
+                         formulas, salida=salida)
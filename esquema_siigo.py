@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# ==============================================================================
+# ESQUEMA DE TIPOS DEL EXPORT DE SIIGO
+# ==============================================================================
+# Las columnas de pocos valores distintos (comprobante, tipo, línea, vendedor,
+# tercero...) se guardan como categorías: cada fila ocupa un código de 1-2 bytes
+# en lugar de un objeto str, y los ==/isin comparan códigos. Los textos libres
+# quedan como cadenas respaldadas por Arrow. Las categorías se quitan al final
+# (quitar_categorias) para que el resultado tenga los mismos tipos de siempre.
+# Solo se listan columnas que llegan al archivo final; las que se eliminan en la
+# limpieza no vale la pena convertirlas. El esquema se aplica a cada bloque apenas
+# se lee (así los pasos de la limpieza ya comparan códigos) y otra vez al final de
+# la limpieza para las columnas que ella crea.
+CATEGORIA = "categoria"
+TEXTO = "texto"
+
+ESQUEMA_SIIGO = {
+    "Tipo clasificación": CATEGORIA,
+    "Tipo Bien": CATEGORIA,
+    "Número comprobante": CATEGORIA,
+    "Numero comprobante": TEXTO,
+    "Línea": CATEGORIA,
+    "Sublínea": CATEGORIA,
+    "Clasificación Producto": CATEGORIA,
+    "Identificación Vendedor": CATEGORIA,
+    "Vendedor": CATEGORIA,
+    "Nombre tercero": CATEGORIA,
+    "Nombre": CATEGORIA,
+    "Identificación": CATEGORIA,  # NIT del tercero: se repite en todas las líneas de sus documentos
+    "Observaciones": TEXTO,
+    "NIT_relacion": TEXTO,
+    "Factura proveedor": TEXTO,
+}
+
+# Cadenas de Arrow con NaN como valor faltante (el tipo 'str' por defecto de pandas 3)
+try:
+    TIPO_TEXTO = pd.StringDtype("pyarrow", na_value=np.nan)
+except TypeError:
+    TIPO_TEXTO = "string[pyarrow_numpy]"  # pandas 2.1/2.2
+
+
+def aplicar_esquema(df, esquema=ESQUEMA_SIIGO):
+    """
+    Convierte las columnas del esquema que existan en el DataFrame.
+
+    Args:
+        df (pandas.DataFrame): Bloque o DataFrame del export (no se modifica).
+        esquema (dict): Columna -> CATEGORIA o TEXTO.
+
+    Returns:
+        pandas.DataFrame: Copia con los tipos del esquema.
+    """
+    conversiones = {}
+    for columna, tipo in esquema.items():
+        if columna not in df.columns or isinstance(df[columna].dtype, pd.CategoricalDtype):
+            continue
+        if tipo == CATEGORIA:
+            conversiones[columna] = "category"
+        elif df[columna].dtype != TIPO_TEXTO and pd.api.types.is_string_dtype(df[columna].dtype):
+            # Los textos que pandas dejó numéricos (p. ej. columnas vacías) se respetan
+            conversiones[columna] = TIPO_TEXTO
+    return df.astype(conversiones) if conversiones else df
+
+
+def reemplazar_valores(serie, mapeo):
+    """Series.replace que también sirve para categorías (renombra las categorías)."""
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.replace(mapeo)
+    # pd.Index infiere el tipo (str) igual que el de las categorías originales
+    nuevas_categorias = pd.Index([mapeo.get(categoria, categoria) for categoria in serie.cat.categories])
+    if nuevas_categorias.is_unique:
+        return serie.cat.rename_categories(nuevas_categorias)
+    # Dos categorías que terminan en el mismo valor: se reemplaza sobre los valores
+    return pd.Series(np.asarray(serie), index=serie.index, name=serie.name).replace(mapeo).astype("category")
+
+
+def concatenar_bloques(partes):
+    """
+    pd.concat que conserva las categorías aunque cada bloque tenga las suyas
+    (pd.concat las convertiría a object).
+
+    Args:
+        partes (list): DataFrames con las mismas columnas.
+
+    Returns:
+        pandas.DataFrame: Las partes concatenadas.
+    """
+    partes = [parte for parte in partes if parte is not None]
+    if len(partes) > 1:
+        for columna in partes[0].columns:
+            if not all(isinstance(parte[columna].dtype, pd.CategoricalDtype) for parte in partes if columna in parte):
+                continue
+            try:
+                categorias = union_categoricals([parte[columna].array for parte in partes if columna in parte]).categories
+            except TypeError:
+                continue  # Categorías de tipos distintos: pd.concat las une como valores normales
+            partes = [
+                parte.assign(**{columna: parte[columna].cat.set_categories(categorias)}) if columna in parte else parte
+                for parte in partes
+            ]
+    return pd.concat(partes)
+
+
+def mapear_categorias(serie, mapeo, por_defecto):
+    """
+    serie.map(mapeo) con por_defecto para lo que no está en el mapeo; en una serie
+    categórica se calcula una vez por categoría y se reparte por los códigos.
+
+    Returns:
+        numpy.ndarray: Un valor por fila (dtype object).
+    """
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.map(mapeo).to_numpy(dtype=object, na_value=por_defecto)
+    # El código -1 (vacío) toma el último elemento: por_defecto
+    por_categoria = np.array([mapeo.get(categoria, por_defecto) for categoria in serie.cat.categories] + [por_defecto],
+                             dtype=object)
+    return por_categoria[serie.cat.codes.to_numpy()]
+
+
+def quitar_categorias(df):
+    """
+    Devuelve las columnas categóricas a valores normales (texto o número, con NaN), que
+    es lo que esperan la descarga y los pasos de SharePoint (fillna(''), astype(str)...).
+    """
+    columnas_categoricas = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+    if not columnas_categoricas:
+        return df
+    return df.assign(**{
+        columna: pd.Series(np.asarray(df[columna]), index=df.index).infer_objects()
+        for columna in columnas_categoricas
+    })
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# EXTRACCIÓN DE LOS CAMPOS MARCADOS EN 'Observaciones' Y 'Referencia fábrica'
+# ==============================================================================
+# En el export de Siigo los datos adicionales vienen marcados dentro del texto:
+#   Observaciones:      "Clasificación"  {TRM}  (NIT del documento relacionado)
+#   Referencia fábrica: (Línea)  {Sublínea}
+# Los textos se repiten mucho (todas las líneas de una factura comparten las
+# observaciones y cada producto su referencia), así que cada columna se recorre
+# una sola vez para sacar sus valores distintos, los patrones se aplican solo a
+# esos valores y el resultado se reparte de nuevo a todas las filas.
+PATRONES_OBSERVACIONES = {
+    "Clasificación Producto": r'"([^"]+)"',
+    "TRM": r'\{(.*?)\}',
+    "NIT_relacion": r'\((.*?)\)',
+}
+PATRONES_REFERENCIA = {
+    "Línea": r'\(([^)]+)\)',
+    "Sublínea": r'\{([^}]+)\}',
+}
+# Si casi todos los valores son distintos (texto libre), sacar los distintos y
+# repartir el resultado cuesta más de lo que se ahorra: los patrones se aplican
+# directamente a la columna. Para decidirlo sin recorrer la columna completa se mira
+# una muestra de TAMANO_MUESTRA_DISTINTOS valores (ver _muchos_distintos).
+FRACCION_MAXIMA_DISTINTOS = 0.5
+TAMANO_MUESTRA_DISTINTOS = 10_000
+
+
+def _muchos_distintos(serie, fraccion_maxima=FRACCION_MAXIMA_DISTINTOS, tamano_muestra=TAMANO_MUESTRA_DISTINTOS):
+    """
+    Estima, con una muestra al azar, si la columna tiene más de fraccion_maxima de
+    valores distintos.
+
+    Si cada valor se repitiera m veces, una muestra de una fracción r de la columna
+    tendría una fracción (1 - e^(-r·m)) / (r·m) de valores distintos; la muestra se
+    compara con esa fracción para m = 1 / fraccion_maxima.
+    """
+    if len(serie) <= 2 * tamano_muestra:
+        return False  # Columna pequeña: sacar los distintos cuesta poco
+    # Posiciones al azar (con reposición, sin permutar toda la columna)
+    muestra = serie.iloc[np.random.default_rng(0).integers(0, len(serie), tamano_muestra)]
+    tasa = tamano_muestra / len(serie) / fraccion_maxima
+    return muestra.nunique(dropna=False) / tamano_muestra > (1 - math.exp(-tasa)) / tasa
+
+
+def extraer_etiquetas(serie, patrones):
+    """
+    Extrae todos los campos marcados de una columna, recorriéndola una sola vez para
+    obtener sus valores distintos y aplicando los patrones solo a esos valores.
+
+    Args:
+        serie (pandas.Series): Columna de texto (p. ej. 'Observaciones').
+        patrones (dict): Nombre del campo -> regex con un grupo de captura; se toma la
+            primera coincidencia, igual que Series.str.extract.
+
+    Returns:
+        pandas.DataFrame: Una columna por campo, con el mismo índice de la serie y NaN
+        donde el patrón no aparece.
+    """
+    if _muchos_distintos(serie):
+        return pd.DataFrame(
+            {nombre: serie.str.extract(patron, expand=False) for nombre, patron in patrones.items()},
+            index=serie.index
+        )
+
+    codigos, valores_unicos = pd.factorize(serie)
+    serie_unicos = pd.Series(valores_unicos, dtype=serie.dtype)
+
+    campos = {}
+    for nombre, patron in patrones.items():
+        extraidos = serie_unicos.str.extract(patron, expand=False)
+        # Los códigos -1 (valores nulos en la serie) quedan como NaN
+        campos[nombre] = pd.Series(extraidos.array.take(codigos, allow_fill=True), index=serie.index)
+    return pd.DataFrame(campos, index=serie.index)
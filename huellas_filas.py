@@ -0,0 +1,129 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# HUELLAS DE FILAS PARA DETECTAR REGISTROS YA CARGADOS
+# ==============================================================================
+# Antes se concatenaba todo el histórico con los registros nuevos, se convertía
+# cada columna a texto y se corría DataFrame.duplicated sobre el conjunto. Ahora
+# cada fila se normaliza con las mismas reglas (NaN/None -> '', números a 2
+# decimales, sin '.0' final, sin espacios) y se resume en un hash de 64 bits
+# (pd.util.hash_pandas_object, con clave fija, así que es estable entre
+# ejecuciones). Los registros nuevos se comparan contra el conjunto de huellas del
+# histórico, y ese conjunto se puede guardar para no recalcularlo.
+#
+# La normalización depende de cada valor y no del tipo de la columna combinada,
+# para que el histórico y los nuevos den la misma huella aunque pandas los haya
+# leído con tipos distintos (p. ej. una columna float en el histórico y object en
+# los nuevos porque trae celdas vacías).
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+DECIMALES_COMPARACION = 2
+
+
+def _texto_final(serie):
+    """Últimas reglas de texto: sin '.0' al final, sin 'None' y sin espacios alrededor."""
+    return (
+        serie
+        .str.replace(r'\.0+$', '', regex=True)
+        .str.replace('None', '', regex=False)
+        .str.strip()
+    )
+
+
+def _normalizar_objetos(valores):
+    """Normaliza valor por valor una columna object (tipos mezclados)."""
+    textos = np.empty(len(valores), dtype=object)
+    posiciones_decimales, decimales = [], []
+    for posicion, valor in enumerate(valores):
+        if valor is None or valor is pd.NaT or (isinstance(valor, (float, np.floating)) and np.isnan(valor)):
+            textos[posicion] = ''
+        elif isinstance(valor, (bool, np.bool_, int, np.integer)):
+            textos[posicion] = str(valor)
+        elif isinstance(valor, (float, np.floating)):
+            # Se redondean juntos abajo, igual que una columna float
+            posiciones_decimales.append(posicion)
+            decimales.append(valor)
+        elif isinstance(valor, datetime.datetime):
+            textos[posicion] = valor.strftime(FORMATO_FECHA)
+        else:
+            textos[posicion] = str(valor)
+    if decimales:
+        redondeados = np.round(np.asarray(decimales, dtype=float), DECIMALES_COMPARACION)
+        textos[posiciones_decimales] = redondeados.astype(str)
+    return textos
+
+
+def normalizar_columna(serie):
+    """
+    Convierte una columna al texto que se usa para comparar registros.
+
+    Args:
+        serie (pandas.Series): Columna del histórico o de los registros nuevos.
+
+    Returns:
+        pandas.Series: Textos normalizados, con el mismo índice.
+    """
+    tipo = serie.dtype
+    if pd.api.types.is_bool_dtype(tipo) or pd.api.types.is_integer_dtype(tipo):
+        textos = serie.astype(object).where(serie.notna(), '').astype(str)
+    elif pd.api.types.is_float_dtype(tipo):
+        textos = serie.round(DECIMALES_COMPARACION).astype(str).where(serie.notna(), '')
+    elif pd.api.types.is_datetime64_any_dtype(tipo):
+        textos = serie.dt.strftime(FORMATO_FECHA).fillna('')
+    elif pd.api.types.infer_dtype(serie, skipna=True) in ('string', 'empty'):
+        # Solo texto (el caso común): sin recorrer valor por valor
+        textos = serie.fillna('')
+    else:
+        textos = pd.Series(_normalizar_objetos(serie.to_numpy(dtype=object)), index=serie.index)
+    return _texto_final(textos.astype(str))
+
+
+def normalizar_filas(df, columnas):
+    """
+    Normaliza las columnas indicadas; las que no existan en df cuentan como vacías.
+
+    Returns:
+        pandas.DataFrame: Textos normalizados, columnas en el orden de 'columnas'.
+    """
+    return pd.DataFrame(
+        {columna: normalizar_columna(df[columna]) if columna in df.columns else pd.Series('', index=df.index)
+         for columna in columnas},
+        index=df.index, columns=columnas
+    )
+
+
+def huellas_filas(df, columnas):
+    """
+    Huella de 64 bits de cada fila, calculada sobre las columnas normalizadas.
+
+    Args:
+        df (pandas.DataFrame): Registros (histórico o nuevos).
+        columnas (list): Columnas que definen un registro repetido, siempre en el mismo orden.
+
+    Returns:
+        numpy.ndarray: Huellas (uint64), una por fila.
+    """
+    if len(df) == 0:
+        return np.array([], dtype=np.uint64)
+    return pd.util.hash_pandas_object(normalizar_filas(df, columnas), index=False).to_numpy()
+
+
+def marcar_repetidos(huellas_existentes, huellas_nuevas):
+    """
+    Marca los registros nuevos que ya están en el histórico o que repiten uno anterior
+    del mismo lote (como DataFrame.duplicated(keep='first') sobre histórico + nuevos).
+
+    Args:
+        huellas_existentes (numpy.ndarray or set): Huellas del histórico.
+        huellas_nuevas (numpy.ndarray): Huellas de los registros nuevos, en orden.
+
+    Returns:
+        numpy.ndarray: Máscara booleana sobre los registros nuevos.
+    """
+    if isinstance(huellas_existentes, (set, frozenset)):
+        huellas_existentes = np.fromiter(huellas_existentes, dtype=np.uint64, count=len(huellas_existentes))
+    ya_existen = np.isin(huellas_nuevas, huellas_existentes)
+    repetidos_en_lote = pd.Series(huellas_nuevas).duplicated(keep='first').to_numpy()
+    return ya_existen | repetidos_en_lote
@@ -0,0 +1,169 @@
+import base64
+import json
+import os
+
+import numpy as np
+import requests
+
+from escritor_graph import URL_GRAPH
+
+# ==============================================================================
+# ÍNDICE DE HUELLAS JUNTO A LOS LIBROS DE SHAREPOINT
+# ==============================================================================
+# Para saber qué filas ya existen en TRM4.xlsx o en el libro del mes había que
+# descargarlo y leer todas sus filas. Ahora, después de cada actualización, se sube
+# en la misma carpeta un archivo compañero ('<libro>.huellas.json') con las huellas
+# de todas las filas (ver huellas_filas.py), las columnas con que se calcularon y el
+# eTag que SharePoint le dio al libro al subirlo. En la siguiente ejecución, si el
+# eTag actual del libro es el mismo, la deduplicación se hace solo con ese archivo;
+# si el libro cambió por fuera (otro eTag), no hay índice o está dañado, se vuelve
+# a leer el libro completo y el índice se reconstruye al subir.
+SUFIJO_INDICE_HUELLAS = ".huellas.json"
+VERSION_INDICE_HUELLAS = 1
+USAR_INDICE_HUELLAS = os.environ.get("SIIGO_INDICE_HUELLAS", "1") != "0"
+
+URL_GRAPH_DRIVE = URL_GRAPH + "/sites/{site_id}/drive/root:/{ruta}"
+
+
+def ruta_indice_huellas(ruta_archivo):
+    """Ruta en SharePoint del índice de un libro (misma carpeta, mismo nombre + sufijo)."""
+    return f"{ruta_archivo}{SUFIJO_INDICE_HUELLAS}"
+
+
+def serializar_indice(huellas, etag, columnas, columnas_huella):
+    """
+    Arma el contenido del índice.
+
+    Args:
+        huellas (numpy.ndarray): Huellas (uint64) de todas las filas del libro.
+        etag (str): eTag del libro al que corresponden.
+        columnas (list): Encabezados del libro.
+        columnas_huella (list): Columnas (en orden) con que se calcularon las huellas.
+
+    Returns:
+        bytes: JSON con las huellas únicas en base64 (8 bytes cada una).
+    """
+    unicas = np.unique(np.asarray(huellas, dtype=np.uint64)).astype("<u8")
+    return json.dumps({
+        "version": VERSION_INDICE_HUELLAS,
+        "etag": etag,
+        "columnas": [str(col) for col in columnas],
+        "columnas_huella": [str(col) for col in columnas_huella],
+        "huellas": base64.b64encode(unicas.tobytes()).decode("ascii"),
+    }).encode("utf-8")
+
+
+def leer_indice(contenido):
+    """
+    Interpreta el contenido de un índice.
+
+    Returns:
+        dict or None: 'etag', 'columnas', 'columnas_huella' y 'huellas' (numpy.ndarray),
+            o None si el contenido no es un índice válido de esta versión.
+    """
+    try:
+        datos = json.loads(contenido)
+        if datos.get("version") != VERSION_INDICE_HUELLAS:
+            return None
+        return {
+            "etag": datos["etag"],
+            "columnas": datos["columnas"],
+            "columnas_huella": datos["columnas_huella"],
+            "huellas": np.frombuffer(base64.b64decode(datos["huellas"]), dtype="<u8").astype(np.uint64),
+        }
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"Índice de huellas inválido, se reconstruirá: {e}")
+        return None
+
+
+def obtener_etag(headers, site_id, ruta_archivo):
+    """
+    Consulta el eTag actual de un archivo sin descargarlo.
+
+    Returns:
+        str or None: eTag, o None si no se pudo consultar.
+    """
+    try:
+        response = requests.get(URL_GRAPH_DRIVE.format(site_id=site_id, ruta=ruta_archivo), headers=headers)
+        if response.status_code != 200:
+            return None
+        return response.json().get("eTag")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"No se pudo consultar el eTag de '{ruta_archivo}': {e}")
+        return None
+
+
+def etag_respuesta(response):
+    """eTag del driveItem que Graph devuelve al subir un archivo (None si no viene)."""
+    try:
+        return response.json().get("eTag")
+    except ValueError:
+        return None
+
+
+def cargar_indice_huellas(headers, site_id, ruta_archivo, etag, columnas_huella=None):
+    """
+    Descarga el índice de un libro y lo devuelve solo si sigue vigente.
+
+    Args:
+        headers (dict): Encabezados con el token de Graph.
+        site_id (str): Id del sitio de SharePoint.
+        ruta_archivo (str): Ruta del libro (no del índice).
+        etag (str): eTag actual del libro.
+        columnas_huella (list, optional): Si se indica, el índice debe haberse
+            calculado con exactamente estas columnas.
+
+    Returns:
+        dict or None: Índice como el de leer_indice, o None si no existe, está dañado,
+            es de otra versión del libro o de otras columnas.
+    """
+    if not USAR_INDICE_HUELLAS or not etag:
+        return None
+    endpoint = URL_GRAPH_DRIVE.format(site_id=site_id, ruta=ruta_indice_huellas(ruta_archivo)) + ":/content"
+    try:
+        response = requests.get(endpoint, headers=headers)
+    except requests.exceptions.RequestException as e:
+        print(f"No se pudo descargar el índice de huellas: {e}")
+        return None
+    if response.status_code != 200:
+        return None
+
+    indice = leer_indice(response.content)
+    if indice is None or indice["etag"] != etag:
+        return None
+    if columnas_huella is not None and indice["columnas_huella"] != [str(col) for col in columnas_huella]:
+        return None
+    return indice
+
+
+def guardar_indice_huellas(headers, site_id, ruta_archivo, etag, columnas, columnas_huella, huellas):
+    """
+    Sube (o reemplaza) el índice de un libro recién actualizado.
+
+    Args:
+        headers (dict): Encabezados con el token de Graph.
+        site_id (str): Id del sitio de SharePoint.
+        ruta_archivo (str): Ruta del libro (no del índice).
+        etag (str): eTag que SharePoint devolvió al subir el libro.
+        columnas (list): Encabezados del libro.
+        columnas_huella (list): Columnas con que se calcularon las huellas.
+        huellas (numpy.ndarray): Huellas de todas las filas del libro subido.
+
+    Returns:
+        bool: True si el índice quedó guardado.
+    """
+    if not USAR_INDICE_HUELLAS or not etag:
+        return False
+    endpoint = URL_GRAPH_DRIVE.format(site_id=site_id, ruta=ruta_indice_huellas(ruta_archivo)) + ":/content"
+    try:
+        response = requests.put(
+            endpoint,
+            data=serializar_indice(huellas, etag, columnas, columnas_huella),
+            headers={**headers, "Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+        return True
+    except requests.exceptions.RequestException as e:
+        # Sin índice la próxima ejecución solo vuelve a leer el libro completo
+        print(f"No se pudo guardar el índice de huellas de '{ruta_archivo}': {e}")
+        return False
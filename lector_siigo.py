@@ -0,0 +1,210 @@
+import openpyxl
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+# ==============================================================================
+# LECTURA EN STREAMING DEL EXPORT DE SIIGO
+# ==============================================================================
+# El export de Siigo trae normalmente 7 filas de encabezado (título, empresa,
+# fechas...) y los nombres de columna en la fila 8. En lugar de pd.read_excel, que arma en memoria
+# todas las celdas de openpyxl, se recorren las filas en modo read_only/values_only
+# y se entregan DataFrames por bloques, así que la memoria máxima de la lectura
+# depende del tamaño del bloque y no del tamaño del archivo.
+FILAS_ENCABEZADO_SIIGO = 7
+TAMANO_BLOQUE = 5000
+
+# Si Siigo cambia el número de filas del encabezado, la fila con los nombres de
+# columna se busca entre las primeras filas comparándola con las columnas conocidas.
+MAX_FILAS_BUSQUEDA_ENCABEZADO = 30
+MIN_COLUMNAS_CONOCIDAS = 3
+COLUMNAS_CONOCIDAS_SIIGO = {
+    "Tipo clasificación", "Número comprobante", "Consecutivo", "Factura proveedor",
+    "Fecha elaboración", "Identificación", "Nombre tercero", "Código", "Nombre",
+    "Referencia fábrica", "Cantidad", "Valor unitario", "Total", "Tasa de cambio",
+    "Observaciones", "Identificación Vendedor", "Nombre vendedor", "Sucursal",
+    "Centro costo", "Bodega", "Moneda", "Forma pago", "Fecha vencimiento",
+}
+_COLUMNAS_CONOCIDAS_NORMALIZADAS = {columna.casefold() for columna in COLUMNAS_CONOCIDAS_SIIGO}
+
+
+class EncabezadoNoEncontrado(ValueError):
+    """El archivo no tiene el encabezado de un export de Siigo en sus primeras filas."""
+
+
+def _nombres_columnas(encabezados):
+    """Replica los nombres que asigna pandas: 'Unnamed: i' para vacíos y '.1', '.2' para repetidos."""
+    nombres = []
+    vistos = {}
+    for i, valor in enumerate(encabezados):
+        nombre = f"Unnamed: {i}" if valor is None or str(valor).strip() == "" else str(valor)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+def _construir_bloque(filas, columnas, inicio):
+    """
+    Arma un DataFrame tipado a partir de una lista de filas (tuplas de valores). Las
+    celdas numéricas y de fecha quedan con su tipo, los textos vacíos como NaN y los
+    demás textos como texto.
+
+    A diferencia de pd.read_excel, una columna de textos que parecen números no se
+    convierte a número: esa decisión depende de todas las filas del archivo y un
+    bloque solo ve las suyas, así que un código '00123' saldría como 123 en los
+    bloques sin otros textos y como '00123' en los demás.
+    """
+    df_bloque = pd.DataFrame.from_records(filas, columns=columnas, index=range(inicio, inicio + len(filas)))
+
+    for columna in df_bloque.columns:
+        serie = df_bloque[columna]
+        if is_numeric_dtype(serie) or is_datetime64_any_dtype(serie):
+            continue
+        serie = serie.where(serie != "", None)
+        # Una columna sin ningún valor queda numérica (NaN), como en pd.read_excel
+        df_bloque[columna] = serie if serie.notna().any() else serie.astype(float)
+
+    return df_bloque.infer_objects()
+
+
+def _es_encabezado(fila):
+    """Indica si la fila tiene al menos MIN_COLUMNAS_CONOCIDAS nombres de columna del export de Siigo."""
+    coincidencias = sum(
+        1 for valor in fila
+        if isinstance(valor, str) and valor.strip().casefold() in _COLUMNAS_CONOCIDAS_NORMALIZADAS
+    )
+    return coincidencias >= MIN_COLUMNAS_CONOCIDAS
+
+
+def _buscar_encabezado(filas, max_filas):
+    """
+    Recorre como máximo max_filas del iterador de filas buscando la de los nombres de columna.
+
+    Returns:
+        tuple: (número de filas antes del encabezado, fila de encabezado).
+
+    Raises:
+        EncabezadoNoEncontrado: Si ninguna de las primeras max_filas filas parece un encabezado de Siigo.
+    """
+    for numero_fila, fila in enumerate(filas):
+        if numero_fila >= max_filas:
+            break
+        if _es_encabezado(fila):
+            return numero_fila, fila
+
+    raise EncabezadoNoEncontrado(
+        f"No se encontró el encabezado del export de Siigo en las primeras {max_filas} filas. "
+        f"Se esperaban columnas como {', '.join(sorted(COLUMNAS_CONOCIDAS_SIIGO)[:5])}..."
+    )
+
+
+def localizar_encabezado(archivo, max_filas=MAX_FILAS_BUSQUEDA_ENCABEZADO, hoja=0):
+    """
+    Busca la fila de encabezado leyendo solo las primeras filas de la hoja en modo streaming.
+
+    Args:
+        archivo (str or file-like): Ruta o archivo .xlsx.
+        max_filas (int): Filas que se revisan como máximo.
+        hoja (int or str): Índice o nombre de la hoja.
+
+    Returns:
+        int or None: Filas que hay antes del encabezado (el valor para skiprows) o None si no se encontró.
+    """
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        hoja_datos = libro.worksheets[hoja] if isinstance(hoja, int) else libro[hoja]
+        filas_a_saltar, _ = _buscar_encabezado(hoja_datos.iter_rows(values_only=True), max_filas)
+        return filas_a_saltar
+    except EncabezadoNoEncontrado:
+        return None
+    finally:
+        libro.close()
+        # Para que el mismo archivo subido se pueda volver a leer desde el inicio
+        if hasattr(archivo, "seek"):
+            archivo.seek(0)
+
+
+def leer_siigo_por_bloques(archivo, filas_a_saltar=None, tamano_bloque=TAMANO_BLOQUE, hoja=0,
+                           max_filas_busqueda=MAX_FILAS_BUSQUEDA_ENCABEZADO, detalles=None):
+    """
+    Lee el export de Siigo en modo streaming y lo entrega por bloques de filas.
+
+    Args:
+        archivo (str or file-like): Ruta o archivo (p. ej. streamlit.UploadedFile) .xlsx.
+        filas_a_saltar (int, optional): Filas que se ignoran antes de los nombres de columna.
+            Si es None, el encabezado se busca en las primeras max_filas_busqueda filas.
+        tamano_bloque (int): Máximo de filas por bloque.
+        hoja (int or str): Índice o nombre de la hoja a leer.
+        max_filas_busqueda (int): Filas que se revisan al buscar el encabezado.
+        detalles (dict, optional): Si se indica, se guarda en 'filas_saltadas' cuántas filas
+            había antes del encabezado.
+
+    Yields:
+        pandas.DataFrame: Bloques con las columnas del export, tipos inferidos por columna
+        y un índice continuo entre bloques (igual al que daría pd.read_excel).
+
+    Raises:
+        EncabezadoNoEncontrado: Si se busca el encabezado y no aparece en las primeras filas.
+    """
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        hoja_datos = libro.worksheets[hoja] if isinstance(hoja, int) else libro[hoja]
+        # Algunos exports declaran mal sus dimensiones; así se leen todas las filas reales
+        hoja_datos.reset_dimensions()
+
+        if filas_a_saltar is None:
+            # Solo se leen las primeras filas; un archivo sin encabezado se rechaza sin recorrerlo entero
+            filas = hoja_datos.iter_rows(values_only=True)
+            filas_a_saltar, encabezados = _buscar_encabezado(filas, max_filas_busqueda)
+        else:
+            filas = hoja_datos.iter_rows(min_row=filas_a_saltar + 1, values_only=True)
+            encabezados = next(filas, None)
+            if encabezados is None:
+                return
+
+        if detalles is not None:
+            detalles["filas_saltadas"] = filas_a_saltar
+
+        # Se descartan las columnas vacías al final del encabezado
+        while encabezados and encabezados[-1] is None:
+            encabezados = encabezados[:-1]
+        columnas = _nombres_columnas(encabezados)
+        num_columnas = len(columnas)
+
+        bloque = []
+        inicio = 0
+        for fila in filas:
+            fila = fila[:num_columnas]
+            # Igual que pd.read_excel, las filas completamente vacías se omiten
+            if all(valor is None or valor == "" for valor in fila):
+                continue
+            if len(fila) < num_columnas:
+                fila = fila + (None,) * (num_columnas - len(fila))
+            bloque.append(fila)
+
+            if len(bloque) >= tamano_bloque:
+                yield _construir_bloque(bloque, columnas, inicio)
+                inicio += len(bloque)
+                bloque = []
+
+        if bloque:
+            yield _construir_bloque(bloque, columnas, inicio)
+    finally:
+        libro.close()
+
+
+def leer_siigo(archivo, filas_a_saltar=None, tamano_bloque=TAMANO_BLOQUE, hoja=0, detalles=None):
+    """
+    Lee el export de Siigo completo usando la lectura por bloques (con los mismos
+    argumentos de leer_siigo_por_bloques).
+
+    Returns:
+        pandas.DataFrame: Los datos desde la fila siguiente al encabezado. Vacío si no hay datos.
+    """
+    bloques = list(leer_siigo_por_bloques(archivo, filas_a_saltar, tamano_bloque, hoja, detalles=detalles))
+    if not bloques:
+        return pd.DataFrame()
+    return pd.concat(bloques)
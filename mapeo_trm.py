@@ -0,0 +1,97 @@
+import pandas as pd
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+# ==============================================================================
+# MAPEO DE LOS REGISTROS PROCESADOS A LA HOJA "Datos" DEL TRM
+# ==============================================================================
+# Antes cada registro se armaba con iterrows: un diccionario con todas las columnas
+# del TRM, año/mes/país en A-C y los valores procesados corridos 4 posiciones, así
+# que una columna que faltara en df_result desplazaba todas las siguientes. Ahora
+# cada columna del TRM se llena por su letra: con una columna de los registros
+# procesados (MAPEO_COLUMNAS_TRM), con un valor fijo (A-C) o vacía, y el resultado
+# se arma de una vez por columnas. D, AJ y AK quedan vacías: llevan las fórmulas de
+# FORMULAS_TRM, que se escriben al añadir las filas ('{fila}' es el número de fila en
+# Excel y solo debe ir en referencias relativas, porque se escriben como fórmula
+# compartida de toda la columna; ver escritor_xlsx.py).
+PAIS_TRM = "Colombia"
+
+FORMULAS_TRM = {
+    "D": '=IFERROR(VLOOKUP(R{fila},vendedor!$B:$C,2,FALSE),"")',  # Comercial según el vendedor (R)
+    "AJ": "=IFERROR(1-(AH{fila}/W{fila}),0)",  # Margen
+    "AK": "=W{fila}-AH{fila}",  # Utilidad
+}
+
+MAPEO_COLUMNAS_TRM = {
+    "E": "Tipo Bien",
+    "F": "Clasificación Producto",
+    "G": "Línea",
+    "H": "Descripción Línea",
+    "I": "Sublínea",
+    "J": "Descripción Sublínea",
+    "K": "Código",
+    "L": "Nombre",
+    "M": "Número comprobante",
+    "N": "Numero comprobante",
+    "O": "Fecha elaboración",
+    "P": "Identificación",
+    "Q": "Nombre tercero",
+    "R": "Vendedor",
+    "S": "Cantidad",
+    "T": "Valor unitario",
+    "U": "Total",
+    "V": "Tasa de cambio",
+    "W": "Valor Total ME",
+    "X": "Observaciones",
+    "Y": "REL_Número comprobante",
+    "Z": "REL_Consecutivo",
+    "AA": "REL_Factura proveedor",
+    "AB": "REL_Identificación",
+    "AC": "REL_Nombre tercero",
+    "AD": "REL_Cantidad",
+    "AE": "REL_Valor unitario",
+    "AF": "REL_Tasa de cambio",
+    "AG": "REL_Total",
+    "AH": "REL_Valor Total ME",
+}
+
+
+def valores_fijos_trm(anio, mes):
+    """Columnas del TRM que llevan el mismo valor en todos los registros de una carga."""
+    return {"A": anio, "B": mes, "C": PAIS_TRM}
+
+
+def formulas_trm(formulas=FORMULAS_TRM):
+    """Plantillas de fórmula por índice de columna (desde 0), como las recibe escritor_xlsx."""
+    return {column_index_from_string(letra) - 1: plantilla for letra, plantilla in formulas.items()}
+
+
+def mapear_filas_trm(df_datos_procesados, columnas_destino, anio, mes, mapeo=MAPEO_COLUMNAS_TRM):
+    """
+    Arma los registros procesados con las columnas de la hoja "Datos" del TRM.
+
+    Args:
+        df_datos_procesados (pandas.DataFrame): Registros procesados (df_result).
+        columnas_destino (list): Encabezados del TRM, en orden (la primera es la columna A).
+        anio (int): Año de la carga.
+        mes (int): Mes de la carga.
+        mapeo (dict): Letra de columna del TRM -> columna de df_datos_procesados.
+
+    Returns:
+        pandas.DataFrame: Un registro por fila procesada, con las columnas de
+            columnas_destino. Las columnas sin origen (o cuyo origen no viene en
+            df_datos_procesados) quedan con "".
+    """
+    # Las columnas se toman como Series (sin copiar ni volver a inferir su tipo)
+    df_origen = df_datos_procesados.reset_index(drop=True)
+    fijos = valores_fijos_trm(anio, mes)
+    columnas = {}
+    for posicion, col_destino in enumerate(columnas_destino):
+        letra = get_column_letter(posicion + 1)
+        origen = mapeo.get(letra)
+        if letra in fijos:
+            columnas[col_destino] = fijos[letra]
+        elif origen is not None and origen in df_origen.columns:
+            columnas[col_destino] = df_origen[origen]
+        else:
+            columnas[col_destino] = ""
+    return pd.DataFrame(columnas, index=df_origen.index, columns=columnas_destino)
@@ -0,0 +1,240 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from esquema_siigo import TIPO_TEXTO
+from relacion_siigo import codificar_claves, emparejar, indexar_fuente
+
+# ==============================================================================
+# ÍNDICE PERSISTENTE DE DOCUMENTOS SIN PAREJA (ENTRE MESES)
+# ==============================================================================
+# Las FV-1/FV-2 y las DS-1/FC-1 que no encontraron pareja en su export se guardan
+# en una base SQLite (ARCHIVO_PENDIENTES, dentro de RUTA_PENDIENTES_SIIGO): una fila
+# por documento con su clave de relación, la huella del export del que viene, la
+# fecha en que entró y la fila completa en JSON. El export siguiente busca, por el
+# índice (lado, clave), solo las filas guardadas con las mismas claves que sus
+# propias filas sin pareja, así que una DS que llega un mes después de su FV se
+# relaciona sin volver a subir los dos meses y sin leer ni reescribir el histórico.
+# Las filas que encuentran pareja salen de 'pendientes' y pasan a 'relacionados'
+# con la huella del export que las tomó: si ese export se procesa otra vez, vuelven
+# a 'pendientes' (y se quitan las que él mismo agregó), para que dé el mismo
+# resultado. Las filas más antiguas que DIAS_MAXIMOS_PENDIENTES se borran.
+RUTA_PENDIENTES_SIIGO = os.environ.get(
+    "SIIGO_PENDIENTES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pendientes_siigo")
+)
+DIAS_MAXIMOS_PENDIENTES = int(os.environ.get("SIIGO_PENDIENTES_DIAS", "400"))
+ARCHIVO_PENDIENTES = "pendientes.sqlite"
+SEPARADOR_CLAVE = "\x1f"
+# Lo que deja astype(str) en una clave vacía según la versión de pandas ('nan', '<NA>', 'None')
+VALORES_SIN_CLAVE = ["", "nan", "NaN", "<NA>", "None"]
+
+_COLUMNAS_FILA = "id, lado, clave, origen, fecha, datos"
+_candado_pendientes = threading.Lock()
+
+
+def _conectar(ruta_pendientes):
+    """Abre el índice y crea sus tablas si todavía no existen."""
+    os.makedirs(ruta_pendientes, exist_ok=True)
+    conexion = sqlite3.connect(os.path.join(ruta_pendientes, ARCHIVO_PENDIENTES), timeout=30)
+    # AUTOINCREMENT: una fila que vuelve de 'relacionados' conserva su id (y su orden)
+    conexion.executescript(
+        "CREATE TABLE IF NOT EXISTS pendientes ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, lado TEXT NOT NULL, clave TEXT NOT NULL,"
+        " origen TEXT NOT NULL, fecha REAL NOT NULL, datos TEXT NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS pendientes_clave ON pendientes (lado, clave);"
+        "CREATE INDEX IF NOT EXISTS pendientes_origen ON pendientes (origen);"
+        "CREATE INDEX IF NOT EXISTS pendientes_fecha ON pendientes (fecha);"
+        "CREATE TABLE IF NOT EXISTS relacionados ("
+        " id INTEGER PRIMARY KEY, lado TEXT NOT NULL, clave TEXT NOT NULL,"
+        " origen TEXT NOT NULL, fecha REAL NOT NULL, datos TEXT NOT NULL, relacionado_en TEXT NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS relacionados_en ON relacionados (relacionado_en);"
+        "CREATE INDEX IF NOT EXISTS relacionados_origen ON relacionados (origen);"
+        "CREATE INDEX IF NOT EXISTS relacionados_fecha ON relacionados (fecha);"
+    )
+    return conexion
+
+
+def _claves_texto(df, claves):
+    """Clave de relación de cada fila como un solo texto (valores unidos por SEPARADOR_CLAVE)."""
+    textos = df[claves[0]].astype(str)
+    for columna in claves[1:]:
+        textos = textos + SEPARADOR_CLAVE + df[columna].astype(str)
+    return textos
+
+
+def _filas_json(df):
+    """Cada fila como un objeto JSON columna -> valor (los vacíos como null)."""
+    columnas = list(df.columns)
+    valores = df.astype(object).where(df.notna(), None)
+    return [json.dumps(dict(zip(columnas, fila)), ensure_ascii=False, default=str)
+            for fila in valores.itertuples(index=False, name=None)]
+
+
+def _filas_desde_json(datos):
+    """DataFrame con las filas guardadas; las columnas de texto quedan con TIPO_TEXTO."""
+    df = pd.DataFrame([json.loads(fila) for fila in datos])
+    # Columnas que mezclan tipos entre meses (p. ej. vacía en uno y con texto en otro)
+    columnas_texto = [col for col in df.columns if df[col].dtype == object]
+    return df.astype({col: TIPO_TEXTO for col in columnas_texto}) if columnas_texto else df
+
+
+def _agregar_pendientes(conexion, lado, df, claves, huella):
+    """Guarda las filas nuevas sin pareja con el export del que vienen y la fecha actual."""
+    if df.empty:
+        return
+    conexion.executemany(
+        "INSERT INTO pendientes (lado, clave, origen, fecha, datos) VALUES (?, ?, ?, ?, ?)",
+        zip(itertools.repeat(lado), _claves_texto(df, claves), itertools.repeat(huella),
+            itertools.repeat(time.time()), _filas_json(df))
+    )
+
+
+def _cargar_por_claves(conexion, lado, claves):
+    """
+    Filas de un lado que esperan pareja y tienen alguna de las claves, en el orden en
+    que entraron al índice.
+
+    Returns:
+        tuple: (ids de las filas (numpy.ndarray), DataFrame con sus datos).
+    """
+    conexion.execute("CREATE TEMP TABLE IF NOT EXISTS claves_buscadas (clave TEXT PRIMARY KEY)")
+    conexion.execute("DELETE FROM claves_buscadas")
+    conexion.executemany("INSERT OR IGNORE INTO claves_buscadas (clave) VALUES (?)", ((clave,) for clave in claves))
+    registros = conexion.execute(
+        "SELECT p.id, p.datos FROM pendientes p JOIN claves_buscadas c ON p.clave = c.clave"
+        " WHERE p.lado = ? ORDER BY p.id",
+        (lado,)
+    ).fetchall()
+    if not registros:
+        return np.array([], dtype=np.int64), pd.DataFrame()
+    return np.array([registro[0] for registro in registros], dtype=np.int64), _filas_desde_json([registro[1] for registro in registros])
+
+
+def _mover_a_relacionados(conexion, ids, huella):
+    """Saca de 'pendientes' las filas que encontraron pareja, guardándolas con la huella del export."""
+    ids = [(int(id_fila),) for id_fila in ids]
+    conexion.executemany(
+        f"INSERT INTO relacionados ({_COLUMNAS_FILA}, relacionado_en)"
+        f" SELECT {_COLUMNAS_FILA}, ? FROM pendientes WHERE id = ?",
+        [(huella, id_fila) for (id_fila,) in ids]
+    )
+    conexion.executemany("DELETE FROM pendientes WHERE id = ?", ids)
+
+
+def _preparar_export(conexion, huella, limite):
+    """
+    Borra las filas vencidas y las que vinieron de este mismo export, y devuelve a
+    'pendientes' las que este export había relacionado antes, para que procesarlo
+    otra vez dé el mismo resultado.
+    """
+    for tabla in ("pendientes", "relacionados"):
+        conexion.execute(f"DELETE FROM {tabla} WHERE fecha < ? OR origen = ?", (limite, huella))
+    conexion.execute(
+        f"INSERT INTO pendientes ({_COLUMNAS_FILA}) SELECT {_COLUMNAS_FILA} FROM relacionados WHERE relacionado_en = ?",
+        (huella,)
+    )
+    conexion.execute("DELETE FROM relacionados WHERE relacionado_en = ?", (huella,))
+
+
+def _emparejar_lados(df_destino, df_fuente, claves_destino, claves_fuente, modo):
+    """
+    Parejas entre dos conjuntos de filas sin pareja.
+
+    Returns:
+        tuple: (DataFrame con las parejas, posiciones usadas de df_destino, posiciones
+            usadas de df_fuente).
+    """
+    vacio = (pd.DataFrame(), np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    if df_destino.empty or df_fuente.empty:
+        return vacio
+
+    codigos_destino, codigos_fuente, num_claves = codificar_claves(df_destino[claves_destino], df_fuente[claves_fuente])
+    posiciones_destino, posiciones_fuente, usadas = emparejar(codigos_destino, indexar_fuente(codigos_fuente, num_claves), modo)
+    con_pareja = posiciones_fuente >= 0
+    if not con_pareja.any():
+        return vacio
+
+    pares = pd.concat([
+        df_destino.iloc[posiciones_destino[con_pareja]].reset_index(drop=True),
+        df_fuente.iloc[posiciones_fuente[con_pareja]].reset_index(drop=True),
+    ], axis=1)
+    return pares, np.unique(posiciones_destino[con_pareja]), np.flatnonzero(usadas)
+
+
+def _sin_clave_completa(df, claves):
+    # Un export sin DS/FC no trae ni siquiera las columnas de la fuente
+    if df.empty:
+        return df
+    sin_clave = df[claves].isna() | df[claves].isin(VALORES_SIN_CLAVE)
+    return df[~sin_clave.any(axis=1)]
+
+
+def cruzar_con_pendientes(nuevas_destino, nuevas_fuente, huella, claves_destino, claves_fuente, modo="todos",
+                          ruta_pendientes=RUTA_PENDIENTES_SIIGO, dias_maximos=DIAS_MAXIMOS_PENDIENTES):
+    """
+    Cruza las filas sin pareja de un export con las de exports anteriores y actualiza el índice.
+
+    Solo se usan filas con la clave completa: una DS/FC sin NIT en 'Observaciones' no
+    puede relacionarse con nada en otro mes y no se guarda. Del índice solo se leen las
+    filas con las claves de este export, y las que encuentran pareja salen de él.
+
+    Args:
+        nuevas_destino (pandas.DataFrame): FV sin pareja del export, con las claves normalizadas.
+        nuevas_fuente (pandas.DataFrame): DS/FC sin pareja del export (columnas ya prefijadas).
+        huella (str): SHA-256 del export (ver cache_siigo.huella_archivo).
+        claves_destino (list): Columnas de la clave en las FV.
+        claves_fuente (list): Columnas de la clave en las DS/FC, en el mismo orden.
+        modo (str): Modo de relacion_siigo.MODOS_RELACION.
+        ruta_pendientes (str): Carpeta del índice.
+        dias_maximos (int): Días que una fila puede esperar su pareja.
+
+    Returns:
+        tuple: (DataFrame con las parejas encontradas (columnas FV y luego DS/FC),
+            etiquetas de nuevas_destino que encontraron pareja, etiquetas de
+            nuevas_fuente que encontraron pareja, dict con los conteos).
+    """
+    nuevas_destino = _sin_clave_completa(nuevas_destino, claves_destino)
+    nuevas_fuente = _sin_clave_completa(nuevas_fuente, claves_fuente)
+    claves_nuevas_destino = _claves_texto(nuevas_destino, claves_destino) if not nuevas_destino.empty else []
+    claves_nuevas_fuente = _claves_texto(nuevas_fuente, claves_fuente) if not nuevas_fuente.empty else []
+    limite = time.time() - dias_maximos * 86400
+
+    with _candado_pendientes, closing(_conectar(ruta_pendientes)) as conexion:
+        with conexion:
+            conexion.execute("BEGIN IMMEDIATE")
+            _preparar_export(conexion, huella, limite)
+
+            # FV nuevas contra DS/FC de meses anteriores, y FV anteriores contra DS/FC nuevas
+            ids_fuente, pendientes_fuente = _cargar_por_claves(conexion, "fuente", claves_nuevas_destino)
+            ids_destino, pendientes_destino = _cargar_por_claves(conexion, "destino", claves_nuevas_fuente)
+            pares_fv_nuevas, usadas_destino, usadas_pendientes_fuente = _emparejar_lados(
+                nuevas_destino, pendientes_fuente, claves_destino, claves_fuente, modo
+            )
+            pares_fuente_nuevas, usadas_pendientes_destino, usadas_fuente = _emparejar_lados(
+                pendientes_destino, nuevas_fuente, claves_destino, claves_fuente, modo
+            )
+            _mover_a_relacionados(
+                conexion, np.concatenate([ids_fuente[usadas_pendientes_fuente], ids_destino[usadas_pendientes_destino]]), huella
+            )
+            _agregar_pendientes(conexion, "destino", nuevas_destino.drop(index=nuevas_destino.index[usadas_destino]),
+                                claves_destino, huella)
+            _agregar_pendientes(conexion, "fuente", nuevas_fuente.drop(index=nuevas_fuente.index[usadas_fuente]),
+                                claves_fuente, huella)
+            conteos = dict(conexion.execute("SELECT lado, COUNT(*) FROM pendientes GROUP BY lado").fetchall())
+
+    estadisticas = {
+        "parejas_fv_nuevas": len(pares_fv_nuevas),
+        "parejas_fuente_nuevas": len(pares_fuente_nuevas),
+        "fv_pendientes": conteos.get("destino", 0),
+        "fuente_pendientes": conteos.get("fuente", 0),
+    }
+    pares = pd.concat([pares_fv_nuevas, pares_fuente_nuevas], ignore_index=True)
+    return pares, nuevas_destino.index[usadas_destino], nuevas_fuente.index[usadas_fuente], estadisticas
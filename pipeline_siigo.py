@@ -0,0 +1,599 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from cache_siigo import RUTA_CACHE_SIIGO, huella_archivo, leer_siigo_con_cache
+from esquema_siigo import (ESQUEMA_SIIGO, aplicar_esquema, concatenar_bloques, mapear_categorias, quitar_categorias,
+                           reemplazar_valores)
+from extractor_siigo import PATRONES_OBSERVACIONES, PATRONES_REFERENCIA, extraer_etiquetas
+from lector_siigo import TAMANO_BLOQUE, leer_siigo_por_bloques
+from pendientes_siigo import RUTA_PENDIENTES_SIIGO, cruzar_con_pendientes
+from relacion_siigo import relacionar_documentos
+
+# ==============================================================================
+# PROCESAMIENTO POR BLOQUES DEL EXPORT DE SIIGO
+# ==============================================================================
+# Todos los pasos de la limpieza (Línea/Sublínea, Clasificación Producto, Total,
+# Numero comprobante, TRM de 'Observaciones', Valor Total ME) dependen solo de la
+# fila, así que se aplican bloque por bloque sobre lo que entrega lector_siigo.py.
+# Cada bloque se recorta de inmediato a las columnas del archivo final, y el único
+# paso con estado global es el relacionamiento FV ↔ DS/FC, que necesita ver todos
+# los documentos antes de cruzarlos.
+COLUMNAS_A_ELIMINAR = [
+    "Sucursal",
+    "Centro costo",
+    "Fecha creación",
+    "Fecha modificación",
+    "Correo electrónico",
+    "Tipo de registro",
+    "Referencia fábrica",
+    "Bodega",
+    #"Identificación Vendedor",
+    "Nombre vendedor",
+    "Valor desc.",
+    "Base AIU",
+    "Impuesto cargo",
+    "Valor Impuesto Cargo",
+    "Impuesto Cargo 2",
+    "Valor Impuesto Cargo 2",
+    "Impuesto retención",
+    "Valor Impuesto Retención",
+    "Base retención (ICA/IVA)",
+    "Cargo en totales",
+    "Descuento en totales",
+    "Moneda",
+    "Forma pago",
+    "Fecha vencimiento",
+    "Nombre contacto"
+]
+
+COLUMNAS_FINALES = [
+    # Columnas del lado izquierdo (FV)
+    'Tipo Bien', 'Clasificación Producto', 'Línea', 'Descripción Línea', 'Sublínea', 'Descripción Sublínea', 'Código', 'Nombre', 'Número comprobante', 'Numero comprobante',
+    'Fecha elaboración', 'Identificación', 'Nombre tercero', 'Vendedor', 'Cantidad',
+    'Valor unitario', 'Total', 'Tasa de cambio', 'Valor Total ME', 'Observaciones',
+
+    # Columnas del lado derecho (REL_)
+    'REL_Número comprobante', 'REL_Consecutivo',
+    'REL_Factura proveedor', 'REL_Identificación', 'REL_Nombre tercero', 'REL_Cantidad',
+    'REL_Valor unitario',  'REL_Tasa de cambio', 'REL_Total', 'REL_Valor Total ME'
+]
+
+COLUMNAS_VACIAS_FINALES = ['Clasificación Producto', 'Línea', 'Descripción Línea', 'Sublínea', 'Descripción Sublínea']
+MAPEO_TIPO_BIEN = {'Servicio': 'S', 'Producto': 'P'}
+PREFIJOS_NUMERO_COMPROBANTE = {'FV-1': 'FLE-', 'FV-2': 'FSE-'}  # 'Numero comprobante' = prefijo + Consecutivo
+COMPROBANTES_DESTINO = ['FV-1', 'FV-2']
+COMPROBANTES_FUENTE = ['DS-1', 'FC-1']
+PREFIJO_RELACION = 'REL_'
+MODO_RELACION = 'todos'  # Ver relacion_siigo.MODOS_RELACION
+CLAVES_RELACION_DESTINO = ['Identificación', 'Código']
+CLAVES_RELACION_FUENTE = ['NIT_relacion', 'Código']  # Sin el prefijo 'REL_'
+COLUMNA_ESTADO_RELACION = '_relacion'  # 'ambos', 'solo_destino' o 'solo_fuente'; no llega al archivo final
+
+
+def convertir_a_numero_limpiando_comas(columna):
+    """Convierte una columna a número quitando las comas de miles."""
+    if not pd.api.types.is_string_dtype(columna):
+        columna = columna.astype(str)
+    columna_limpia = columna.str.replace(',', '', regex=False)
+    return pd.to_numeric(columna_limpia, errors='coerce')
+
+
+def nuevo_resumen():
+    """
+    Crea el diccionario donde los pasos acumulan los conteos de todos los bloques,
+    para mostrar los mensajes de estado una sola vez al final.
+    """
+    return {
+        "filas_saltadas": None,
+        "desde_cache": False,
+        "filas_leidas": 0,
+        "filas_sin_tipo_clasificacion": 0,
+        "lineas": 0,
+        "sublineas": 0,
+        "clasificaciones": 0,
+        "trm_observaciones": 0,
+        "ejemplo_trm": [],
+        "muestra_observaciones": [],
+        "columnas_leidas": [],
+        "relacionado": False,
+        "relacion": {},
+        "cardinalidad_relacion": [],
+        "pendientes": {},
+    }
+
+
+def transformar_bloque(df_bloque, resumen, columnas_a_eliminar=COLUMNAS_A_ELIMINAR, mapeo_tipo_bien=MAPEO_TIPO_BIEN):
+    """
+    Aplica a un bloque los pasos de limpieza que dependen solo de cada fila.
+
+    Args:
+        df_bloque (pandas.DataFrame): Bloque del export de Siigo tal como lo entrega el lector.
+        resumen (dict): Conteos acumulados (ver nuevo_resumen); se actualiza en el sitio.
+        columnas_a_eliminar (list): Columnas del export que se descartan.
+        mapeo_tipo_bien (dict): Reemplazos de los valores de 'Tipo Bien'.
+
+    Returns:
+        pandas.DataFrame: El bloque transformado (mismo índice, sin las filas sin 'Tipo clasificación').
+    """
+    columnas = df_bloque.columns
+    if not resumen["columnas_leidas"]:
+        resumen["columnas_leidas"] = list(columnas)
+    resumen["filas_leidas"] += len(df_bloque)
+
+    # Columna 'Vendedor' a partir de 'Identificación Vendedor'
+    if 'Identificación Vendedor' in columnas:
+        df_bloque['Vendedor'] = df_bloque['Identificación Vendedor']
+    else:
+        df_bloque['Vendedor'] = ''
+
+    # Línea (entre paréntesis) y Sublínea (entre llaves) desde "Referencia fábrica"
+    if "Referencia fábrica" in columnas:
+        etiquetas_referencia = extraer_etiquetas(df_bloque['Referencia fábrica'].astype(str), PATRONES_REFERENCIA)
+        df_bloque['Línea'] = etiquetas_referencia['Línea'].fillna('')
+        df_bloque['Sublínea'] = etiquetas_referencia['Sublínea'].fillna('')
+        resumen["lineas"] += int(df_bloque['Línea'].ne('').sum())
+        resumen["sublineas"] += int(df_bloque['Sublínea'].ne('').sum())
+    else:
+        df_bloque['Línea'] = ''
+        df_bloque['Sublínea'] = ''
+
+    # Clasificación Producto "...", TRM {...} y NIT relacionado (...) desde "Observaciones"
+    if "Observaciones" in columnas:
+        df_bloque['Observaciones'] = df_bloque['Observaciones'].astype(str)
+        etiquetas_observaciones = extraer_etiquetas(df_bloque['Observaciones'], PATRONES_OBSERVACIONES)
+        df_bloque['Clasificación Producto'] = etiquetas_observaciones['Clasificación Producto'].fillna('')
+        df_bloque['NIT_relacion'] = etiquetas_observaciones['NIT_relacion']
+        resumen["clasificaciones"] += int(df_bloque['Clasificación Producto'].ne('').sum())
+    else:
+        df_bloque['Clasificación Producto'] = ''
+
+    # 1. Eliminar filas donde "Tipo clasificación" esté vacío/NaN
+    if "Tipo clasificación" in columnas:
+        filas_antes = len(df_bloque)
+        df_bloque = df_bloque.dropna(subset=["Tipo clasificación"])
+        resumen["filas_sin_tipo_clasificacion"] += filas_antes - len(df_bloque)
+
+    # 2. Eliminar columnas especificadas
+    df_bloque = df_bloque.drop(columns=[col for col in columnas_a_eliminar if col in columnas])
+
+    # 3. Actualizar la columna "Total" existente
+    if "Cantidad" in columnas and "Valor unitario" in columnas and "Total" in columnas:
+        df_bloque["Cantidad"] = pd.to_numeric(df_bloque["Cantidad"], errors='coerce')
+        df_bloque["Valor unitario"] = pd.to_numeric(df_bloque["Valor unitario"], errors='coerce')
+        df_bloque["Total"] = (df_bloque["Cantidad"] * df_bloque["Valor unitario"]).fillna(0)
+
+    # 4. Crear "Numero comprobante" antes de "Factura proveedor"
+    if all(col in columnas for col in ['Número comprobante', 'Consecutivo', 'Factura proveedor']):
+        # Con el esquema, el prefijo se decide una vez por comprobante distinto (códigos de la categoría)
+        prefijos = mapear_categorias(df_bloque['Número comprobante'], PREFIJOS_NUMERO_COMPROBANTE, '')
+        # El lector deja como texto los consecutivos escritos como texto en el export
+        consecutivo = pd.to_numeric(df_bloque['Consecutivo'], errors='coerce').astype('Int64').astype(str)
+        valores_nueva_columna = np.where(prefijos != '', prefijos + consecutivo, '')
+        df_bloque.insert(df_bloque.columns.get_loc('Factura proveedor'), 'Numero comprobante', valores_nueva_columna)
+
+    # 5. Sobrescribir 'Tasa de cambio' con la TRM entre {} de 'Observaciones'
+    if "Tasa de cambio" in columnas and "Observaciones" in columnas:
+        df_bloque['Tasa de cambio'] = convertir_a_numero_limpiando_comas(df_bloque['Tasa de cambio']).fillna(0.0).astype(float)
+
+        if not resumen["muestra_observaciones"]:
+            resumen["muestra_observaciones"] = df_bloque['Observaciones'].head(10).tolist()
+
+        trm_extraida = etiquetas_observaciones['TRM'].loc[df_bloque.index].dropna()
+        trm_numerica = pd.to_numeric(trm_extraida.str.replace(',', '', regex=False).str.strip(), errors='coerce').dropna()
+        df_bloque.loc[trm_numerica.index, 'Tasa de cambio'] = trm_numerica
+        resumen["trm_observaciones"] += len(trm_numerica)
+        if len(resumen["ejemplo_trm"]) < 10:
+            resumen["ejemplo_trm"].extend(trm_numerica.head(10 - len(resumen["ejemplo_trm"])).tolist())
+
+    # 5.1. 'Valor Total ME' = Total / Tasa de cambio (0 cuando no hay tasa)
+    if 'Total' in df_bloque.columns and 'Tasa de cambio' in df_bloque.columns:
+        tasa_numerica = pd.to_numeric(df_bloque['Tasa de cambio'], errors='coerce').replace(0, np.nan)
+        df_bloque['Valor Total ME'] = (df_bloque['Total'] / tasa_numerica).fillna(0)
+
+    # 7.A Renombrar "Tipo clasificación" a "Tipo Bien" con los valores 'S'/'P'
+    if "Tipo clasificación" in df_bloque.columns:
+        df_bloque = df_bloque.rename(columns={"Tipo clasificación": "Tipo Bien"})
+        df_bloque['Tipo Bien'] = reemplazar_valores(df_bloque['Tipo Bien'], mapeo_tipo_bien)
+
+    return df_bloque
+
+
+def procesar_bloques(bloques, resumen, columnas_a_eliminar=COLUMNAS_A_ELIMINAR, mapeo_tipo_bien=MAPEO_TIPO_BIEN,
+                     esquema=None):
+    """
+    Generador que aplica transformar_bloque a cada bloque del export.
+
+    Args:
+        bloques (iterable): DataFrames del export (p. ej. leer_siigo_por_bloques).
+        resumen (dict): Conteos acumulados (ver nuevo_resumen).
+        columnas_a_eliminar (list): Ver transformar_bloque.
+        mapeo_tipo_bien (dict): Ver transformar_bloque.
+        esquema (dict, optional): Tipos compactos por columna (ver esquema_siigo.py). Se
+            aplican a cada bloque recién leído, para que la limpieza compare códigos de
+            categoría, y de nuevo al bloque transformado para las columnas que ella crea.
+
+    Yields:
+        pandas.DataFrame: Bloques transformados.
+    """
+    for df_bloque in bloques:
+        if not esquema:
+            yield transformar_bloque(df_bloque, resumen, columnas_a_eliminar, mapeo_tipo_bien)
+            continue
+        df_bloque = transformar_bloque(aplicar_esquema(df_bloque, esquema), resumen, columnas_a_eliminar, mapeo_tipo_bien)
+        yield aplicar_esquema(df_bloque, esquema)
+
+
+def separar_documentos(bloques, resumen, columnas_conservadas=COLUMNAS_FINALES,
+                       comprobantes_destino=COMPROBANTES_DESTINO, comprobantes_fuente=COMPROBANTES_FUENTE):
+    """
+    Consume los bloques y guarda de cada uno solo las columnas que llegan al archivo
+    final, separadas en destino (FV) y fuente (DS/FC) para el relacionamiento.
+
+    Las filas de otros comprobantes se conservan únicamente mientras no aparezca
+    ningún documento fuente, porque en ese caso el resultado es el export completo.
+
+    Args:
+        bloques (iterable): Bloques transformados (p. ej. procesar_bloques).
+        resumen (dict): Conteos acumulados.
+        columnas_conservadas (list): Columnas finales (las 'REL_' se buscan sin prefijo en la fuente).
+        comprobantes_destino (list): Valores de 'Número comprobante' del lado izquierdo.
+        comprobantes_fuente (list): Valores de 'Número comprobante' del lado derecho.
+
+    Returns:
+        dict: DataFrames 'destino', 'fuente' y 'otros' (None si no hubo filas de ese tipo).
+    """
+    columnas_destino = [col for col in columnas_conservadas if not col.startswith(PREFIJO_RELACION)]
+    columnas_fuente = [col[len(PREFIJO_RELACION):] for col in columnas_conservadas if col.startswith(PREFIJO_RELACION)]
+    columnas_fuente += ['Código', 'NIT_relacion']
+
+    partes_destino, partes_fuente, partes_otros = [], [], []
+
+    for df_bloque in bloques:
+        comprobante = df_bloque['Número comprobante']
+        es_destino = comprobante.isin(comprobantes_destino)
+        es_fuente = comprobante.isin(comprobantes_fuente)
+
+        partes_destino.append(df_bloque.loc[es_destino, [col for col in columnas_destino if col in df_bloque.columns]])
+
+        if es_fuente.any():
+            # 'NIT_relacion' ya viene extraído de 'Observaciones' en transformar_bloque
+            partes_fuente.append(df_bloque.loc[es_fuente, [col for col in columnas_fuente if col in df_bloque.columns]])
+            partes_otros = []
+        elif not partes_fuente:
+            partes_otros.append(df_bloque.loc[~es_destino, [col for col in columnas_destino if col in df_bloque.columns]])
+
+    return {
+        "destino": concatenar_bloques(partes_destino) if partes_destino else pd.DataFrame(columns=columnas_destino),
+        "fuente": concatenar_bloques(partes_fuente) if partes_fuente else None,
+        "otros": concatenar_bloques(partes_otros) if partes_otros else None,
+    }
+
+
+def cruzar_documentos(partes, resumen, modo_relacion=MODO_RELACION):
+    """
+    Relaciona los documentos FV-1/FV-2 con los DS-1/FC-1 por Identificación/Código
+    contra el NIT entre paréntesis de 'Observaciones' y Código (ver relacion_siigo.py).
+
+    Args:
+        partes (dict): Resultado de separar_documentos (no se modifica).
+        resumen (dict): Conteos acumulados; se marca 'relacionado' y se guardan las
+            estadísticas ('relacion') y las claves muchos-a-muchos ('cardinalidad_relacion').
+        modo_relacion (str): 'todos' (outer join), 'primero' o 'uno_a_uno'.
+
+    Returns:
+        pandas.DataFrame: Documentos relacionados, o todas las filas si no hay DS-1/FC-1.
+    """
+    df_destino = partes["destino"].copy()
+
+    if partes["fuente"] is None:
+        if partes["otros"] is None:
+            return df_destino
+        return concatenar_bloques([df_destino, partes["otros"]]).sort_index()
+
+    df_fuente = partes["fuente"].copy()
+    df_destino = normalizar_claves_destino(df_destino)
+    df_fuente['NIT_relacion'] = df_fuente['NIT_relacion'].astype(str)
+    df_fuente['Código'] = df_fuente['Código'].astype(str)
+
+    # Añadir prefijo a las columnas para evitar colisiones y dar claridad
+    df_fuente = df_fuente.add_prefix(PREFIJO_RELACION)
+
+    df_relacionado, resumen["relacion"], resumen["cardinalidad_relacion"] = relacionar_documentos(
+        df_destino,
+        df_fuente,
+        CLAVES_RELACION_DESTINO,
+        [PREFIJO_RELACION + col for col in CLAVES_RELACION_FUENTE],
+        modo_relacion,
+        indicador=COLUMNA_ESTADO_RELACION
+    )
+    resumen["relacionado"] = True
+    return df_relacionado
+
+
+def _nit_como_texto(valor):
+    """Un NIT numérico como texto sin decimales (900123456.0 -> '900123456'); los textos y vacíos quedan igual."""
+    if isinstance(valor, (int, float, np.integer, np.floating)) and math.isfinite(valor) and float(valor).is_integer():
+        return str(int(valor))
+    return valor
+
+
+def normalizar_claves_destino(df):
+    """Identificación y Código como texto, que es como se comparan con el NIT y el Código de la fuente."""
+    conversiones = {}
+    identificacion = df['Identificación']
+    if isinstance(identificacion.dtype, pd.CategoricalDtype):
+        # Con el esquema se convierte cada NIT distinto (las categorías), no cada fila
+        if not pd.api.types.is_string_dtype(identificacion.cat.categories):
+            categorias = pd.Index([_nit_como_texto(categoria) for categoria in identificacion.cat.categories])
+            if categorias.is_unique:
+                conversiones['Identificación'] = identificacion.cat.rename_categories(categorias)
+            else:
+                # El mismo NIT como número y como texto ('123' y 123): se convierten los valores
+                conversiones['Identificación'] = identificacion.astype(object).map(_nit_como_texto).astype('category')
+    elif pd.api.types.is_numeric_dtype(identificacion):
+        conversiones['Identificación'] = identificacion.astype('Int64').astype(str)
+    elif not pd.api.types.is_string_dtype(identificacion):
+        # Celdas numéricas y de texto en la misma columna (el lector no convierte los textos)
+        conversiones['Identificación'] = identificacion.map(_nit_como_texto)
+    if not pd.api.types.is_string_dtype(df['Código']):
+        conversiones['Código'] = df['Código'].astype(str)
+    return df.assign(**conversiones) if conversiones else df
+
+
+def relacionar_con_meses_anteriores(df_relacionado, huella, resumen, ruta_pendientes=RUTA_PENDIENTES_SIIGO,
+                                    comprobantes_destino=COMPROBANTES_DESTINO, modo_relacion=MODO_RELACION):
+    """
+    Cruza las FV y DS/FC que quedaron sin pareja en este export con las que quedaron
+    sin pareja en exports anteriores (ver pendientes_siigo.py) y actualiza ese índice.
+
+    Las parejas encontradas reemplazan a las filas sin pareja de este export y se
+    agregan al final. Una FV de un mes anterior que encuentra su DS/FC en este export
+    sale de nuevo, ahora relacionada.
+
+    Args:
+        df_relacionado (pandas.DataFrame): Resultado de cruzar_documentos (no se modifica).
+        huella (str): SHA-256 del export.
+        resumen (dict): Conteos acumulados; se guardan en 'pendientes'.
+        ruta_pendientes (str): Carpeta del índice de pendientes.
+        comprobantes_destino (list): Valores de 'Número comprobante' del lado izquierdo.
+        modo_relacion (str): Modo con el que se forman las parejas.
+
+    Returns:
+        pandas.DataFrame: El resultado con las parejas entre meses.
+    """
+    df = quitar_categorias(df_relacionado)
+    columnas_fuente = [col for col in df.columns if col.startswith(PREFIJO_RELACION)]
+    columnas_destino = [col for col in df.columns if col not in columnas_fuente and col != COLUMNA_ESTADO_RELACION]
+
+    es_fv = df['Número comprobante'].isin(comprobantes_destino)
+    if COLUMNA_ESTADO_RELACION in df.columns:
+        fv_sin_pareja = es_fv & df[COLUMNA_ESTADO_RELACION].eq('solo_destino')
+        fuente_sin_pareja = df[COLUMNA_ESTADO_RELACION].eq('solo_fuente')
+    else:
+        # El export no trajo DS/FC: todas sus FV están sin pareja
+        fv_sin_pareja = es_fv
+        fuente_sin_pareja = pd.Series(False, index=df.index)
+
+    pares, usadas_destino, usadas_fuente, resumen["pendientes"] = cruzar_con_pendientes(
+        normalizar_claves_destino(df.loc[fv_sin_pareja, columnas_destino]),
+        df.loc[fuente_sin_pareja, columnas_fuente],
+        huella,
+        CLAVES_RELACION_DESTINO,
+        [PREFIJO_RELACION + col for col in CLAVES_RELACION_FUENTE],
+        modo_relacion,
+        ruta_pendientes
+    )
+    if pares.empty:
+        return df
+    return pd.concat([df.drop(index=usadas_destino.union(usadas_fuente)), pares], ignore_index=True)
+
+
+def organizar_columnas_finales(df, columnas_finales=COLUMNAS_FINALES, columnas_vacias=COLUMNAS_VACIAS_FINALES):
+    """
+    Agrega las columnas descriptivas vacías, deja solo las columnas finales en su orden
+    y devuelve las columnas categóricas del esquema a valores normales.
+    """
+    df = df.copy()
+    for columna in columnas_vacias:
+        if columna not in df.columns:
+            df[columna] = ''
+    return quitar_categorias(df[[col for col in columnas_finales if col in df.columns]])
+
+
+# ==============================================================================
+# ETAPAS CON MEMORIA (DAG DEL PROCESAMIENTO)
+# ==============================================================================
+# El procesamiento se divide en etapas con entradas, salida y configuración
+# declaradas. La clave de cada etapa es el SHA-256 de su nombre, su configuración
+# y las claves de sus entradas (la del archivo es el SHA-256 de su contenido), así
+# que se calcula sin mirar los datos. Si solo cambia la configuración de una etapa
+# (p. ej. el orden de 'columnas_finales'), las anteriores se toman de la memoria y
+# solo se recalcula desde esa etapa en adelante.
+CONFIGURACION_PIPELINE = {
+    "filas_a_saltar": None,
+    "columnas_a_eliminar": COLUMNAS_A_ELIMINAR,
+    "mapeo_tipo_bien": MAPEO_TIPO_BIEN,
+    "comprobantes_destino": COMPROBANTES_DESTINO,
+    "comprobantes_fuente": COMPROBANTES_FUENTE,
+    "modo_relacion": MODO_RELACION,
+    "columnas_finales": COLUMNAS_FINALES,
+    "columnas_vacias_finales": COLUMNAS_VACIAS_FINALES,
+    "esquema": ESQUEMA_SIIGO,  # None conserva los tipos que infiere el lector
+}
+MAX_RESULTADOS_EN_MEMORIA = 12  # Resultados de etapas guardados (LRU) entre ejecuciones de Streamlit
+
+_memoria_etapas = OrderedDict()
+_candado_memoria = threading.Lock()
+
+
+def _etapa_limpieza(entradas, configuracion, resumen, opciones):
+    """Lectura del export (con caché en Parquet), pasos por fila y separación FV / DS-FC."""
+    archivo = entradas["archivo"]
+    filas_a_saltar = configuracion["filas_a_saltar"]
+    if opciones["ruta_cache"] is None:
+        bloques_leidos = leer_siigo_por_bloques(archivo, filas_a_saltar, opciones["tamano_bloque"], detalles=resumen)
+    else:
+        bloques_leidos = leer_siigo_con_cache(archivo, filas_a_saltar, opciones["tamano_bloque"], opciones["ruta_cache"],
+                                              detalles=resumen, huella=opciones["huella"])
+
+    bloques = procesar_bloques(
+        bloques_leidos, resumen, configuracion["columnas_a_eliminar"], configuracion["mapeo_tipo_bien"],
+        configuracion["esquema"]
+    )
+    return separar_documentos(
+        bloques, resumen, configuracion["columnas_conservadas"],
+        configuracion["comprobantes_destino"], configuracion["comprobantes_fuente"]
+    )
+
+
+def _etapa_relacionamiento(entradas, configuracion, resumen, opciones):
+    return cruzar_documentos(entradas["partes"], resumen, configuracion["modo_relacion"])
+
+
+def _etapa_organizacion(entradas, configuracion, resumen, opciones):
+    return organizar_columnas_finales(entradas["df_relacionado"], configuracion["columnas_finales"], configuracion["columnas_vacias_finales"])
+
+
+ETAPAS_PIPELINE = [
+    {
+        "nombre": "limpieza",
+        "entradas": ["archivo"],
+        "salida": "partes",
+        # Solo importa qué columnas se conservan, no su orden
+        "configuracion": lambda c: {
+            "filas_a_saltar": c["filas_a_saltar"],
+            "columnas_a_eliminar": c["columnas_a_eliminar"],
+            "mapeo_tipo_bien": c["mapeo_tipo_bien"],
+            "comprobantes_destino": c["comprobantes_destino"],
+            "comprobantes_fuente": c["comprobantes_fuente"],
+            "columnas_conservadas": sorted(set(c["columnas_finales"])),
+            "esquema": c["esquema"],
+        },
+        "funcion": _etapa_limpieza,
+    },
+    {
+        "nombre": "relacionamiento",
+        "entradas": ["partes"],
+        "salida": "df_relacionado",
+        "configuracion": lambda c: {"modo_relacion": c["modo_relacion"]},
+        "funcion": _etapa_relacionamiento,
+    },
+    {
+        "nombre": "organizacion",
+        "entradas": ["df_relacionado"],
+        "salida": "df_final",
+        "configuracion": lambda c: {
+            "columnas_finales": c["columnas_finales"],
+            "columnas_vacias_finales": c["columnas_vacias_finales"],
+        },
+        "funcion": _etapa_organizacion,
+    },
+]
+
+
+def _clave_etapa(etapa, configuracion_etapa, claves_entradas):
+    """SHA-256 del nombre de la etapa, su configuración y las claves de sus entradas."""
+    contenido = json.dumps(
+        {"etapa": etapa["nombre"], "configuracion": configuracion_etapa, "entradas": claves_entradas},
+        sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+def limpiar_memoria_etapas():
+    """Descarta todos los resultados de etapas guardados en memoria."""
+    with _candado_memoria:
+        _memoria_etapas.clear()
+
+
+def ejecutar_pipeline(archivo, configuracion=None, tamano_bloque=TAMANO_BLOQUE, ruta_cache=RUTA_CACHE_SIIGO,
+                      ruta_pendientes=None):
+    """
+    Ejecuta las etapas del procesamiento reutilizando los resultados guardados en memoria
+    de las etapas cuyas entradas y configuración no cambiaron.
+
+    Args:
+        archivo (str or file-like): Ruta o archivo .xlsx subido.
+        configuracion (dict, optional): Valores que reemplazan a los de CONFIGURACION_PIPELINE.
+        tamano_bloque (int): Filas por bloque en la lectura.
+        ruta_cache (str, optional): Carpeta de la caché en Parquet (ver cache_siigo.py); None la desactiva.
+        ruta_pendientes (str, optional): Carpeta del índice de documentos sin pareja de meses
+            anteriores (ver relacionar_con_meses_anteriores); None relaciona solo dentro del export.
+            Ese paso depende del índice en disco, así que ni él ni la organización final se memorizan.
+
+    Returns:
+        tuple: (pandas.DataFrame final, dict con el resumen). El resumen incluye
+            'etapas_calculadas' y 'etapas_memorizadas' con los nombres de las etapas.
+    """
+    configuracion_total = {**CONFIGURACION_PIPELINE, **(configuracion or {})}
+    # Las claves se calculan de adelante hacia atrás sin ejecutar nada. La del archivo
+    # (su SHA-256) es también la de la caché en Parquet, así que se calcula una sola vez
+    claves = {"archivo": huella_archivo(archivo)}
+    opciones = {"tamano_bloque": tamano_bloque, "ruta_cache": ruta_cache, "huella": claves["archivo"]}
+    etapa_por_salida = {}
+    for etapa in ETAPAS_PIPELINE:
+        configuracion_etapa = etapa["configuracion"](configuracion_total)
+        claves[etapa["salida"]] = _clave_etapa(etapa, configuracion_etapa, [claves[e] for e in etapa["entradas"]])
+        etapa_por_salida[etapa["salida"]] = (etapa, configuracion_etapa)
+
+    resumen = nuevo_resumen()
+    resumen["etapas_calculadas"] = []
+    resumen["etapas_memorizadas"] = []
+    valores = {"archivo": archivo}
+
+    def obtener(salida):
+        """Devuelve la salida pedida; solo ejecuta las etapas que no están en memoria."""
+        if salida in valores:
+            return valores[salida]
+
+        etapa, configuracion_etapa = etapa_por_salida[salida]
+        clave = claves[salida]
+        with _candado_memoria:
+            guardado = _memoria_etapas.get(clave)
+            if guardado is not None:
+                _memoria_etapas.move_to_end(clave)
+
+        if guardado is not None:
+            resultado, resumen_etapa = guardado
+            resumen["etapas_memorizadas"].append(etapa["nombre"])
+        else:
+            entradas = {nombre: obtener(nombre) for nombre in etapa["entradas"]}
+            resumen_inicial = nuevo_resumen()
+            resumen_propio = nuevo_resumen()
+            resultado = etapa["funcion"](entradas, configuracion_etapa, resumen_propio, opciones)
+            # Conteos de las etapas anteriores más los que llenó esta etapa, para que una
+            # etapa tomada de la memoria traiga el resumen completo hasta ese punto
+            resumen_etapa = {nombre: valor for nombre, valor in resumen.items() if nombre in resumen_inicial}
+            resumen_etapa.update({
+                nombre: valor for nombre, valor in resumen_propio.items()
+                if nombre not in resumen_inicial or valor != resumen_inicial[nombre]
+            })
+            resumen["etapas_calculadas"].append(etapa["nombre"])
+            with _candado_memoria:
+                _memoria_etapas[clave] = (resultado, resumen_etapa)
+                while len(_memoria_etapas) > MAX_RESULTADOS_EN_MEMORIA:
+                    _memoria_etapas.popitem(last=False)
+
+        resumen.update(resumen_etapa)
+        valores[salida] = resultado
+        return resultado
+
+    if ruta_pendientes is None:
+        df_final = obtener(ETAPAS_PIPELINE[-1]["salida"])
+    else:
+        df_relacionado = relacionar_con_meses_anteriores(
+            obtener("df_relacionado"), claves["archivo"], resumen, ruta_pendientes,
+            configuracion_total["comprobantes_destino"], configuracion_total["modo_relacion"]
+        )
+        df_final = organizar_columnas_finales(
+            df_relacionado, configuracion_total["columnas_finales"], configuracion_total["columnas_vacias_finales"]
+        )
+    # Copia para que los cambios de quien llama no alteren el resultado guardado en memoria
+    return df_final.copy(), resumen
+
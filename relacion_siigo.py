@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# RELACIONAMIENTO FV ↔ DS/FC CON ÍNDICE POR CÓDIGOS ENTEROS
+# ==============================================================================
+# Las claves de los dos lados (Identificación/Código contra NIT_relacion/Código)
+# se convierten una sola vez a un código entero por combinación, numerado en orden
+# lexicográfico. Con esos códigos se arma un índice directo sobre el lado DS/FC
+# (posición de inicio y cantidad de filas de cada clave), así que cada fila FV
+# encuentra sus parejas sin comparar textos. Antes de construir el resultado se
+# cuentan las filas por clave en cada lado, lo que permite reportar las claves
+# muchos-a-muchos y saber cuántas filas va a generar cada modo:
+#   'todos'      Todas las parejas, igual que el outer merge (puede multiplicar filas).
+#   'primero'    Cada FV toma la primera fila DS/FC de su clave.
+#   'uno_a_uno'  La n-ésima FV de una clave toma la n-ésima DS/FC de esa clave.
+# En todos los modos las filas de ambos lados que quedan sin pareja se conservan,
+# y el resultado sale ordenado por clave, como el de pd.merge(how='outer').
+MODOS_RELACION = ("todos", "primero", "uno_a_uno")
+MAX_CLAVES_REPORTADAS = 20  # Claves muchos-a-muchos que se listan en el reporte de cardinalidad
+
+
+def codificar_claves(claves_destino, claves_fuente):
+    """
+    Convierte las claves compuestas de ambos lados a códigos enteros compartidos.
+
+    Args:
+        claves_destino (pandas.DataFrame): Columnas de la clave en el lado FV.
+        claves_fuente (pandas.DataFrame): Columnas de la clave en el lado DS/FC, en el mismo orden.
+
+    Returns:
+        tuple: (códigos del destino, códigos de la fuente, número de claves distintas).
+            Los códigos van de 0 a n-1 en el orden lexicográfico de las claves.
+    """
+    num_destino = len(claves_destino)
+    combinados = np.zeros(num_destino + len(claves_fuente), dtype=np.int64)
+    for columna_destino, columna_fuente in zip(claves_destino.columns, claves_fuente.columns):
+        valores = pd.concat([claves_destino[columna_destino], claves_fuente[columna_fuente]], ignore_index=True)
+        codigos, unicos = pd.factorize(valores, sort=True)
+        # Los valores nulos (-1) van después de todos los demás, como en el orden de pd.merge
+        combinados = combinados * (len(unicos) + 1) + np.where(codigos < 0, len(unicos), codigos)
+    codigos, unicos = pd.factorize(combinados, sort=True)
+    return codigos[:num_destino], codigos[num_destino:], len(unicos)
+
+
+def _ordenar_por_codigo(codigos, num_claves):
+    """argsort estable; con el tipo entero más pequeño numpy usa radix sort (hasta 65.536 claves)."""
+    return np.argsort(codigos.astype(np.min_scalar_type(max(num_claves - 1, 0))), kind="stable")
+
+
+def indexar_fuente(codigos_fuente, num_claves):
+    """
+    Índice directo del lado DS/FC: las filas ordenadas por clave (estable) y, para cada
+    clave, dónde empiezan en ese orden y cuántas son.
+
+    Returns:
+        dict: 'orden', 'inicio' y 'conteo' (arreglos de numpy).
+    """
+    conteo = np.bincount(codigos_fuente, minlength=num_claves)
+    return {
+        "orden": _ordenar_por_codigo(codigos_fuente, num_claves),
+        "inicio": np.cumsum(conteo) - conteo,
+        "conteo": conteo,
+    }
+
+
+def _posicion_en_grupo(codigos, num_claves):
+    """Para cada fila, cuántas filas anteriores tienen el mismo código (cumcount)."""
+    orden = _ordenar_por_codigo(codigos, num_claves)
+    codigos_ordenados = codigos[orden]
+    inicio_grupo = np.r_[0, np.flatnonzero(np.diff(codigos_ordenados)) + 1]
+    tamanos = np.diff(np.r_[inicio_grupo, len(codigos)])
+    posicion = np.empty(len(codigos), dtype=np.int64)
+    posicion[orden] = np.arange(len(codigos)) - np.repeat(inicio_grupo, tamanos)
+    return posicion
+
+
+def emparejar(codigos_destino, indice, modo="todos"):
+    """
+    Calcula qué fila DS/FC acompaña a cada fila FV del resultado.
+
+    Args:
+        codigos_destino (numpy.ndarray): Código de clave de cada fila FV.
+        indice (dict): Resultado de indexar_fuente.
+        modo (str): Uno de MODOS_RELACION.
+
+    Returns:
+        tuple: (posiciones FV, posiciones DS/FC con -1 donde no hay pareja,
+            máscara de las filas DS/FC usadas).
+    """
+    if modo not in MODOS_RELACION:
+        raise ValueError(f"Modo de relacionamiento desconocido: '{modo}'. Opciones: {', '.join(MODOS_RELACION)}.")
+
+    conteo_fuente = indice["conteo"][codigos_destino]
+    inicio_fuente = indice["inicio"][codigos_destino]
+    usadas = np.zeros(len(indice["orden"]), dtype=bool)
+
+    if modo == "todos":
+        repeticiones = np.maximum(conteo_fuente, 1)
+        posiciones_destino = np.repeat(np.arange(len(codigos_destino)), repeticiones)
+        desplazamiento = np.arange(len(posiciones_destino)) - np.repeat(np.cumsum(repeticiones) - repeticiones, repeticiones)
+        con_pareja = np.repeat(conteo_fuente > 0, repeticiones)
+        posiciones_fuente = np.full(len(posiciones_destino), -1, dtype=np.int64)
+        posiciones_fuente[con_pareja] = indice["orden"][
+            np.repeat(inicio_fuente, repeticiones)[con_pareja] + desplazamiento[con_pareja]
+        ]
+    else:
+        posiciones_destino = np.arange(len(codigos_destino))
+        # 'primero' toma siempre la fila 0 del grupo; 'uno_a_uno' la fila n para la n-ésima FV
+        n = np.zeros(len(codigos_destino), dtype=np.int64) if modo == "primero" else _posicion_en_grupo(codigos_destino, len(indice["conteo"]))
+        con_pareja = n < conteo_fuente
+        posiciones_fuente = np.full(len(codigos_destino), -1, dtype=np.int64)
+        posiciones_fuente[con_pareja] = indice["orden"][inicio_fuente[con_pareja] + n[con_pareja]]
+
+    usadas[posiciones_fuente[posiciones_fuente >= 0]] = True
+    return posiciones_destino, posiciones_fuente, usadas
+
+
+def cardinalidad_claves(claves_destino, codigos_destino, codigos_fuente, num_claves, max_claves=MAX_CLAVES_REPORTADAS):
+    """
+    Cuenta las filas de cada clave en los dos lados sin construir el resultado.
+
+    Returns:
+        tuple: (dict con los totales, lista de registros de las claves muchos-a-muchos
+            con más parejas, hasta max_claves).
+    """
+    conteo_destino = np.bincount(codigos_destino, minlength=num_claves)
+    conteo_fuente = np.bincount(codigos_fuente, minlength=num_claves)
+    compartidas = (conteo_destino > 0) & (conteo_fuente > 0)
+    muchos_a_muchos = (conteo_destino > 1) & (conteo_fuente > 1)
+
+    totales = {
+        "claves_destino": int((conteo_destino > 0).sum()),
+        "claves_fuente": int((conteo_fuente > 0).sum()),
+        "claves_comunes": int(compartidas.sum()),
+        "claves_muchos_a_muchos": int(muchos_a_muchos.sum()),
+        "max_filas_fuente_por_clave": int(conteo_fuente.max()) if num_claves else 0,
+        # Filas que daría el modo 'todos' (outer merge)
+        "filas_todos": int(np.maximum(conteo_fuente[codigos_destino], 1).sum() + conteo_fuente[conteo_destino == 0].sum()),
+    }
+
+    pares = conteo_destino * conteo_fuente
+    claves_reportadas = np.flatnonzero(muchos_a_muchos)
+    claves_reportadas = claves_reportadas[np.argsort(-pares[claves_reportadas], kind="stable")][:max_claves]
+    # Primera fila FV de cada clave reportada, para mostrar sus valores
+    primera_fila = np.full(num_claves, -1, dtype=np.int64)
+    primera_fila[codigos_destino[::-1]] = np.arange(len(codigos_destino))[::-1]
+    registros = []
+    for clave in claves_reportadas:
+        registro = claves_destino.iloc[primera_fila[clave]].to_dict()
+        registro.update({
+            "filas_destino": int(conteo_destino[clave]),
+            "filas_fuente": int(conteo_fuente[clave]),
+            "pares": int(pares[clave]),
+        })
+        registros.append(registro)
+    return totales, registros
+
+
+def _tomar_filas(df, posiciones):
+    """df.take que acepta -1 (fila vacía con NaN), como las filas sin pareja del outer merge."""
+    return pd.DataFrame(
+        {columna: df[columna].array.take(posiciones, allow_fill=True) for columna in df.columns},
+        columns=df.columns
+    )
+
+
+def relacionar_documentos(df_destino, df_fuente, columnas_destino, columnas_fuente, modo="todos", indicador=None):
+    """
+    Relaciona las filas FV con las DS/FC por clave compuesta conservando las filas sin pareja.
+
+    Args:
+        df_destino (pandas.DataFrame): Documentos FV con las claves ya normalizadas.
+        df_fuente (pandas.DataFrame): Documentos DS/FC (con sus columnas ya prefijadas).
+        columnas_destino (list): Columnas de la clave en df_destino.
+        columnas_fuente (list): Columnas de la clave en df_fuente, en el mismo orden.
+        modo (str): Uno de MODOS_RELACION.
+        indicador (str, optional): Nombre de una columna que se agrega con 'ambos',
+            'solo_destino' o 'solo_fuente' (como indicator=True de pd.merge).
+
+    Returns:
+        tuple: (pandas.DataFrame relacionado con índice 0..n-1, dict con las estadísticas
+            del relacionamiento, lista con la cardinalidad de las claves muchos-a-muchos).
+    """
+    codigos_destino, codigos_fuente, num_claves = codificar_claves(df_destino[columnas_destino], df_fuente[columnas_fuente])
+    estadisticas, cardinalidad = cardinalidad_claves(df_destino[columnas_destino], codigos_destino, codigos_fuente, num_claves)
+
+    indice = indexar_fuente(codigos_fuente, num_claves)
+    posiciones_destino, posiciones_fuente, usadas = emparejar(codigos_destino, indice, modo)
+    sin_pareja = np.flatnonzero(~usadas)
+
+    # Filas FV (con o sin pareja) seguidas de las DS/FC sin usar, ordenadas por clave
+    codigos_resultado = np.concatenate([codigos_destino[posiciones_destino], codigos_fuente[sin_pareja]])
+    orden = _ordenar_por_codigo(codigos_resultado, num_claves)
+    todas_destino = np.concatenate([posiciones_destino, np.full(len(sin_pareja), -1, dtype=np.int64)])[orden]
+    todas_fuente = np.concatenate([posiciones_fuente, sin_pareja])[orden]
+
+    df_relacionado = pd.concat(
+        [_tomar_filas(df_destino, todas_destino), _tomar_filas(df_fuente, todas_fuente)], axis=1
+    )
+    if indicador is not None:
+        df_relacionado[indicador] = np.select(
+            [todas_destino < 0, todas_fuente < 0], ["solo_fuente", "solo_destino"], default="ambos"
+        )
+    estadisticas.update({
+        "modo": modo,
+        "filas_resultado": len(df_relacionado),
+        "filas_destino_con_pareja": int(np.unique(posiciones_destino[posiciones_fuente >= 0]).size),
+        "filas_fuente_con_pareja": int(usadas.sum()),
+    })
+    return df_relacionado, estadisticas, cardinalidad
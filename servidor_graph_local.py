@@ -0,0 +1,339 @@
+import argparse
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import openpyxl
+
+from escritor_xlsx import anexar_filas_xlsx, nombres_hojas
+
+# ==============================================================================
+# SERVIDOR LOCAL QUE IMITA LA PARTE DE GRAPH QUE USAN LOS ESCRITORES
+# ==============================================================================
+# Guarda libros .xlsx en memoria y responde, con las mismas rutas y formas JSON que
+# Microsoft Graph, lo necesario para probar y medir escritor_graph.py sin SharePoint:
+#   GET  /sites/{host}:/sites/{nombre}                      Id del sitio
+#   GET  /sites/{sitio}/drive/root:/{ruta}                  Metadatos (eTag, size)
+#   GET  /sites/{sitio}/drive/root:/{carpeta}:/children     Archivos de una carpeta
+#   GET  /sites/{sitio}/drive/root:/{ruta}:/content         Bytes del libro
+#   PUT  /sites/{sitio}/drive/root:/{ruta}:/content         Reemplaza el libro
+#   POST .../root:/{ruta}:/workbook/createSession           Sesión de libro
+#   POST .../root:/{ruta}:/workbook/closeSession
+#   GET  .../root:/{ruta}:/workbook/worksheets
+#   GET  .../root:/{ruta}:/workbook/worksheets/{hoja}/tables
+#   GET  .../root:/{ruta}:/workbook/tables/{tabla}/range
+#   POST .../root:/{ruta}:/workbook/tables/{tabla}/rows/add
+#   PATCH .../root:/{ruta}:/workbook/worksheets/{hoja}/range(address='A2:B3')  Solo numberFormat
+#   POST .../root:/{ruta}:/createUploadSession               Sesión de carga
+#   PUT/GET/DELETE /subidas/{id}                             Fragmentos, estado y cancelación
+# rows/add escribe las filas con escritor_xlsx.anexar_filas_xlsx al final de la
+# hoja, así que solo acepta la Tabla que este extiende y si termina en la última
+# fila de la hoja (el caso del TRM); Excel Online, en cambio, desplazaría lo que
+# haya debajo. El PATCH de numberFormat abre y guarda el libro con openpyxl (None
+# deja la celda como está), así las fechas que escritor_graph.py envía como número
+# de serie se releen como fechas, igual que en Excel. Cada cambio da un eTag nuevo.
+# Con tasa_errores_subida, una fracción de los fragmentos falla: la mitad con 503
+# antes de guardarlos y la otra mitad con 500 después de guardarlos (la respuesta
+# "se pierde"), para probar la reanudación de subida_sharepoint.py.
+# Uso:
+#   python servidor_graph_local.py --libro TRM4.xlsx --ruta "01 Archivos Area Administrativa/TRM4.xlsx"
+#   GRAPH_URL_BASE=http://127.0.0.1:8766/v1.0 python ...
+RAIZ_API = "/v1.0"
+
+PATRON_SITIO = re.compile(r"^/v1\.0/sites/([^/:]+):/sites/([^/]+)$")
+PATRON_ITEM = re.compile(r"^/v1\.0/sites/([^/]+)/drive/root:/(.+?)(?::(/.*))?$")
+PATRON_TABLAS_HOJA = re.compile(r"^/workbook/worksheets/([^/]+)/tables$")
+PATRON_TABLA = re.compile(r"^/workbook/tables/([^/]+)/(range|rows/add)$")
+PATRON_RANGO_HOJA = re.compile(r"^/workbook/worksheets/([^/]+)/range\(address='([^']+)'\)$")
+PATRON_SUBIDA = re.compile(r"^/subidas/([0-9a-f-]+)$")
+PATRON_RANGO_CONTENIDO = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class LibrosEnMemoria:
+    """Libros por ruta, con su eTag y las sesiones abiertas."""
+
+    def __init__(self):
+        self.contenidos = {}
+        self.etags = {}
+        self.sesiones = {}
+        self.subidas = {}
+        self.candado = threading.Lock()
+
+    def guardar(self, ruta, contenido):
+        self.contenidos[ruta] = contenido
+        self.etags[ruta] = f'"{{{uuid.uuid4()}}},1"'
+        return self.etags[ruta]
+
+    def tablas(self, ruta):
+        """{nombre de la Tabla: (hoja, ref)} del libro."""
+        libro = openpyxl.load_workbook(io.BytesIO(self.contenidos[ruta]))
+        return {nombre: (hoja.title, ref) for hoja in libro.worksheets for nombre, ref in hoja.tables.items()}
+
+
+def crear_manejador(libros, latencia=0.0, tasa_errores_subida=0.0):
+    """Construye la clase manejadora HTTP sobre los libros en memoria."""
+    estadisticas = {"peticiones": 0, "bytes_recibidos": 0, "bytes_enviados": 0, "filas_anadidas": 0,
+                    "fragmentos": 0, "errores_inyectados": 0}
+
+    class ManejadorGraph(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._atender("GET")
+
+        def do_PUT(self):
+            self._atender("PUT")
+
+        def do_POST(self):
+            self._atender("POST")
+
+        def do_PATCH(self):
+            self._atender("PATCH")
+
+        def do_DELETE(self):
+            self._atender("DELETE")
+
+        def _atender(self, metodo):
+            cuerpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with libros.candado:
+                estadisticas["peticiones"] += 1
+                estadisticas["bytes_recibidos"] += len(cuerpo)
+            if latencia:
+                time.sleep(latencia)
+
+            subida = PATRON_SUBIDA.match(urlparse(self.path).path)
+            if subida is not None:
+                with libros.candado:
+                    self._subida(metodo, subida.group(1), cuerpo)
+                return
+            sitio = PATRON_SITIO.match(urlparse(self.path).path)
+            if sitio is not None and metodo == "GET":
+                self._responder(200, {"id": f"{sitio.group(1)},{unquote(sitio.group(2))}"})
+                return
+            coincidencia = PATRON_ITEM.match(urlparse(self.path).path)
+            if coincidencia is None:
+                self._responder(404, {"error": {"code": "itemNotFound", "message": self.path}})
+                return
+            _, ruta, accion = coincidencia.groups()
+            ruta, accion = unquote(ruta), unquote(accion or "")
+
+            with libros.candado:
+                if metodo == "PUT" and accion == "/content":
+                    etag = libros.guardar(ruta, cuerpo)
+                    self._responder(200, {"name": ruta.split("/")[-1], "eTag": etag, "size": len(cuerpo)})
+                    return
+                if metodo == "POST" and accion == "/createUploadSession":
+                    id_subida = str(uuid.uuid4())
+                    libros.subidas[id_subida] = {"ruta": ruta, "recibido": bytearray()}
+                    self._responder(200, {"uploadUrl": f"http://{self.headers['Host']}/subidas/{id_subida}",
+                                          "nextExpectedRanges": ["0-"]})
+                    return
+                if metodo == "GET" and accion == "/children":
+                    prefijo = ruta.rstrip("/") + "/"
+                    self._responder(200, {"value": [
+                        {"name": r[len(prefijo):], "size": len(c), "eTag": libros.etags[r]}
+                        for r, c in libros.contenidos.items() if r.startswith(prefijo) and "/" not in r[len(prefijo):]
+                    ]})
+                    return
+                if ruta not in libros.contenidos:
+                    self._responder(404, {"error": {"code": "itemNotFound", "message": ruta}})
+                    return
+                if metodo == "GET" and accion == "":
+                    self._responder(200, {"name": ruta.split("/")[-1], "eTag": libros.etags[ruta],
+                                          "size": len(libros.contenidos[ruta])})
+                elif metodo == "GET" and accion == "/content":
+                    self._responder_bytes(libros.contenidos[ruta])
+                elif accion.startswith("/workbook"):
+                    self._libro(metodo, ruta, accion, cuerpo)
+                else:
+                    self._responder(400, {"error": {"code": "invalidRequest", "message": accion}})
+
+        def _libro(self, metodo, ruta, accion, cuerpo):
+            if metodo == "POST" and accion == "/workbook/createSession":
+                id_sesion = str(uuid.uuid4())
+                libros.sesiones[id_sesion] = ruta
+                self._responder(201, {"id": id_sesion, "persistChanges": True})
+                return
+            id_sesion = self.headers.get("workbook-session-id")
+            if id_sesion is not None and libros.sesiones.get(id_sesion) != ruta:
+                self._responder(404, {"error": {"code": "InvalidSessionReCreatable", "message": id_sesion}})
+                return
+            if metodo == "POST" and accion == "/workbook/closeSession":
+                libros.sesiones.pop(id_sesion, None)
+                self._responder(204, None)
+                return
+
+            if metodo == "GET" and accion == "/workbook/worksheets":
+                self._responder(200, {"value": [{"name": nombre, "position": posicion}
+                                                for posicion, nombre in enumerate(nombres_hojas(libros.contenidos[ruta]))]})
+                return
+            rango = PATRON_RANGO_HOJA.match(accion)
+            if metodo == "PATCH" and rango:
+                self._formato_rango(ruta, *rango.groups(), json.loads(cuerpo))
+                return
+            tablas = libros.tablas(ruta)
+            hoja = PATRON_TABLAS_HOJA.match(accion)
+            if metodo == "GET" and hoja:
+                nombre_hoja = hoja.group(1)
+                self._responder(200, {"value": [{"name": nombre} for nombre, (h, _) in tablas.items() if h == nombre_hoja]})
+                return
+            tabla = PATRON_TABLA.match(accion)
+            if tabla is None or tabla.group(1) not in tablas:
+                self._responder(404, {"error": {"code": "ItemNotFound", "message": accion}})
+                return
+            nombre_hoja, ref = tablas[tabla.group(1)]
+            if metodo == "GET" and tabla.group(2) == "range":
+                self._responder(200, {"address": f"{nombre_hoja}!{ref}"})
+            elif metodo == "POST" and tabla.group(2) == "rows/add":
+                valores = json.loads(cuerpo)["values"]
+                try:
+                    contenido, detalles = anexar_filas_xlsx(libros.contenidos[ruta], nombre_hoja, valores)
+                except ValueError as e:
+                    self._responder(400, {"error": {"code": "InvalidArgument", "message": str(e)}})
+                    return
+                # Excel Online añade justo debajo de la Tabla: aquí solo se acepta si esa es la última fila
+                if not any(ref_anterior == ref and int(re.search(r"\d+$", ref).group(0)) == detalles["primera_fila"] - 1
+                           for _, ref_anterior, _ in detalles["tablas"]):
+                    self._responder(400, {"error": {"code": "InvalidArgument",
+                                                    "message": "La Tabla no termina en la última fila de la hoja."}})
+                    return
+                libros.guardar(ruta, contenido)
+                estadisticas["filas_anadidas"] += len(valores)
+                self._responder(201, {"index": detalles["primera_fila"] - 2, "values": valores})
+            else:
+                self._responder(405, {"error": {"code": "MethodNotAllowed", "message": accion}})
+
+        def _formato_rango(self, ruta, nombre_hoja, direccion, propiedades):
+            libro = openpyxl.load_workbook(io.BytesIO(libros.contenidos[ruta]))
+            if nombre_hoja not in libro.sheetnames or set(propiedades) != {"numberFormat"}:
+                self._responder(400, {"error": {"code": "InvalidArgument", "message": "Solo se admite numberFormat."}})
+                return
+            celdas = libro[nombre_hoja][direccion]
+            formatos = propiedades["numberFormat"]
+            if len(formatos) != len(celdas) or any(len(f) != len(c) for f, c in zip(formatos, celdas)):
+                self._responder(400, {"error": {"code": "InvalidArgument",
+                                                "message": "numberFormat no tiene el tamaño del rango."}})
+                return
+            for fila_celdas, fila_formatos in zip(celdas, formatos):
+                for celda, formato in zip(fila_celdas, fila_formatos):
+                    if formato is not None:
+                        celda.number_format = formato
+            salida = io.BytesIO()
+            libro.save(salida)
+            libros.guardar(ruta, salida.getvalue())
+            self._responder(200, {"address": f"{nombre_hoja}!{direccion}", "numberFormat": formatos})
+
+        def _subida(self, metodo, id_subida, cuerpo):
+            subida = libros.subidas.get(id_subida)
+            if subida is None:
+                self._responder(404, {"error": {"code": "itemNotFound", "message": "Sesión de carga inexistente"}})
+                return
+            recibido = subida["recibido"]
+            if metodo == "DELETE":
+                libros.subidas.pop(id_subida)
+                self._responder(204, None)
+                return
+            if metodo == "GET":
+                self._responder(200, {"nextExpectedRanges": [f"{len(recibido)}-"]})
+                return
+
+            rango = PATRON_RANGO_CONTENIDO.match(self.headers.get("Content-Range", ""))
+            if metodo != "PUT" or rango is None:
+                self._responder(400, {"error": {"code": "invalidRequest", "message": "Falta Content-Range"}})
+                return
+            inicio, fin, total = (int(valor) for valor in rango.groups())
+            if inicio != len(recibido) or fin - inicio + 1 != len(cuerpo):
+                self._responder(416, {"error": {"code": "invalidRange", "message": "Rango inesperado"},
+                                      "nextExpectedRanges": [f"{len(recibido)}-"]})
+                return
+            estadisticas["fragmentos"] += 1
+            falla = tasa_errores_subida and random.random() < tasa_errores_subida
+            if falla and random.random() < 0.5:
+                estadisticas["errores_inyectados"] += 1
+                self._responder(503, {"error": {"code": "serviceNotAvailable", "message": "Error inyectado"}})
+                return
+            recibido.extend(cuerpo)
+            if falla:
+                estadisticas["errores_inyectados"] += 1
+                self._responder(500, {"error": {"code": "generalException", "message": "Error inyectado"}})
+                return
+            if len(recibido) < total:
+                self._responder(202, {"nextExpectedRanges": [f"{len(recibido)}-"]})
+                return
+            libros.subidas.pop(id_subida)
+            etag = libros.guardar(subida["ruta"], bytes(recibido))
+            self._responder(201, {"name": subida["ruta"].split("/")[-1], "eTag": etag, "size": total})
+
+        def _responder(self, codigo, cuerpo):
+            contenido = json.dumps(cuerpo).encode("utf-8") if cuerpo is not None else b""
+            self._enviar(codigo, contenido, "application/json; charset=utf-8")
+
+        def _responder_bytes(self, contenido):
+            self._enviar(200, contenido, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+        def _enviar(self, codigo, contenido, tipo):
+            estadisticas["bytes_enviados"] += len(contenido)
+            self.send_response(codigo)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, formato, *args):
+            pass  # Sin registro por petición para no distorsionar los benchmarks
+
+    ManejadorGraph.estadisticas = estadisticas
+    return ManejadorGraph
+
+
+def iniciar_servidor_graph(libros_iniciales=None, host="127.0.0.1", puerto=0, latencia=0.0, tasa_errores_subida=0.0):
+    """
+    Inicia el servidor en un hilo en segundo plano (útil para benchmarks y pruebas).
+
+    Args:
+        libros_iniciales (dict, optional): {ruta: bytes del .xlsx} con que arranca.
+        host (str): Interfaz de escucha.
+        puerto (int): Puerto; 0 elige uno libre.
+        latencia (float): Segundos de espera fijos por petición.
+        tasa_errores_subida (float): Fracción de fragmentos de sesiones de carga que fallan.
+
+    Returns:
+        tuple: (servidor, url_base, libros). url_base va en GRAPH_URL_BASE o en
+            base_url de escritor_graph; libros es el LibrosEnMemoria para revisar
+            los contenidos. Llamar servidor.shutdown() para detenerlo.
+    """
+    libros = LibrosEnMemoria()
+    for ruta, contenido in (libros_iniciales or {}).items():
+        libros.guardar(ruta, contenido)
+    servidor = ThreadingHTTPServer((host, puerto), crear_manejador(libros, latencia, tasa_errores_subida))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}{RAIZ_API}", libros
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de archivos y libros de Graph.")
+    parser.add_argument("--libro", help="Archivo .xlsx que se sirve al arrancar.")
+    parser.add_argument("--ruta", help="Ruta con que se publica --libro (por defecto, su nombre).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8766)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de latencia fija por petición.")
+    parser.add_argument("--tasa-errores-subida", type=float, default=0.0,
+                        help="Fracción de fragmentos de sesiones de carga que fallan.")
+    argumentos = parser.parse_args()
+
+    libros = LibrosEnMemoria()
+    if argumentos.libro:
+        with open(argumentos.libro, "rb") as archivo:
+            libros.guardar(argumentos.ruta or argumentos.libro.replace("\\", "/").split("/")[-1], archivo.read())
+    manejador = crear_manejador(libros, argumentos.latencia, argumentos.tasa_errores_subida)
+    servidor = ThreadingHTTPServer((argumentos.host, argumentos.puerto), manejador)
+    print(f"Sirviendo Graph en http://{argumentos.host}:{argumentos.puerto}{RAIZ_API} (Ctrl+C para detener)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Servidor detenido. Estadísticas: {manejador.estadisticas}")
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+# ==============================================================================
+# SERVIDOR LOCAL QUE IMITA EL RECURSO mcec-87by DE DATOS ABIERTOS
+# ==============================================================================
+# Sirve la TRM desde un archivo de fixture con el mismo esquema JSON que Socrata,
+# con latencia y errores configurables, para medir y probar la consulta de la TRM
+# sin red. Uso:
+#   python servidor_trm_local.py --puerto 8765 --latencia 0.15 --tasa-errores 0.05
+#   TRM_URL_BASE=http://127.0.0.1:8765/resource/mcec-87by.json streamlit run appSiigo.py
+RUTA_RECURSO = "/resource/mcec-87by.json"
+FIXTURE_POR_DEFECTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "trm_mcec-87by.json")
+
+PATRON_BETWEEN = re.compile(r"^(\w+)\s+between\s+'([^']*)'\s+and\s+'([^']*)'$", re.IGNORECASE)
+PATRON_COMPARACION = re.compile(r"^(\w+)\s*(<=|>=|=|<|>)\s*'([^']*)'$")
+COMPARADORES = {
+    "<=": lambda a, b: a <= b,
+    ">=": lambda a, b: a >= b,
+    "=": lambda a, b: a == b,
+    "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b,
+}
+
+
+def cargar_fixture(ruta_fixture):
+    """
+    Carga los registros de TRM del fixture: un arreglo JSON con el esquema de la API
+    (valor, unidad, vigenciadesde, vigenciahasta) o un CSV descargado de Datos Abiertos.
+
+    Returns:
+        list: Registros (dict) ordenados por 'vigenciadesde'.
+    """
+    if ruta_fixture.lower().endswith(".csv"):
+        df_csv = pd.read_csv(ruta_fixture, dtype=str)
+        df_csv.columns = [str(col).strip().lower() for col in df_csv.columns]
+        for columna in ["vigenciadesde", "vigenciahasta"]:
+            df_csv[columna] = pd.to_datetime(df_csv[columna], format='mixed').dt.strftime('%Y-%m-%dT00:00:00.000')
+        registros = df_csv.to_dict(orient="records")
+    else:
+        with open(ruta_fixture, encoding="utf-8") as archivo:
+            registros = json.load(archivo)
+    return sorted(registros, key=lambda registro: registro["vigenciadesde"])
+
+
+def _normalizar(valor):
+    """Las fechas se comparan sin milisegundos ('YYYY-MM-DDTHH:MM:SS')."""
+    return str(valor)[:19]
+
+
+def filtrar_registros(registros, where):
+    """
+    Aplica un subconjunto de SoQL: condiciones 'campo between a and b' y
+    'campo <op> valor' unidas con 'and'.
+    """
+    if not where:
+        return registros
+
+    condiciones = []
+    for parte in re.split(r"\s+and\s+(?=\w+\s*(?:<=|>=|=|<|>|\s+between))", where.strip(), flags=re.IGNORECASE):
+        coincidencia = PATRON_BETWEEN.match(parte.strip())
+        if coincidencia:
+            campo, desde, hasta = coincidencia.groups()
+            condiciones.append(lambda r, c=campo, d=_normalizar(desde), h=_normalizar(hasta): d <= _normalizar(r.get(c)) <= h)
+            continue
+        coincidencia = PATRON_COMPARACION.match(parte.strip())
+        if coincidencia:
+            campo, operador, valor = coincidencia.groups()
+            condiciones.append(lambda r, c=campo, o=COMPARADORES[operador], v=_normalizar(valor): o(_normalizar(r.get(c)), v))
+            continue
+        raise ValueError(f"Condición SoQL no soportada: {parte}")
+
+    return [registro for registro in registros if all(condicion(registro) for condicion in condiciones)]
+
+
+def consultar_registros(registros, parametros):
+    """Resuelve una consulta de la API (filtros, $where, $order, $offset, $limit y $select)."""
+    resultado = registros
+
+    # Filtros simples por igualdad, p. ej. ?vigenciadesde=2025-01-02T00:00:00.000
+    for campo, valor in parametros.items():
+        if not campo.startswith("$"):
+            resultado = [r for r in resultado if _normalizar(r.get(campo)) == _normalizar(valor)]
+
+    resultado = filtrar_registros(resultado, parametros.get("$where"))
+
+    if "$order" in parametros:
+        campo_orden, *direccion = parametros["$order"].split()
+        descendente = bool(direccion) and direccion[0].upper() == "DESC"
+        resultado = sorted(resultado, key=lambda r: r.get(campo_orden, ""), reverse=descendente)
+
+    offset = int(parametros.get("$offset", 0))
+    limite = int(parametros.get("$limit", 1000))
+    resultado = resultado[offset:offset + limite]
+
+    if "$select" in parametros:
+        campos = [campo.strip() for campo in parametros["$select"].split(",")]
+        resultado = [{campo: r[campo] for campo in campos if campo in r} for r in resultado]
+    return resultado
+
+
+def crear_manejador(registros, latencia=0.0, jitter=0.0, tasa_errores=0.0, codigos_error=(429, 503)):
+    """Construye la clase manejadora HTTP con la configuración del servidor."""
+    estadisticas = {"peticiones": 0, "errores_inyectados": 0}
+    candado = threading.Lock()
+
+    class ManejadorTRM(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            with candado:
+                estadisticas["peticiones"] += 1
+
+            if latencia or jitter:
+                time.sleep(latencia + random.uniform(0, jitter))
+
+            if url.path != RUTA_RECURSO:
+                self._responder(404, {"error": True, "message": f"Recurso no encontrado: {url.path}"})
+                return
+
+            if tasa_errores and random.random() < tasa_errores:
+                with candado:
+                    estadisticas["errores_inyectados"] += 1
+                codigo = random.choice(codigos_error)
+                self._responder(codigo, {"error": True, "message": "Error inyectado"}, {"Retry-After": "0"})
+                return
+
+            parametros = {clave: valores[-1] for clave, valores in parse_qs(url.query).items()}
+            try:
+                self._responder(200, consultar_registros(registros, parametros))
+            except (ValueError, KeyError) as e:
+                self._responder(400, {"error": True, "message": str(e)})
+
+        def _responder(self, codigo, cuerpo, encabezados=None):
+            contenido = json.dumps(cuerpo).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(contenido)))
+            for nombre, valor in (encabezados or {}).items():
+                self.send_header(nombre, valor)
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, formato, *args):
+            pass  # Sin registro por petición para no distorsionar los benchmarks
+
+    ManejadorTRM.estadisticas = estadisticas
+    return ManejadorTRM
+
+
+def iniciar_servidor_trm(ruta_fixture=FIXTURE_POR_DEFECTO, host="127.0.0.1", puerto=0, latencia=0.0,
+                         jitter=0.0, tasa_errores=0.0):
+    """
+    Inicia el servidor en un hilo en segundo plano (útil para benchmarks y pruebas).
+
+    Args:
+        ruta_fixture (str): Archivo JSON o CSV con los registros de TRM.
+        host (str): Interfaz de escucha.
+        puerto (int): Puerto; 0 elige uno libre.
+        latencia (float): Segundos de espera fijos por petición.
+        jitter (float): Segundos adicionales aleatorios (0 a jitter) por petición.
+        tasa_errores (float): Fracción de peticiones que responden 429/503.
+
+    Returns:
+        tuple: (servidor, url_base). Llamar servidor.shutdown() para detenerlo.
+            Las estadísticas quedan en servidor.RequestHandlerClass.estadisticas.
+    """
+    manejador = crear_manejador(cargar_fixture(ruta_fixture), latencia, jitter, tasa_errores)
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}{RUTA_RECURSO}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que imita el recurso mcec-87by (TRM) de Datos Abiertos.")
+    parser.add_argument("--fixture", default=FIXTURE_POR_DEFECTO, help="Archivo JSON o CSV con los registros de TRM.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de latencia fija por petición.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Segundos de latencia aleatoria adicional.")
+    parser.add_argument("--tasa-errores", type=float, default=0.0, help="Fracción de peticiones que fallan con 429/503.")
+    argumentos = parser.parse_args()
+
+    manejador = crear_manejador(cargar_fixture(argumentos.fixture), argumentos.latencia, argumentos.jitter, argumentos.tasa_errores)
+    servidor = ThreadingHTTPServer((argumentos.host, argumentos.puerto), manejador)
+    print(f"Sirviendo TRM en http://{argumentos.host}:{argumentos.puerto}{RUTA_RECURSO} (Ctrl+C para detener)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Servidor detenido. Estadísticas: {manejador.estadisticas}")
@@ -0,0 +1,166 @@
+import io
+import os
+import random
+import tempfile
+import time
+from urllib.parse import quote
+
+import requests
+
+from escritor_graph import URL_GRAPH
+
+# ==============================================================================
+# SUBIDA DE LIBROS A SHAREPOINT POR FRAGMENTOS (createUploadSession)
+# ==============================================================================
+# Los libros se subían con un solo PUT a /content con todo el .xlsx en memoria
+# (output.getvalue() es una segunda copia del BytesIO), y ese PUT falla por encima
+# del límite de subida simple de Graph y, si la red se corta, se reenvía completo.
+# Ahora el libro se escribe en un archivo temporal (SpooledTemporaryFile: en
+# memoria hasta MAX_MEMORIA_SUBIDA y en disco por encima) y, si pasa de
+# LIMITE_SUBIDA_SIMPLE, se sube con una sesión de carga en fragmentos de
+# TAMANO_FRAGMENTO_SUBIDA leídos del archivo. Si un fragmento falla, se le pregunta
+# a la sesión qué rangos le faltan (nextExpectedRanges) y se sigue desde ahí, sin
+# reenviar lo que ya recibió. Los libros pequeños siguen yendo en un solo PUT.
+LIMITE_SUBIDA_SIMPLE = int(os.environ.get("SIIGO_LIMITE_SUBIDA_SIMPLE", 4 * 1024 * 1024))
+MULTIPLO_FRAGMENTO = 320 * 1024  # Graph exige fragmentos múltiplos de 320 KiB
+TAMANO_FRAGMENTO_SUBIDA = int(os.environ.get("SIIGO_FRAGMENTO_SUBIDA", 16 * MULTIPLO_FRAGMENTO))  # 5 MiB
+MAX_MEMORIA_SUBIDA = 32 * 1024 * 1024
+MAX_REINTENTOS_SUBIDA = 5           # Reintentos seguidos de un fragmento antes de abandonar la sesión
+ESPERA_BASE_REINTENTO_SUBIDA = 1.0  # Segundos; se duplica en cada reintento (con jitter)
+CODIGOS_REINTENTABLES_SUBIDA = {408, 429, 500, 502, 503, 504}
+TIMEOUT_SUBIDA = 120
+
+
+def archivo_temporal_subida():
+    """Archivo donde se escribe el libro antes de subirlo (en memoria hasta MAX_MEMORIA_SUBIDA)."""
+    return tempfile.SpooledTemporaryFile(max_size=MAX_MEMORIA_SUBIDA)
+
+
+def _url_item(site_id, ruta_archivo, base_url):
+    return f"{base_url}/sites/{site_id}/drive/root:/{quote(ruta_archivo)}:"
+
+
+def crear_sesion_subida(headers, site_id, ruta_archivo, base_url=URL_GRAPH):
+    """
+    Crea una sesión de carga que reemplaza el archivo al terminar.
+
+    Returns:
+        str: uploadUrl de la sesión (ya autorizada; no lleva el token).
+    """
+    response = requests.post(
+        f"{_url_item(site_id, ruta_archivo, base_url)}/createUploadSession",
+        json={"item": {"@microsoft.graph.conflictBehavior": "replace"}},
+        headers=headers,
+        timeout=TIMEOUT_SUBIDA,
+    )
+    response.raise_for_status()
+    return response.json()["uploadUrl"]
+
+
+def _siguiente_inicio(estado, por_defecto):
+    """Primer byte que la sesión espera, según 'nextExpectedRanges' (p. ej. ['26214400-'])."""
+    rangos = estado.get("nextExpectedRanges") or []
+    if not rangos:
+        return por_defecto
+    return int(str(rangos[0]).split("-")[0])
+
+
+def _consultar_sesion(upload_url, por_defecto):
+    """Pregunta a la sesión desde qué byte seguir; si no responde, se sigue desde por_defecto."""
+    try:
+        response = requests.get(upload_url, timeout=TIMEOUT_SUBIDA)
+        if response.status_code == 200:
+            return _siguiente_inicio(response.json(), por_defecto)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"No se pudo consultar la sesión de carga: {e}")
+    return por_defecto
+
+
+def subir_por_fragmentos(headers, site_id, ruta_archivo, archivo, tamano, tamano_fragmento=TAMANO_FRAGMENTO_SUBIDA,
+                         base_url=URL_GRAPH):
+    """
+    Sube un archivo con una sesión de carga, fragmento por fragmento y reanudando tras un error.
+
+    Args:
+        headers (dict): Encabezados con el token de Graph (solo para crear la sesión).
+        site_id (str): Id del sitio de SharePoint.
+        ruta_archivo (str): Ruta de destino en la biblioteca del sitio.
+        archivo: Archivo binario con posicionamiento (seek/read).
+        tamano (int): Bytes a subir.
+        tamano_fragmento (int): Bytes por PUT; se redondea a un múltiplo de 320 KiB.
+        base_url (str): Raíz de la API de Graph.
+
+    Returns:
+        requests.Response: Respuesta del último fragmento, con el driveItem (y su eTag).
+
+    Raises:
+        requests.exceptions.RequestException: Si un fragmento sigue fallando después de
+            MAX_REINTENTOS_SUBIDA reintentos o la sesión se rechaza (p. ej. expiró).
+    """
+    tamano_fragmento = max(MULTIPLO_FRAGMENTO, tamano_fragmento // MULTIPLO_FRAGMENTO * MULTIPLO_FRAGMENTO)
+    upload_url = crear_sesion_subida(headers, site_id, ruta_archivo, base_url)
+    inicio, reintentos = 0, 0
+    try:
+        while True:
+            archivo.seek(inicio)
+            fragmento = archivo.read(min(tamano_fragmento, tamano - inicio))
+            fin = inicio + len(fragmento) - 1
+            try:
+                response = requests.put(
+                    upload_url,
+                    data=fragmento,
+                    headers={"Content-Length": str(len(fragmento)), "Content-Range": f"bytes {inicio}-{fin}/{tamano}"},
+                    timeout=TIMEOUT_SUBIDA,
+                )
+                if response.status_code in (200, 201):
+                    return response
+                if response.status_code == 202:
+                    inicio, reintentos = _siguiente_inicio(response.json(), fin + 1), 0
+                    continue
+                if response.status_code not in CODIGOS_REINTENTABLES_SUBIDA and response.status_code != 416:
+                    response.raise_for_status()
+                error = requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+
+            reintentos += 1
+            if reintentos > MAX_REINTENTOS_SUBIDA:
+                raise error
+            time.sleep(random.uniform(0, ESPERA_BASE_REINTENTO_SUBIDA * (2 ** (reintentos - 1))))
+            # El fragmento pudo llegar aunque la respuesta no: se sigue desde lo que falta
+            inicio = _consultar_sesion(upload_url, inicio)
+    except Exception:
+        try:
+            requests.delete(upload_url, timeout=TIMEOUT_SUBIDA)  # Libera la sesión incompleta
+        except requests.exceptions.RequestException:
+            pass
+        raise
+
+
+def subir_archivo_sharepoint(headers, site_id, ruta_archivo, archivo, base_url=URL_GRAPH):
+    """
+    Sube (reemplazando) un archivo a SharePoint: en un solo PUT si es pequeño y por
+    fragmentos con sesión de carga si pasa de LIMITE_SUBIDA_SIMPLE.
+
+    Args:
+        headers (dict): Encabezados con el token de Graph.
+        site_id (str): Id del sitio de SharePoint.
+        ruta_archivo (str): Ruta de destino en la biblioteca del sitio.
+        archivo (bytes or file): Contenido, o archivo binario (p. ej. el de
+            archivo_temporal_subida) que se lee desde el inicio.
+        base_url (str): Raíz de la API de Graph.
+
+    Returns:
+        requests.Response: Respuesta con el driveItem subido (ver indice_huellas.etag_respuesta).
+    """
+    if isinstance(archivo, (bytes, bytearray, memoryview)):
+        archivo = io.BytesIO(archivo)
+    tamano = archivo.seek(0, io.SEEK_END)
+    archivo.seek(0)
+
+    if tamano <= LIMITE_SUBIDA_SIMPLE:
+        response = requests.put(f"{_url_item(site_id, ruta_archivo, base_url)}/content", data=archivo.read(),
+                                headers=headers)
+        response.raise_for_status()
+        return response
+    return subir_por_fragmentos(headers, site_id, ruta_archivo, archivo, tamano, base_url=base_url)
@@ -0,0 +1,428 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+import requests
+from datetime import timedelta
+from requests.adapters import HTTPAdapter
+
+from almacen_trm import RUTA_ALMACEN_TRM, cargar_trm_almacen, guardar_trm_almacen, rango_sincronizado
+
+# ==============================================================================
+# CONSULTA DE LA TRM EN BLOQUE (DATOS ABIERTOS COLOMBIA - RECURSO mcec-87by)
+# ==============================================================================
+# Se puede apuntar a otro servidor (p. ej. servidor_trm_local.py) con la variable TRM_URL_BASE
+URL_BASE_TRM = os.environ.get("TRM_URL_BASE", "https://www.datos.gov.co/resource/mcec-87by.json")
+LIMITE_POR_PAGINA = 5000     # Máximo de registros que se piden a Socrata por página
+MAX_DIAS_POR_CONSULTA = 366  # Los rangos muy largos se parten en varias consultas
+
+# "rango": una consulta por tramo de fechas (por defecto).
+# "concurrente": una consulta por fecha, en paralelo y con límite de tasa.
+# En ambos modos, las fechas que siguen sin TRM se piden en paralelo por fecha.
+MODO_CONSULTA_TRM = os.environ.get("TRM_MODO_CONSULTA", "rango")
+MAX_PETICIONES_EN_VUELO = 8        # Peticiones simultáneas como máximo
+PETICIONES_POR_SEGUNDO = 10        # Ritmo sostenido del limitador de tasa
+MAX_REINTENTOS = 4                 # Reintentos ante 429/5xx o errores de conexión
+ESPERA_BASE_REINTENTO = 0.5        # Segundos; se duplica en cada reintento (con jitter)
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+def obtener_trm_rango(fecha_inicio, fecha_fin, base_url=URL_BASE_TRM, timeout=30):
+    """
+    Consulta en bloque todas las TRM cuya vigencia ('vigenciadesde' a 'vigenciahasta')
+    se cruza con el rango de fechas. Así se incluye también la TRM publicada antes del
+    rango que sigue vigente en sus primeros días (fines de semana y festivos).
+
+    Args:
+        fecha_inicio (datetime): Primera fecha del rango (incluida).
+        fecha_fin (datetime): Última fecha del rango (incluida).
+        base_url (str): URL del recurso mcec-87by.
+        timeout (int): Segundos de espera máximos por petición.
+
+    Returns:
+        pandas.DataFrame: Columnas 'vigenciadesde', 'vigenciahasta' (fechas) y 'valor' (float),
+        ordenadas por 'vigenciadesde'.
+
+    Raises:
+        requests.exceptions.RequestException: Si falla la conexión o la respuesta HTTP.
+    """
+    condicion = (
+        f"vigenciahasta >= '{fecha_inicio:%Y-%m-%d}T00:00:00' "
+        f"and vigenciadesde <= '{fecha_fin:%Y-%m-%d}T00:00:00'"
+    )
+    registros = []
+    offset = 0
+
+    # Socrata pagina los resultados, así que pedimos páginas hasta que llegue una incompleta
+    while True:
+        params = {
+            "$select": "valor,vigenciadesde,vigenciahasta",
+            "$where": condicion,
+            "$order": "vigenciadesde",
+            "$limit": LIMITE_POR_PAGINA,
+            "$offset": offset,
+        }
+        response = requests.get(base_url, params=params, timeout=timeout)
+        response.raise_for_status()
+        pagina = response.json()
+        registros.extend(pagina)
+
+        if len(pagina) < LIMITE_POR_PAGINA:
+            break
+        offset += LIMITE_POR_PAGINA
+
+    df_trm = pd.DataFrame(registros, columns=["vigenciadesde", "vigenciahasta", "valor"])
+    df_trm["vigenciadesde"] = pd.to_datetime(df_trm["vigenciadesde"], errors='coerce').dt.normalize()
+    df_trm["vigenciahasta"] = pd.to_datetime(df_trm["vigenciahasta"], errors='coerce').dt.normalize()
+    df_trm["valor"] = pd.to_numeric(df_trm["valor"], errors='coerce')
+    df_trm = df_trm.dropna(subset=["vigenciadesde", "valor"])
+
+    return df_trm.sort_values("vigenciadesde").reset_index(drop=True)
+
+
+# ==============================================================================
+# CONSULTA CONCURRENTE POR FECHA (POOL DE HILOS + LIMITADOR DE TASA)
+# ==============================================================================
+class LimitadorTasa:
+    """
+    Limitador de tasa tipo "token bucket", compartido por todos los hilos: permite
+    ráfagas de hasta 'capacidad' peticiones y un ritmo sostenido de 'tasa' por segundo.
+    """
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else max(1, tasa))
+        self.fichas = self.capacidad
+        self.ultima_recarga = time.monotonic()
+        self.candado = threading.Lock()
+
+    def esperar_turno(self):
+        """Bloquea el hilo hasta que haya una ficha disponible y la consume."""
+        while True:
+            with self.candado:
+                ahora = time.monotonic()
+                self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultima_recarga) * self.tasa)
+                self.ultima_recarga = ahora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) / self.tasa
+            time.sleep(espera)
+
+
+def crear_sesion_trm(max_en_vuelo=MAX_PETICIONES_EN_VUELO):
+    """Crea una requests.Session con un pool de conexiones del tamaño del pool de hilos."""
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max_en_vuelo)
+    sesion.mount("https://", adaptador)
+    sesion.mount("http://", adaptador)
+    return sesion
+
+
+def _consultar_vigencia_fecha(sesion, limitador, fecha, base_url, timeout=10):
+    """
+    Consulta la vigencia de TRM que cubre una fecha, reintentando con espera
+    exponencial y jitter ante respuestas 429/5xx o errores de conexión.
+    """
+    fecha_texto = f"{fecha:%Y-%m-%d}T00:00:00"
+    params = {
+        "$select": "valor,vigenciadesde,vigenciahasta",
+        "$where": f"vigenciadesde <= '{fecha_texto}' and vigenciahasta >= '{fecha_texto}'",
+        "$order": "vigenciadesde DESC",
+        "$limit": 1,
+    }
+
+    for intento in range(MAX_REINTENTOS + 1):
+        limitador.esperar_turno()
+        try:
+            response = sesion.get(base_url, params=params, timeout=timeout)
+            if response.status_code not in CODIGOS_REINTENTABLES:
+                response.raise_for_status()
+                return response.json()
+            espera_servidor = response.headers.get("Retry-After")
+            error = requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            espera_servidor = None
+            error = e
+
+        if intento == MAX_REINTENTOS:
+            raise error
+
+        # Espera exponencial con jitter completo; se respeta Retry-After si el servidor lo envía
+        espera = random.uniform(0, ESPERA_BASE_REINTENTO * (2 ** intento))
+        if espera_servidor is not None and str(espera_servidor).isdigit():
+            espera = max(espera, float(espera_servidor))
+        time.sleep(espera)
+
+
+def descargar_trm_concurrente(fechas, base_url=URL_BASE_TRM, max_en_vuelo=MAX_PETICIONES_EN_VUELO,
+                              peticiones_por_segundo=PETICIONES_POR_SEGUNDO, progreso=None):
+    """
+    Descarga en paralelo la vigencia de TRM de cada fecha, con un pool de hilos
+    acotado, una sesión HTTP compartida y un limitador de tasa común.
+
+    Args:
+        fechas (iterable): Fechas normalizadas a consultar.
+        base_url (str): URL del recurso mcec-87by.
+        max_en_vuelo (int): Máximo de peticiones simultáneas.
+        peticiones_por_segundo (float): Ritmo máximo sostenido de peticiones.
+        progreso (callable, optional): Se llama como progreso(completadas, total) desde
+            el hilo que invoca esta función, a medida que terminan las consultas.
+
+    Returns:
+        pandas.DataFrame: Columnas 'vigenciadesde', 'vigenciahasta' y 'valor'.
+    """
+    fechas = list(pd.DatetimeIndex(fechas).unique())
+    total = len(fechas)
+    registros = []
+    if total == 0:
+        return pd.DataFrame(columns=["vigenciadesde", "vigenciahasta", "valor"])
+
+    limitador = LimitadorTasa(peticiones_por_segundo)
+    with crear_sesion_trm(max_en_vuelo) as sesion, ThreadPoolExecutor(max_workers=max_en_vuelo) as pool:
+        futuros = {pool.submit(_consultar_vigencia_fecha, sesion, limitador, fecha, base_url): fecha for fecha in fechas}
+        for completadas, futuro in enumerate(as_completed(futuros), start=1):
+            fecha = futuros[futuro]
+            try:
+                registros.extend(futuro.result())
+            except requests.exceptions.RequestException as e:
+                print(f"Error de conexión o HTTP al consultar Datos Abiertos para {fecha:%Y-%m-%d}: {e}")
+            except (ValueError, TypeError) as e:
+                print(f"Error al parsear los datos de la TRM para {fecha:%Y-%m-%d}: {e}")
+            if progreso is not None:
+                progreso(completadas, total)
+
+    df_trm = pd.DataFrame(registros, columns=["vigenciadesde", "vigenciahasta", "valor"])
+    df_trm["vigenciadesde"] = pd.to_datetime(df_trm["vigenciadesde"], errors='coerce').dt.normalize()
+    df_trm["vigenciahasta"] = pd.to_datetime(df_trm["vigenciahasta"], errors='coerce').dt.normalize()
+    df_trm["valor"] = pd.to_numeric(df_trm["valor"], errors='coerce')
+    df_trm = df_trm.dropna(subset=["vigenciadesde", "valor"]).drop_duplicates(subset=["vigenciadesde"])
+    return df_trm.sort_values("vigenciadesde").reset_index(drop=True)
+
+
+def partir_en_tramos(fecha_inicio, fecha_fin):
+    """Parte un rango en tramos consecutivos (inicio, fin) de hasta MAX_DIAS_POR_CONSULTA días."""
+    tramos = []
+    inicio_tramo = fecha_inicio
+    while inicio_tramo <= fecha_fin:
+        fin_tramo = min(inicio_tramo + timedelta(days=MAX_DIAS_POR_CONSULTA - 1), fecha_fin)
+        tramos.append((inicio_tramo, fin_tramo))
+        inicio_tramo = fin_tramo + timedelta(days=1)
+    return tramos
+
+
+def _descargar_tramo(inicio_tramo, fin_tramo, base_url):
+    """obtener_trm_rango que informa el error por consola y devuelve None si el tramo falla."""
+    try:
+        return obtener_trm_rango(inicio_tramo, fin_tramo, base_url=base_url)
+    except requests.exceptions.RequestException as e:
+        print(f"Error de conexión o HTTP al consultar Datos Abiertos entre {inicio_tramo:%Y-%m-%d} y {fin_tramo:%Y-%m-%d}: {e}")
+    except (ValueError, TypeError) as e:
+        print(f"Error al parsear los datos de la TRM entre {inicio_tramo:%Y-%m-%d} y {fin_tramo:%Y-%m-%d}: {e}")
+    return None
+
+
+def descargar_trm_por_tramos(fecha_inicio, fecha_fin, base_url=URL_BASE_TRM):
+    """
+    Descarga las TRM de un rango partiéndolo en tramos de hasta MAX_DIAS_POR_CONSULTA
+    días. Los tramos que fallen se informan por consola y se omiten.
+
+    Args:
+        fecha_inicio (datetime): Primera fecha del rango (incluida).
+        fecha_fin (datetime): Última fecha del rango (incluida).
+        base_url (str): URL del recurso mcec-87by.
+
+    Returns:
+        pandas.DataFrame: Columnas 'vigenciadesde', 'vigenciahasta' y 'valor'.
+    """
+    tramos = [
+        df_tramo for df_tramo in (_descargar_tramo(inicio, fin, base_url) for inicio, fin in partir_en_tramos(fecha_inicio, fecha_fin))
+        if df_tramo is not None
+    ]
+    if not tramos:
+        return pd.DataFrame(columns=["vigenciadesde", "vigenciahasta", "valor"])
+    return pd.concat(tramos, ignore_index=True).drop_duplicates(subset=["vigenciadesde"], keep="last")
+
+
+def sincronizar_almacen_trm(fecha_fin, fecha_inicio=None, base_url=URL_BASE_TRM, ruta_almacen=RUTA_ALMACEN_TRM):
+    """
+    Completa el almacén local con las TRM que le faltan entre 'fecha_inicio' y 'fecha_fin'.
+    Solo se descargan las fechas fuera del tramo sincronizado (ver
+    almacen_trm.rango_sincronizado): hacia atrás desde su inicio y hacia adelante desde
+    su final. Cada tramo descargado amplía el tramo sincronizado en la misma
+    transacción en que se guarda; si uno falla se para en ese lado, para no marcar
+    como sincronizado un hueco. Las TRM sueltas guardadas por fecha no cuentan.
+
+    Args:
+        fecha_fin (datetime): Fecha hasta la que debe quedar sincronizado el almacén.
+        fecha_inicio (datetime, optional): Fecha desde la que se necesitan datos.
+        base_url (str): URL del recurso mcec-87by.
+        ruta_almacen (str): Ruta del archivo SQLite.
+
+    Returns:
+        int: Número de registros descargados y guardados.
+    """
+    # No tiene sentido pedir fechas futuras: todavía no hay TRM publicada para ellas
+    fecha_fin = min(pd.Timestamp(fecha_fin).normalize(), pd.Timestamp.today().normalize())
+    fecha_inicio = fecha_fin if fecha_inicio is None else pd.Timestamp(fecha_inicio).normalize()
+    if fecha_inicio > fecha_fin:
+        return 0
+    desde_sincronizado, hasta_sincronizado = rango_sincronizado(ruta_almacen)
+
+    if desde_sincronizado is None:
+        # Almacén nuevo o de una versión anterior (sin tramo): se descarga todo lo pedido
+        tramos_atras, tramos_adelante = [], partir_en_tramos(fecha_inicio, fecha_fin)
+    else:
+        # Los tramos anteriores se piden del más reciente al más antiguo para que cada uno toque al sincronizado
+        tramos_atras = partir_en_tramos(fecha_inicio, desde_sincronizado - timedelta(days=1))[::-1]
+        tramos_adelante = partir_en_tramos(hasta_sincronizado + timedelta(days=1), fecha_fin)
+
+    total_guardados = 0
+    for tramos in (tramos_atras, tramos_adelante):
+        for inicio, fin in tramos:
+            df_tramo = _descargar_tramo(inicio, fin, base_url)
+            if df_tramo is None or df_tramo.empty:
+                break
+            # Lo que todavía no se publicó (p. ej. la TRM de hoy) no queda marcado como sincronizado
+            cubierto_hasta = min(fin, df_tramo["vigenciahasta"].fillna(df_tramo["vigenciadesde"]).max())
+            total_guardados += guardar_trm_almacen(df_tramo, ruta_almacen, tramo_sincronizado=(inicio, cubierto_hasta))
+            if cubierto_hasta < fin:
+                break
+    return total_guardados
+
+
+def resolver_trm_por_vigencia(fechas, df_trm):
+    """
+    Asigna a cada fecha la TRM vigente con una búsqueda ordenada (merge_asof): la
+    última publicación con 'vigenciadesde' anterior o igual a la fecha, siempre que
+    la fecha no supere su 'vigenciahasta'. Los fines de semana y festivos toman así
+    la TRM publicada el día hábil anterior, sin peticiones adicionales.
+
+    Args:
+        fechas (iterable): Fechas normalizadas a resolver.
+        df_trm (pandas.DataFrame): Vigencias con 'vigenciadesde', 'vigenciahasta' y 'valor'.
+
+    Returns:
+        pandas.Series: TRM (float) indexada por fecha. Las fechas sin TRM vigente no aparecen.
+    """
+    consulta = pd.DataFrame({"fecha": pd.DatetimeIndex(fechas).unique().sort_values()})
+    if consulta.empty or df_trm.empty:
+        return pd.Series(dtype=float)
+
+    vigencias = df_trm[["vigenciadesde", "vigenciahasta", "valor"]].copy()
+    vigencias["vigenciadesde"] = pd.to_datetime(vigencias["vigenciadesde"]).astype(consulta["fecha"].dtype)
+    vigencias["vigenciahasta"] = pd.to_datetime(vigencias["vigenciahasta"]).astype(consulta["fecha"].dtype)
+    vigencias = vigencias.sort_values("vigenciadesde")
+
+    unido = pd.merge_asof(consulta, vigencias, left_on="fecha", right_on="vigenciadesde", direction="backward")
+
+    # Sin 'vigenciahasta' conocida solo se acepta la coincidencia exacta
+    fin_vigencia = unido["vigenciahasta"].fillna(unido["vigenciadesde"])
+    vigente = unido["valor"].notna() & (unido["fecha"] <= fin_vigencia)
+
+    trm_por_fecha = pd.Series(unido.loc[vigente, "valor"].astype(float).values, index=unido.loc[vigente, "fecha"].values)
+    trm_por_fecha.index.name = None
+    return trm_por_fecha
+
+
+def obtener_trm_por_fechas(fechas, base_url=URL_BASE_TRM, ruta_almacen=RUTA_ALMACEN_TRM,
+                           modo=MODO_CONSULTA_TRM, progreso=None):
+    """
+    Obtiene la TRM vigente para un conjunto de fechas. Las vigencias ya guardadas en
+    el almacén local se leen de disco sin peticiones. En modo "rango" el resto se
+    consulta por tramos de hasta MAX_DIAS_POR_CONSULTA días, en lugar de una petición
+    por fecha. Las fechas que aun así quedan sin TRM (o todas las faltantes, en modo
+    "concurrente") se piden una por una en paralelo con descargar_trm_concurrente.
+
+    Args:
+        fechas (iterable): Fechas (datetime, Timestamp o texto 'YYYY-MM-DD') a resolver.
+        base_url (str): URL del recurso mcec-87by.
+        ruta_almacen (str or None): Ruta del almacén SQLite. Con None no se usa almacén.
+        modo (str): "rango" o "concurrente" (ver MODO_CONSULTA_TRM).
+        progreso (callable, optional): progreso(completadas, total) de las consultas por fecha.
+
+    Returns:
+        pandas.Series: TRM (float) indexada por fecha normalizada. Las fechas sin TRM
+        vigente publicada en Datos Abiertos no aparecen en el índice.
+    """
+    fechas = pd.to_datetime(pd.Series(list(fechas), dtype=object), errors='coerce').dropna().dt.normalize()
+    if fechas.empty:
+        return pd.Series(dtype=float)
+
+    fecha_min = fechas.min()
+    fecha_max = fechas.max()
+
+    df_trm = None
+    if ruta_almacen is not None:
+        try:
+            if modo == "rango":
+                sincronizar_almacen_trm(fecha_max, fecha_min, base_url=base_url, ruta_almacen=ruta_almacen)
+            df_trm = cargar_trm_almacen(fecha_min, fecha_max, ruta_almacen=ruta_almacen)
+        except sqlite3.Error as e:
+            print(f"No se pudo usar el almacén local de TRM '{ruta_almacen}': {e}. Se consultará Datos Abiertos directamente.")
+            ruta_almacen = None
+
+    if df_trm is None:
+        if modo == "rango":
+            df_trm = descargar_trm_por_tramos(fecha_min, fecha_max, base_url=base_url)
+        else:
+            df_trm = pd.DataFrame(columns=["vigenciadesde", "vigenciahasta", "valor"])
+
+    trm_por_fecha = resolver_trm_por_vigencia(fechas, df_trm)
+
+    # Las fechas pasadas que siguen sin TRM sí necesitan la red: se piden en paralelo
+    fechas_pendientes = pd.DatetimeIndex(fechas.unique())
+    fechas_pendientes = fechas_pendientes[
+        ~fechas_pendientes.isin(trm_por_fecha.index) & (fechas_pendientes <= pd.Timestamp.today().normalize())
+    ]
+    if len(fechas_pendientes):
+        df_nuevas = descargar_trm_concurrente(fechas_pendientes, base_url=base_url, progreso=progreso)
+        if ruta_almacen is not None:
+            guardar_trm_almacen(df_nuevas, ruta_almacen)
+        if not df_nuevas.empty:
+            df_trm = pd.concat([df for df in [df_trm, df_nuevas] if not df.empty], ignore_index=True)
+            trm_por_fecha = resolver_trm_por_vigencia(fechas, df_trm.drop_duplicates(subset=["vigenciadesde"], keep="last"))
+
+    return trm_por_fecha
+
+
+def rellenar_tasa_de_cambio(df, columna_tasa="Tasa de cambio", columna_fecha="Fecha elaboración",
+                            formato_fecha='%d/%m/%Y', resolver_trm=obtener_trm_por_fechas):
+    """
+    Rellena en el mismo DataFrame las celdas vacías o en 0 de la tasa de cambio con
+    la TRM de su fecha, usando operaciones por columna: una máscara de filas sin tasa,
+    una Serie fecha -> TRM y una única asignación con .map.
+
+    Args:
+        df (pandas.DataFrame): Datos a actualizar (se modifican en el mismo objeto).
+        columna_tasa (str): Columna con la tasa de cambio.
+        columna_fecha (str): Columna con la fecha del documento.
+        formato_fecha (str): Formato de la fecha cuando viene como texto.
+        resolver_trm (callable): Recibe las fechas distintas y devuelve una Serie fecha -> TRM.
+
+    Returns:
+        dict: 'fechas_consultadas', 'filas_rellenadas' y 'filas_sin_trm'.
+    """
+    fechas = pd.to_datetime(df[columna_fecha], format=formato_fecha, errors='coerce').dt.normalize()
+    tasa = pd.to_numeric(df[columna_tasa], errors='coerce')
+
+    # 1. Máscara de filas con tasa vacía o en 0 y fecha válida
+    mascara_sin_tasa = (tasa.isna() | (tasa == 0)) & fechas.notna()
+    fechas_sin_tasa = fechas[mascara_sin_tasa]
+    fechas_distintas = fechas_sin_tasa.unique()
+
+    # 2. Serie fecha -> TRM con una sola consulta para todas las fechas distintas
+    trm_por_fecha = resolver_trm(fechas_distintas) if len(fechas_distintas) else pd.Series(dtype=float)
+
+    # 3. Asignación vectorizada solo donde se encontró TRM
+    trm_asignada = fechas_sin_tasa.map(trm_por_fecha).dropna()
+    df.loc[trm_asignada.index, columna_tasa] = trm_asignada
+
+    return {
+        "fechas_consultadas": len(fechas_distintas),
+        "filas_rellenadas": len(trm_asignada),
+        "filas_sin_trm": int(mascara_sin_tasa.sum()) - len(trm_asignada),
+    }